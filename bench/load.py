@@ -0,0 +1,433 @@
+#!/usr/bin/python
+'''
+Run the application from server.py in this process against a
+temporary MEI_DIRECTORY of synthetic documents, and drive it with
+simulated editors: each opens a random document, then fetches it
+again, edits it or uploads a new document, in the given proportions,
+until the time is up. Reports the throughput and latency percentiles
+of each route.
+
+    python bench/load.py --editors 50 --documents 20 --duration 30 --mix file=20,edit=75,upload=5
+
+Configuration values can be overridden for a run, e.g.
+--set WRITE_BEHIND=True --set EDIT_WORKERS=8. The server runs in a
+thread of its own, but shares the interpreter with the editors, so
+absolute numbers are lower than those of a server on its own.
+'''
+
+import argparse
+import ast
+import imp
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import uuid
+import xml.etree.ElementTree as ET
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from bench import synthetic
+
+DOCUMENT_TYPE = "squarenote"
+
+BBOX = {"ulx": "100", "uly": "100", "lrx": "130", "lry": "160"}
+
+def load_conf(overrides):
+    '''
+    Import conf, from conf.py.dist if there is no conf.py, and
+    override the given values before the server modules read them.
+    '''
+
+    try:
+        import conf
+    except ImportError:
+        conf = imp.load_source("conf", os.path.join(ROOT, "conf.py.dist"))
+    for name, value in overrides.items():
+        setattr(conf, name, value)
+    return conf
+
+def parse_set(value):
+    name, sep, value = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError("expected NAME=VALUE")
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+def parse_weights(value):
+    weights = {}
+    for item in value.split(","):
+        name, sep, weight = item.partition("=")
+        if name not in ("file", "edit", "upload") or not sep:
+            raise argparse.ArgumentTypeError("expected file=N,edit=N,upload=N")
+        weights[name] = float(weight)
+    return weights
+
+def choose(rng, weights):
+    total = sum(weights.values())
+    x = rng.uniform(0, total)
+    for name, weight in sorted(weights.items()):
+        x -= weight
+        if x <= 0:
+            return name
+    return name
+
+class Structure(object):
+    '''
+    The ids of the elements of a generated document that editors
+    refer to. Editors never delete these, so they stay valid.
+    '''
+
+    def __init__(self, text):
+        root = ET.fromstring(text)
+        ns = "{%s}" % synthetic.MEI_NS
+
+        def ids(parent, name):
+            return [e.get(synthetic.XML_ID) for e in parent.iter(ns + name)]
+
+        self.staves = []
+        for layer in root.iter(ns + "layer"):
+            neumes = []
+            for neume in layer.iter(ns + "neume"):
+                neumes.append((neume.get(synthetic.XML_ID), len(list(neume.iter(ns + "note")))))
+            self.staves.append({
+                "neumes": neumes,
+                "clef": ids(layer, "clef")[0],
+                "custos": ids(layer, "custos")[0],
+                "sb": ids(layer, "sb")[0]
+            })
+        self.systems = ids(root, "system")
+
+class Stats(object):
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route, seconds, ok):
+        self.latencies.setdefault(route, []).append(seconds)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, duration):
+        def percentile(times, p):
+            return times[min(len(times) - 1, int(len(times) * p / 100.0))]
+
+        routes = {}
+        for route, times in self.latencies.items():
+            times = sorted(times)
+            routes[route] = {
+                "requests": len(times),
+                "errors": self.errors.get(route, 0),
+                "throughput": len(times) / duration,
+                "mean": sum(times) / len(times),
+                "p50": percentile(times, 50),
+                "p95": percentile(times, 95),
+                "p99": percentile(times, 99),
+                "max": times[-1]
+            }
+
+        total = sum(len(times) for times in self.latencies.values())
+        return {
+            "duration": duration,
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput": total / duration,
+            "routes": routes
+        }
+
+class Editor(object):
+    '''
+    A simulated user of the editor. Edits only remove or regroup
+    elements the editor added itself, so editors working on the
+    same document do not get in each other's way.
+    '''
+
+    def __init__(self, n, load):
+        self.n = n
+        self.load = load
+        self.rng = random.Random(load.args.seed * 1000 + n)
+        self.uploads = 0
+
+    @gen.coroutine
+    def fetch(self, route, path, body=None, headers=None):
+        started = time.time()
+        response = yield AsyncHTTPClient().fetch(self.load.url + path, method="POST" if body is not None else "GET",
+                                                 body=body, headers=headers, raise_error=False,
+                                                 request_timeout=600)
+        self.load.stats.record(route, time.time() - started, response.code < 400)
+        raise gen.Return(response)
+
+    @gen.coroutine
+    def edit(self, route, **args):
+        path = "/edit/%s/%s" % (urllib.quote(self.document), route)
+        response = yield self.fetch("POST edit/" + route, path, urllib.urlencode(args))
+        if response.code < 400 and response.body:
+            raise gen.Return(json.loads(response.body))
+
+    @gen.coroutine
+    def open(self):
+        self.document = self.rng.choice(self.load.documents)
+        self.structure = self.load.structures[self.document]
+        # puncta, grouped neumes and divisions this editor added
+        self.puncta = []
+        self.groups = []
+        self.divisions = []
+        yield self.fetch("GET file", "/file/" + urllib.quote(self.document))
+
+    def staff(self):
+        return self.rng.choice(self.structure.staves)
+
+    def neume(self):
+        return self.rng.choice(self.staff()["neumes"])[0]
+
+    @gen.coroutine
+    def insert_neume(self):
+        result = yield self.edit("insert/neume", beforeid=self.neume(), pname="g", oct="3", **BBOX)
+        if result:
+            self.puncta.append(result["id"])
+
+    @gen.coroutine
+    def run_edit(self):
+        kind = self.rng.choice(("insert_neume", "move_neume", "headshape", "dot", "neumify", "ungroup",
+                                "delete_neume", "division", "clef", "custos", "systembreak", "system_zone", "batch"))
+
+        if kind in ("move_neume", "headshape", "dot", "delete_neume") and not self.puncta:
+            kind = "insert_neume"
+        if kind == "neumify" and len(self.puncta) < 2:
+            kind = "insert_neume"
+        if kind == "ungroup" and not self.groups:
+            kind = "neumify" if len(self.puncta) >= 2 else "insert_neume"
+
+        if kind == "insert_neume":
+            yield self.insert_neume()
+        elif kind == "move_neume":
+            data = dict(BBOX, id=self.rng.choice(self.puncta), beforeid=self.neume(), pitchInfo=[{"pname": "a", "oct": "3"}])
+            yield self.edit("move/neume", data=json.dumps(data))
+        elif kind == "headshape":
+            yield self.edit("update/neume/headshape", id=self.rng.choice(self.puncta), shape="punctum_inclinatum", **BBOX)
+        elif kind == "dot":
+            punctum = self.rng.choice(self.puncta)
+            yield self.edit("insert/dot", id=punctum, dotform="aug", **BBOX)
+            yield self.edit("delete/dot", id=punctum, **BBOX)
+        elif kind == "neumify":
+            nids = [self.puncta.pop(), self.puncta.pop()]
+            data = dict(BBOX, nids=",".join(nids), typeid="clivis", headShapes=["punctum", "punctum"])
+            result = yield self.edit("neumify", data=json.dumps(data))
+            if result:
+                self.groups.append(result["id"])
+        elif kind == "ungroup":
+            data = {"nids": self.groups.pop(), "bbs": [[BBOX, BBOX]]}
+            result = yield self.edit("ungroup", data=json.dumps(data))
+            if result:
+                self.puncta.extend(result["nids"][0])
+        elif kind == "delete_neume":
+            yield self.edit("delete/neume", ids=self.puncta.pop())
+        elif kind == "division":
+            if self.divisions:
+                yield self.edit("delete/division", ids=self.divisions.pop())
+            else:
+                result = yield self.edit("insert/division", beforeid=self.neume(), type="minor", **BBOX)
+                if result:
+                    self.divisions.append(result["id"])
+        elif kind == "clef":
+            # the client sends the pitches of everything on the staff
+            staff = self.staff()
+            pitch_info = [{"id": id, "noteInfo": [{"pname": "a", "oct": "3"}] * notes} for id, notes in staff["neumes"]]
+            pitch_info.append({"id": staff["custos"], "noteInfo": {"pname": "a", "oct": "3"}})
+            data = dict(BBOX, id=staff["clef"], line="3", pitchInfo=pitch_info)
+            yield self.edit("move/clef", data=json.dumps(data))
+        elif kind == "custos":
+            yield self.edit("move/custos", id=self.staff()["custos"], pname="b", oct="3", **BBOX)
+        elif kind == "systembreak":
+            yield self.edit("modify/systembreak", sbid=self.staff()["sb"], ordernumber="1")
+        elif kind == "system_zone":
+            yield self.edit("update/system/zone", sid=self.rng.choice(self.structure.systems), **BBOX)
+        elif kind == "batch":
+            ops = [{"method": "insert_punctum", "args": [self.neume(), "g", "3", None, "100", "100", "130", "160"]}
+                   for i in range(3)]
+            result = yield self.edit("batch", data=json.dumps(ops))
+            if result:
+                self.puncta.extend(r["id"] for r in result["results"])
+
+    @gen.coroutine
+    def upload(self):
+        self.uploads += 1
+        boundary = uuid.uuid4().hex
+        filename = "upload-%d-%d-%s.mei" % (self.n, self.uploads, boundary[:8])
+        body = "\r\n".join([
+            "--" + boundary,
+            'Content-Disposition: form-data; name="document_type"',
+            "",
+            DOCUMENT_TYPE,
+            "--" + boundary,
+            'Content-Disposition: form-data; name="mei"; filename="%s"' % filename,
+            "Content-Type: text/xml",
+            "",
+            self.load.upload_data,
+            "--" + boundary + "--",
+            ""
+        ])
+        yield self.fetch("POST upload", "/", body, {"Content-Type": "multipart/form-data; boundary=" + boundary})
+
+    @gen.coroutine
+    def run(self, deadline):
+        yield self.open()
+        while time.time() < deadline:
+            if self.load.args.think:
+                yield gen.sleep(self.rng.expovariate(1.0 / self.load.args.think))
+
+            action = choose(self.rng, self.load.args.mix)
+            if action == "file":
+                # now and then, move on to another document
+                if self.rng.random() < 0.5:
+                    yield self.open()
+                else:
+                    yield self.fetch("GET file", "/file/" + urllib.quote(self.document))
+            elif action == "edit":
+                yield self.run_edit()
+            else:
+                yield self.upload()
+
+class Load(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.stats = Stats()
+        self.documents = []
+        self.structures = {}
+
+    def make_documents(self, directory):
+        # the upload page lists both document types
+        for document_type in (DOCUMENT_TYPE, "cheironomic"):
+            os.makedirs(os.path.join(directory, document_type, "backup"))
+        for i in range(self.args.documents):
+            name = "%s/page%03d.mei" % (DOCUMENT_TYPE, i + 1)
+            text = synthetic.generate(systems=self.args.systems, neumes=self.args.neumes,
+                                      notes=self.args.notes, seed=i)
+            fp = open(os.path.join(directory, name), "w")
+            fp.write(text)
+            fp.close()
+            self.documents.append(name)
+            self.structures[name] = Structure(text)
+
+        self.upload_data = synthetic.generate(systems=2, neumes=self.args.neumes, notes=self.args.notes)
+
+    def start_server(self, server):
+        '''
+        Serve the application from server.py on a port of its own,
+        in a thread with its own IOLoop.
+        '''
+
+        settings = dict(server.settings, autoreload=False, debug=False,
+                        visible_pages=["demo.html", "index.html"], default="demo.html")
+        application = tornado.web.Application(server.rules, **settings)
+        sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+        self.url = "http://127.0.0.1:%d%s" % (sockets[0].getsockname()[1], server.conf.APP_ROOT.rstrip("/"))
+
+        self.server_loop = tornado.ioloop.IOLoop(make_current=False)
+        documents = server.neonsrv.tornadoapi.documents
+
+        def serve():
+            self.server_loop.make_current()
+            http_server = tornado.httpserver.HTTPServer(application)
+            http_server.add_sockets(sockets)
+            if documents.write_behind:
+                flush_due = lambda: server.neonsrv.tornadoapi.flush_documents(documents.due())
+                tornado.ioloop.PeriodicCallback(flush_due, 250).start()
+            self.server_loop.start()
+            http_server.stop()
+
+        self.server_thread = threading.Thread(target=serve)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def stop_server(self, server):
+        self.server_loop.add_callback(self.server_loop.stop)
+        self.server_thread.join()
+
+        server.neonsrv.tornadoapi.executor.shutdown()
+        server.neonsrv.interface.tile_executor.shutdown()
+        server.neonsrv.interface.derivative_jobs.shutdown()
+        server.neonsrv.tornadoapi.documents.flush_all()
+
+    @gen.coroutine
+    def run(self):
+        AsyncHTTPClient.configure(None, max_clients=self.args.editors)
+        started = time.time()
+        deadline = started + self.args.duration
+        yield [Editor(n, self).run(deadline) for n in range(self.args.editors)]
+        raise gen.Return(time.time() - started)
+
+def print_report(report):
+    print "%-32s %9s %7s %9s %9s %9s %9s %9s" % ("route", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms")
+    for route, r in sorted(report["routes"].items()):
+        print "%-32s %9d %7d %9.1f %9.1f %9.1f %9.1f %9.1f" % (route, r["requests"], r["errors"], r["throughput"],
+                                                              r["p50"] * 1000, r["p95"] * 1000, r["p99"] * 1000, r["max"] * 1000)
+    print "%-32s %9d %7d %9.1f" % ("total", report["requests"], report["errors"], report["throughput"])
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--editors", type=int, default=20, help="simulated editors working at the same time")
+    parser.add_argument("--documents", type=int, default=10, help="documents they work on")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run for")
+    parser.add_argument("--think", type=float, default=0, help="mean seconds each editor waits between requests")
+    parser.add_argument("--mix", type=parse_weights, default=parse_weights("file=20,edit=75,upload=5"),
+                        help="proportions of file fetches, edits and uploads")
+    parser.add_argument("--systems", type=int, default=9, help="systems per document")
+    parser.add_argument("--neumes", type=int, default=20, help="neumes per staff")
+    parser.add_argument("--notes", type=int, default=3, help="notes per neume")
+    parser.add_argument("--set", type=parse_set, action="append", default=[], metavar="NAME=VALUE",
+                        help="override a configuration value")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+
+    directory = tempfile.mkdtemp()
+    try:
+        load = Load(args)
+        load.make_documents(directory)
+
+        overrides = dict(args.set)
+        overrides["MEI_DIRECTORY"] = directory
+        load_conf(overrides)
+        import server
+
+        load.start_server(server)
+        try:
+            duration = tornado.ioloop.IOLoop.current().run_sync(load.run)
+        finally:
+            load.stop_server(server)
+
+        report = load.stats.report(duration)
+        report["server"] = {
+            "cache": server.neonsrv.tornadoapi.documents.stats(),
+            "executor": server.neonsrv.tornadoapi.executor.stats()
+        }
+    finally:
+        shutil.rmtree(directory)
+
+    if args.json:
+        print json.dumps(report, indent=1, sort_keys=True)
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,227 @@
+#!/usr/bin/python
+'''
+Time every ModifyDocument operation, and parsing and writing out,
+on synthetic documents of each combination of the given sizes.
+Prints the results as JSON, including for each operation the
+exponent of its median time in the number of elements when more
+than one size is run: around 1 for operations that scale linearly
+with the document, around 0 for those that do not depend on it.
+
+    python bench/modifydocument.py --systems 4 16 64 --neumes 20 --repeat 5
+'''
+
+import argparse
+import itertools
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bench import synthetic
+from neonsrv.modifymei import ModifyDocument
+
+BBOX = ("100", "100", "130", "160")
+
+def staves(md):
+    '''
+    Return the layers of the staves of the document, in order.
+    '''
+
+    layers = []
+    for section_id in md.sections:
+        for staff_id in md.staves[section_id].ids:
+            layers.extend(md.get_element(staff_id).getChildrenByName("layer"))
+    return layers
+
+def layer(md, i):
+    # staves are picked in turn, so repetitions touch different ones
+    layers = staves(md)
+    return layers[i % len(layers)]
+
+def neume(md, i, offset=0):
+    neumes = layer(md, i).getChildrenByName("neume")
+    return neumes[min(len(neumes) // 2 + offset, len(neumes) - 1)]
+
+def clef(md, i):
+    return layer(md, i).getChildrenByName("clef")[0]
+
+def pitch_info(md, i):
+    '''
+    Return the pitches of every neume and custos on a staff, which
+    the client sends with clef operations.
+    '''
+
+    info = []
+    for e in layer(md, i).getChildren():
+        if e.getName() == "neume":
+            info.append({"id": e.getId(), "noteInfo": [{"pname": "a", "oct": "3"} for n in e.getDescendantsByName("note")]})
+        elif e.getName() == "custos":
+            info.append({"id": e.getId(), "noteInfo": {"pname": "a", "oct": "3"}})
+    return info
+
+def ids(md, name, i):
+    elements = md.mei.getElementsByName(name)
+    return elements[i % len(elements)].getId()
+
+def final_division(md, i):
+    # set up a final division to move or delete
+    return md.apply("insert_division", neume(md, i).getId(), "final", *BBOX)["id"]
+
+def punctum(md, i, dot_form=None):
+    return md.apply("insert_punctum", neume(md, i).getId(), "g", "3", dot_form, *BBOX)["id"]
+
+# name -> function(md, i) returning the operation and its arguments.
+# The functions may change the document to set up the operation;
+# only the operation is timed.
+CASES = [
+    ("insert_punctum", lambda md, i: ("insert_punctum", neume(md, i).getId(), "g", "3", None) + BBOX),
+    ("insert_punctum_last", lambda md, i: ("insert_punctum", None, "g", "3", "aug") + BBOX),
+    ("move_neume", lambda md, i: ("move_neume", neume(md, i).getId(), neume(md, i + 1).getId(),
+                                  [{"pname": "c", "oct": "4"}] * len(neume(md, i).getDescendantsByName("note"))) + BBOX),
+    ("delete_neume", lambda md, i: ("delete_neume", [neume(md, i).getId()])),
+    ("update_neume_head_shape", lambda md, i: ("update_neume_head_shape", neume(md, i).getId(), "punctum_inclinatum") + BBOX),
+    ("neumify", lambda md, i: ("neumify", [neume(md, i).getId(), neume(md, i, 1).getId()], "torculus", None,
+                               ["punctum"] * (len(neume(md, i).getDescendantsByName("note")) +
+                                              len(neume(md, i, 1).getDescendantsByName("note")))) + BBOX),
+    ("ungroup", lambda md, i: ("ungroup", [neume(md, i).getId()],
+                               [[dict(zip(("ulx", "uly", "lrx", "lry"), BBOX))] * len(neume(md, i).getDescendantsByName("note"))])),
+    ("insert_division", lambda md, i: ("insert_division", neume(md, i).getId(), "minor") + BBOX),
+    ("insert_division_final", lambda md, i: ("insert_division", neume(md, i).getId(), "final") + BBOX),
+    ("move_division", lambda md, i: ("move_division", ids(md, "division", i), neume(md, i + 1).getId()) + BBOX),
+    ("move_division_final", lambda md, i: ("move_division", final_division(md, i), neume(md, i + 2).getId()) + BBOX),
+    ("delete_division", lambda md, i: ("delete_division", [ids(md, "division", i)])),
+    ("delete_division_final", lambda md, i: ("delete_division", [final_division(md, i)])),
+    ("add_dot", lambda md, i: ("add_dot", punctum(md, i), "aug") + BBOX),
+    ("delete_dot", lambda md, i: ("delete_dot", punctum(md, i, "aug")) + BBOX),
+    ("insert_clef", lambda md, i: ("insert_clef", "3", "f", pitch_info(md, i), neume(md, i).getId()) + BBOX),
+    ("move_clef", lambda md, i: ("move_clef", clef(md, i).getId(), "2", pitch_info(md, i)) + BBOX),
+    ("update_clef_shape", lambda md, i: ("update_clef_shape", clef(md, i).getId(), "f", pitch_info(md, i)) + BBOX),
+    ("delete_clef", lambda md, i: ("delete_clef", [{"id": clef(md, i).getId(), "pitchInfo": pitch_info(md, i)}])),
+    ("insert_custos", lambda md, i: ("insert_custos", "a", "3", neume(md, i).getId()) + BBOX),
+    ("move_custos", lambda md, i: ("move_custos", ids(md, "custos", i), "b", "3") + BBOX),
+    ("delete_custos", lambda md, i: ("delete_custos", [ids(md, "custos", i)])),
+    ("insert_system", lambda md, i: ("insert_system", ids(md, "page", 0)) + BBOX),
+    ("insert_system_break", lambda md, i: ("insert_system_break", ids(md, "system", i), i + 1, ids(md, "sb", i))),
+    ("modify_system_break", lambda md, i: ("modify_system_break", ids(md, "sb", i), "5")),
+    ("delete_system", lambda md, i: ("delete_system", [ids(md, "system", i)])),
+    ("delete_system_break", lambda md, i: ("delete_system_break", [ids(md, "sb", i)])),
+    ("update_system_zone", lambda md, i: ("update_system_zone", ids(md, "system", i)) + BBOX),
+]
+
+def summary(times):
+    times = sorted(times)
+    return {
+        "runs": len(times),
+        "min": times[0],
+        "median": times[len(times) // 2],
+        "mean": sum(times) / len(times),
+        "max": times[-1]
+    }
+
+def timed(fn, *args, **kwargs):
+    started = time.time()
+    result = fn(*args, **kwargs)
+    return time.time() - started, result
+
+def run_size(directory, params, repeat):
+    '''
+    Time parsing, each operation and writing out on one document size.
+    '''
+
+    path = os.path.join(directory, "doc.mei")
+    synthetic.write(path, **params)
+    size = os.path.getsize(path)
+
+    parse = []
+    for r in range(repeat):
+        seconds, md = timed(ModifyDocument, path)
+        parse.append(seconds)
+
+    result = {
+        "params": params,
+        "bytes": size,
+        "elements": len(md.index),
+        "operations": {}
+    }
+
+    for name, case in CASES:
+        # a fresh document for each operation, so earlier operations
+        # do not change the document the next one works on
+        md = ModifyDocument(path)
+        times = []
+        for i in range(repeat):
+            args = case(md, i)
+            seconds, r = timed(md.apply, *args)
+            times.append(seconds)
+        result["operations"][name] = summary(times)
+
+    # the write_doc round trip: numbering the staves, serializing,
+    # and parsing the written file again
+    write = []
+    read = []
+    md = ModifyDocument(path)
+    final_division(md, 0)
+    for r in range(repeat):
+        seconds, _ = timed(md.write_doc)
+        write.append(seconds)
+        seconds, md = timed(ModifyDocument, path)
+        read.append(seconds)
+
+    result["operations"]["parse"] = summary(parse)
+    result["operations"]["write_doc"] = summary(write)
+    result["operations"]["write_doc_reparse"] = summary(read)
+    return result
+
+def exponent(points):
+    '''
+    Least squares slope of log(time) against log(elements).
+    '''
+
+    points = [(math.log(x), math.log(y)) for x, y in points if x > 0 and y > 0]
+    if len(points) < 2:
+        return None
+    mx = sum(x for x, y in points) / len(points)
+    my = sum(y for x, y in points) / len(points)
+    var = sum((x - mx) ** 2 for x, y in points)
+    if var == 0:
+        return None
+    return sum((x - mx) * (y - my) for x, y in points) / var
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--systems", type=int, nargs="+", default=[4, 16, 64], help="systems (and staves) per document")
+    parser.add_argument("--neumes", type=int, nargs="+", default=[20], help="neumes per staff")
+    parser.add_argument("--notes", type=int, nargs="+", default=[3], help="notes per neume")
+    parser.add_argument("--zones", type=int, nargs="+", default=[0], help="extra zones no element refers to")
+    parser.add_argument("--repeat", type=int, default=5, help="times to run each operation per size")
+    parser.add_argument("--output", help="file to write the results to instead of stdout")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        sizes = []
+        for systems, neumes, notes, zones in itertools.product(args.systems, args.neumes, args.notes, args.zones):
+            params = {"systems": systems, "neumes": neumes, "notes": notes, "extra_zones": zones}
+            sys.stderr.write("%s\n" % json.dumps(params, sort_keys=True))
+            sizes.append(run_size(directory, params, args.repeat))
+    finally:
+        shutil.rmtree(directory)
+
+    results = {"repeat": args.repeat, "sizes": sizes, "exponents": {}}
+    for name in sizes[0]["operations"]:
+        results["exponents"][name] = exponent([(size["elements"], size["operations"][name]["median"]) for size in sizes])
+
+    output = json.dumps(results, indent=1, sort_keys=True)
+    if args.output:
+        fp = open(args.output, "w")
+        fp.write(output)
+        fp.close()
+    else:
+        print output
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
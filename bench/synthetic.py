@@ -0,0 +1,111 @@
+'''
+Synthetic square note MEI documents of a given size, laid out like
+the documents the editor writes: one staff per system, each with a
+system break, a clef, neumes with a division after every eighth one,
+and a custos at the end. Every glyph and system has a zone.
+'''
+
+import random
+import xml.etree.ElementTree as ET
+
+MEI_NS = "http://www.music-encoding.org/ns/mei"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+
+PNAMES = "cdefgab"
+
+ET.register_namespace("", MEI_NS)
+ET.register_namespace("xlink", XLINK_NS)
+
+class Builder(object):
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.count = 0
+
+    def element(self, parent, tag, **attrs):
+        if parent is None:
+            e = ET.Element("{%s}%s" % (MEI_NS, tag))
+        else:
+            e = ET.SubElement(parent, "{%s}%s" % (MEI_NS, tag))
+
+        self.count += 1
+        e.set(XML_ID, "m-%08d" % self.count)
+        for key, value in sorted(attrs.items()):
+            e.set(key, str(value))
+        return e
+
+    def zone(self, surface, ulx, uly, width, height):
+        return self.element(surface, "zone", ulx=ulx, uly=uly, lrx=ulx + width, lry=uly + height)
+
+    def pitch(self):
+        return {"pname": self.random.choice(PNAMES), "oct": self.random.choice("23")}
+
+def generate(systems=9, neumes=20, notes=3, extra_zones=0, seed=0):
+    '''
+    Return the text of an MEI document with the given number of
+    systems (and staves), neumes per staff and notes per neume, and
+    extra_zones more zones on the surface that no element refers to,
+    as other tools leave them. The same parameters always give the
+    same document.
+    '''
+
+    b = Builder(seed)
+
+    mei = b.element(None, "mei", meiversion="2011-05")
+    head = b.element(mei, "meiHead")
+    desc = b.element(head, "fileDesc")
+    b.element(b.element(desc, "titleStmt"), "title")
+    b.element(desc, "pubStmt")
+
+    music = b.element(mei, "music")
+    surface = b.element(b.element(music, "facsimile"), "surface")
+    b.element(surface, "graphic", **{"{%s}href" % XLINK_NS: "page.tiff"})
+    page = b.element(b.element(music, "layout"), "page", n=1)
+
+    score = b.element(b.element(b.element(music, "body"), "mdiv", type="solesmes"), "score")
+    staff_group = b.element(b.element(score, "scoreDef"), "staffGrp")
+    section = b.element(score, "section")
+    b.element(section, "pb", pageref=page.get(XML_ID))
+
+    for s in range(systems):
+        top = 100 + 250 * s
+        system = b.element(page, "system", facs=b.zone(surface, 20, top, 1430, 100).get(XML_ID))
+        b.element(staff_group, "staffDef", n=s + 1)
+
+        staff = b.element(section, "staff", n=s + 1)
+        layer = b.element(staff, "layer", n=1)
+        b.element(layer, "sb", n=s + 1, systemref=system.get(XML_ID))
+        b.element(layer, "clef", shape="C", line=4, facs=b.zone(surface, 30, top, 20, 60).get(XML_ID))
+
+        x = 60
+        for n in range(neumes):
+            width = 15 * notes
+            neume = b.element(layer, "neume", name="punctum" if notes == 1 else "scandicus",
+                              facs=b.zone(surface, x, top, width, 60).get(XML_ID))
+            nc = b.element(neume, "nc")
+            for i in range(notes):
+                b.element(nc, "note", **b.pitch())
+            x += width + 5
+
+            if n % 8 == 7:
+                b.element(layer, "division", form="minor", facs=b.zone(surface, x, top, 5, 60).get(XML_ID))
+                x += 10
+
+        b.element(layer, "custos", facs=b.zone(surface, x, top, 10, 20).get(XML_ID), **b.pitch())
+
+    for i in range(extra_zones):
+        b.zone(surface, 0, 0, 1, 1)
+
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(mei)
+
+def write(path, **params):
+    '''
+    Write a generated document to path, see generate.
+    '''
+
+    fp = open(path, "w")
+    try:
+        fp.write(generate(**params))
+    finally:
+        fp.close()
@@ -0,0 +1,23 @@
+#!/usr/bin/python
+'''
+Write content hashed, precompressed copies of the static files and
+their manifest to static/dist. The server links to and serves these
+copies once the manifest exists. Brotli variants are only written if
+the brotli module is installed.
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from neonsrv.fingerprint import DIST_DIRECTORY, build, brotli
+
+if __name__ == "__main__":
+    static_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "static")
+    if len(sys.argv) > 1:
+        static_path = sys.argv[1]
+
+    manifest = build(static_path)
+    print "Fingerprinted %d files to %s" % (len(manifest), os.path.join(static_path, DIST_DIRECTORY))
+    if brotli is None:
+        print "brotli module not installed, only wrote gzip variants"
@@ -15,3 +15,6 @@ java -jar compiler.jar --js ../src/{neon.js,toe.js,model.js,controller.js,view.j
 if [ -a ../static/js/neon.min.js ]; then
     echo "Built to static/js/neon.min.js"
 fi
+
+echo "Fingerprinting and compressing static files ..."
+python assets.py
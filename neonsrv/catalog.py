@@ -0,0 +1,176 @@
+import math
+import os
+import time
+
+from doccache import file_stamp
+
+class Page(object):
+    '''
+    One page of a listing: the names on it and where it lies in the
+    full list. Iterates over the names.
+    '''
+
+    def __init__(self, names, total, start, count):
+        self.names = names
+        self.total = total
+        self.start = start
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def number(self):
+        if not self.count:
+            return 1
+        return self.start // self.count + 1
+
+    @property
+    def pages(self):
+        if not self.count:
+            return 1
+        return max(int(math.ceil(self.total / float(self.count))), 1)
+
+class Listing(object):
+
+    def __init__(self, names):
+        self.names = names
+        self.time = time.time()
+        # name -> (mtime, size), only gathered when sorting by date
+        self.stats = None
+
+class Catalog(object):
+    '''
+    Caches the sorted list of MEI files of each document type directory
+    under root, and the list of document types. A directory is listed
+    again after invalidate is called for it, which callers do when they
+    add or remove files. Saving a document changes the modification time
+    of its directory, so that is not checked; files added or removed by
+    others are picked up once a listing is max_age seconds old. Not
+    thread safe.
+    '''
+
+    SORTS = ("name", "mtime")
+
+    def __init__(self, root, suffix=".mei", max_age=10.0):
+        self.root = os.path.abspath(root)
+        self.suffix = suffix
+        self.max_age = max_age
+
+        self.listings = {}
+        self.types = None
+
+    def directory(self, document_type):
+        '''
+        Return the directory of a document type, "" being the root.
+        Raises ValueError if it lies outside the root.
+        '''
+
+        directory = os.path.abspath(os.path.join(self.root, document_type))
+        if directory != self.root and not directory.startswith(self.root + os.sep):
+            raise ValueError("not a document type: %r" % document_type)
+        return directory
+
+    def document_types(self):
+        '''
+        Return the sorted names of the directories in the root, except
+        hidden ones.
+        '''
+
+        if not self.fresh(self.types):
+            names = [d for d in os.listdir(self.root)
+                     if not d.startswith(".") and os.path.isdir(os.path.join(self.root, d))]
+            self.types = Listing(sorted(names))
+        return list(self.types.names)
+
+    def listing(self, document_type):
+        directory = self.directory(document_type)
+
+        listing = self.listings.get(directory)
+        if not self.fresh(listing):
+            names = [f for f in os.listdir(directory) if f.endswith(self.suffix)]
+            listing = self.listings[directory] = Listing(sorted(names))
+        return listing
+
+    def fresh(self, listing):
+        return listing is not None and time.time() - listing.time < self.max_age
+
+    def page(self, document_type, start=0, count=None, filter=None, sort="name", reverse=False):
+        '''
+        Return a Page of the files of a document type whose names
+        contain filter (ignoring case), sorted by name or modification
+        time. Without count, all files are returned.
+        '''
+
+        if sort not in self.SORTS:
+            raise ValueError("unknown sort %r" % sort)
+
+        listing = self.listing(document_type)
+        names = listing.names
+        if filter:
+            filter = filter.lower()
+            names = [n for n in names if filter in n.lower()]
+
+        if sort == "mtime":
+            stats = self.stats(document_type, listing)
+            names = sorted(names, key=lambda n: stats.get(n, (0, 0))[0])
+        if reverse:
+            names = names[::-1]
+
+        start = max(start, 0)
+        if count is None:
+            return Page(names[start:], len(names), start, None)
+        return Page(names[start:start + count], len(names), start, count)
+
+    def details(self, document_type, names):
+        '''
+        Return the name, modification time and size of the given files.
+        '''
+
+        directory = self.directory(document_type)
+        details = []
+        for name in names:
+            try:
+                mtime, size = file_stamp(os.path.join(directory, name))
+            except OSError:
+                # removed since it was listed
+                continue
+            details.append({"name": name, "mtime": mtime, "size": size})
+        return details
+
+    def stats(self, document_type, listing):
+        if listing.stats is None:
+            directory = self.directory(document_type)
+            stats = {}
+            for name in listing.names:
+                try:
+                    stats[name] = file_stamp(os.path.join(directory, name))
+                except OSError:
+                    pass
+            listing.stats = stats
+        return listing.stats
+
+    def changed(self, document_type):
+        '''
+        Note that files of a document type were modified, but none
+        were added or removed.
+        '''
+
+        listing = self.listings.get(os.path.abspath(os.path.join(self.root, document_type)))
+        if listing is not None:
+            listing.stats = None
+
+    def invalidate(self, document_type=None):
+        '''
+        Forget the listing of a document type, or of everything.
+        '''
+
+        if document_type is None:
+            self.listings.clear()
+            self.types = None
+        else:
+            self.listings.pop(self.directory(document_type), None)
+            self.types = None
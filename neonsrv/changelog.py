@@ -0,0 +1,81 @@
+import time
+
+class ChangeLog(object):
+    '''
+    Numbers the edits of a document and remembers, for the last
+    history edits, which element ids each of them added, changed or
+    removed. Versions start at the time the log was created in
+    milliseconds, so they keep increasing when a document is parsed
+    again, and a version from before that falls outside the history.
+
+        log.begin()
+        log.record(id, "added")
+        ...
+        log.end()
+        log.since(version)
+    '''
+
+    KINDS = ("added", "changed", "removed")
+
+    def __init__(self, history=1000, version=None):
+        if version is None:
+            version = int(time.time() * 1000)
+
+        self.version = version
+        self.history = max(history, 0)
+        # the version the oldest remembered edit was made on
+        self.start = version
+        # id -> first kind of change, one dict per edit after start
+        self.edits = []
+        self.current = None
+
+    def begin(self):
+        '''
+        Start recording an edit.
+        '''
+
+        self.current = {}
+
+    def end(self):
+        '''
+        Finish the edit being recorded and move to the next version.
+        '''
+
+        changes, self.current = self.current, None
+        self.version += 1
+        self.edits.append(changes or {})
+
+        if len(self.edits) > self.history:
+            del self.edits[:len(self.edits) - self.history]
+            self.start = self.version - len(self.edits)
+
+    def record(self, id, kind):
+        '''
+        Note a change to an element. Changes made outside an edit, like
+        deriving staff numbers, belong to the last edit, and are not
+        recorded before the first one.
+        '''
+
+        if kind not in self.KINDS:
+            raise ValueError("unknown kind of change %r" % kind)
+
+        if self.current is not None:
+            self.current.setdefault(id, kind)
+        elif self.edits:
+            self.edits[-1].setdefault(id, kind)
+
+    def since(self, version):
+        '''
+        Return the ids changed after the given version, mapped to the
+        first kind of change made to each of them, or None if the
+        history does not reach back that far.
+        '''
+
+        if version < self.start or version > self.version:
+            return None
+
+        first = {}
+        for changes in self.edits[version - self.start:]:
+            for id, kind in changes.items():
+                first.setdefault(id, kind)
+        return first
@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tornado.log import app_log
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# directory next to the page images where their derivatives are kept
+DERIVATIVE_DIRECTORY = "derivatives"
+
+def derivative_path(image_path, name):
+    '''
+    Path of the derivative with the given name (e.g. "thumbnail")
+    of a page image.
+    '''
+
+    return os.path.join(os.path.dirname(image_path), DERIVATIVE_DIRECTORY,
+                        os.path.basename(image_path), name + ".jpg")
+
+def save_jpeg(image, path, **options):
+    # write next to the destination first, so a derivative is never seen half written
+    tmp = path + ".tmp"
+    image.save(tmp, "JPEG", **options)
+    os.rename(tmp, path)
+
+def make_derivatives(image_path, preview_size=1000, thumbnail_size=160, quality=85):
+    '''
+    Write a progressive JPEG of a page image, a preview and a thumbnail
+    that fit in squares of the given sizes. Returns the names of the
+    derivatives written.
+    '''
+
+    directory = os.path.dirname(derivative_path(image_path, ""))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    image = Image.open(image_path)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    save_jpeg(image, derivative_path(image_path, "progressive"),
+              quality=quality, optimize=True, progressive=True)
+
+    # each size is scaled down from the one before
+    image.thumbnail((preview_size, preview_size), Image.ANTIALIAS)
+    save_jpeg(image, derivative_path(image_path, "preview"), quality=quality, progressive=True)
+
+    image.thumbnail((thumbnail_size, thumbnail_size), Image.ANTIALIAS)
+    save_jpeg(image, derivative_path(image_path, "thumbnail"), quality=quality)
+
+    return ["progressive", "preview", "thumbnail"]
+
+class Job(object):
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.state = "queued"
+        self.result = None
+        self.error = None
+
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.state in ("done", "failed")
+
+    def status(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+class JobQueue(object):
+    '''
+    Runs background jobs in a fixed number of worker threads and keeps
+    the status of the most recent ones, so clients can poll for them
+    after the request that submitted them has returned. Only the last
+    history finished jobs are remembered. Job results must be JSON
+    serializable.
+    '''
+
+    def __init__(self, workers=2, history=1000):
+        self.executor = ThreadPoolExecutor(workers)
+        self.workers = workers
+        self.history = history
+
+        self.jobs = OrderedDict()
+        self.completed = 0
+        self.failed = 0
+
+        self.lock = threading.Lock()
+
+    def submit(self, name, fn, *args, **kwargs):
+        '''
+        Queue fn(*args, **kwargs) and return the id of the job.
+        '''
+
+        job = Job(name)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._trim()
+
+        self.executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def status(self, id):
+        '''
+        Return the status of a job, or None if it is unknown.
+        '''
+
+        with self.lock:
+            job = self.jobs.get(id)
+            if job is None:
+                return None
+            return job.status()
+
+    def stats(self):
+        with self.lock:
+            states = [job.state for job in self.jobs.values()]
+            return {
+                "workers": self.workers,
+                "queued": states.count("queued"),
+                "running": states.count("running"),
+                "completed": self.completed,
+                "failed": self.failed
+            }
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
+
+    def _run(self, job, fn, args, kwargs):
+        with self.lock:
+            job.state = "running"
+            job.started = time.time()
+
+        try:
+            result = fn(*args, **kwargs)
+        except Exception, e:
+            app_log.exception("job %s (%s) failed", job.id, job.name)
+            with self.lock:
+                job.state = "failed"
+                job.error = str(e)
+                job.finished = time.time()
+                self.failed += 1
+            return
+
+        with self.lock:
+            job.state = "done"
+            job.result = result
+            job.finished = time.time()
+            self.completed += 1
+
+    def _trim(self):
+        finished = [id for id, job in self.jobs.items() if job.done]
+        for id in finished[:len(finished) - self.history]:
+            del self.jobs[id]
@@ -0,0 +1,286 @@
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+def file_stamp(path):
+    '''
+    Return the (mtime, size) pair that identifies the version
+    of a file on disk.
+    '''
+
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size)
+
+class CacheEntry(object):
+
+    def __init__(self, document, stamp, nbytes):
+        self.document = document
+        self.stamp = stamp
+        self.nbytes = nbytes
+
+        # time of the first and last unwritten modification
+        self.dirty_since = None
+        self.modified = None
+
+    @property
+    def dirty(self):
+        return self.dirty_since is not None
+
+class DocumentCache(object):
+    '''
+    Keeps parsed documents resident in memory, keyed by absolute path.
+    A cached document is reused as long as the modification time and
+    size of its file match the values recorded when it was loaded.
+    Documents are evicted in least recently used order once the total
+    size of their files exceeds max_bytes. A max_bytes of 0 disables
+    caching. A different stamp function can be given for documents
+    stored in more than one file; the second item of the stamp is
+    taken as the size of the document. If given, saved is called
+    with the number of seconds each write of a document took.
+
+    With write_behind enabled, committed documents are only marked
+    dirty. They are written out by flush_due once no edit has been
+    made for quiet seconds, or max_delay seconds after the first
+    unwritten edit, whichever comes first. Dirty documents are never
+    evicted or reloaded from disk. Documents must provide save().
+
+    The cache itself is thread safe, but callers must make sure a
+    document is not modified, committed or flushed by two threads at
+    the same time.
+    '''
+
+    def __init__(self, loader, max_bytes, write_behind=False, quiet=2.0, max_delay=10.0, stamp=file_stamp, saved=None):
+        # loader(path) parses the file and returns the document to share
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.stamp = stamp
+        self.saved = saved
+
+        self.write_behind = write_behind
+        self.quiet = quiet
+        self.max_delay = max_delay
+
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+        self.lock = threading.RLock()
+
+    def get(self, path):
+        '''
+        Return the document for the given path, parsing the file
+        only if it is not cached or has changed on disk.
+        '''
+
+        path = os.path.abspath(path)
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.dirty:
+                # the file on disk is behind the cached document
+                self._touch(path, entry)
+                self.hits += 1
+                return entry.document
+
+        stamp = self.stamp(path)
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.stamp == stamp:
+                self._touch(path, entry)
+                self.hits += 1
+                return entry.document
+
+            self.misses += 1
+
+        document = self.loader(path)
+
+        with self.lock:
+            self._discard(path)
+            if stamp[1] <= self.max_bytes:
+                self.entries[path] = CacheEntry(document, stamp, stamp[1])
+                self.nbytes += stamp[1]
+                self._evict()
+
+        return document
+
+    def commit(self, path, document, durable=False):
+        '''
+        Persist a modified document. In write behind mode the write is
+        deferred unless durable is set or the document is not cached.
+        '''
+
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if self.write_behind and not durable and entry is not None:
+                now = time.time()
+                if not entry.dirty:
+                    entry.dirty_since = now
+                entry.modified = now
+                return
+
+        self._save(document)
+        self.update(path)
+
+    def update(self, path):
+        '''
+        Record the current state of the file on disk after the cached
+        document has been written out, so it is not parsed again.
+        '''
+
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return
+
+            entry.stamp = self.stamp(path)
+            entry.dirty_since = entry.modified = None
+            self.nbytes += entry.stamp[1] - entry.nbytes
+            entry.nbytes = entry.stamp[1]
+            self._evict()
+
+    def flush(self, path):
+        '''
+        Write out the cached document for the given path if it has
+        unwritten modifications.
+        '''
+
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or not entry.dirty:
+                return
+
+        self._save(entry.document)
+
+        with self.lock:
+            self.flushes += 1
+            self.update(path)
+
+    def due(self):
+        '''
+        Return the paths of dirty documents whose quiet period or
+        maximum delay has elapsed.
+        '''
+
+        now = time.time()
+        with self.lock:
+            return [path for path, entry in self.entries.items()
+                    if entry.dirty and (now - entry.modified >= self.quiet or
+                                        now - entry.dirty_since >= self.max_delay)]
+
+    def flush_due(self):
+        '''
+        Write out dirty documents that are due.
+        '''
+
+        for path in self.due():
+            self.flush(path)
+
+    def flush_all(self):
+        '''
+        Write out every dirty document, e.g. before shutting down.
+        '''
+
+        with self.lock:
+            dirty = [path for path, entry in self.entries.items() if entry.dirty]
+
+        for path in dirty:
+            self.flush(path)
+
+    def invalidate(self, path, discard_changes=True):
+        '''
+        Drop the cached document for the given path, if any. Unless
+        discard_changes is set, a document with unwritten modifications
+        is kept.
+        '''
+
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and (discard_changes or not entry.dirty):
+                self._discard(path)
+
+    def replace(self, path, document):
+        '''
+        Swap the cached document for the given path for another copy of
+        it, such as one rebuilt after a failed edit, keeping the state
+        of the entry, including unwritten modifications. Does nothing
+        if the path is not cached.
+        '''
+
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                entry.document = document
+
+    def stats(self):
+        with self.lock:
+            return {
+                "documents": len(self.entries),
+                "bytes": self.nbytes,
+                "dirty": sum(1 for entry in self.entries.values() if entry.dirty),
+                "hits": self.hits,
+                "misses": self.misses,
+                "flushes": self.flushes
+            }
+
+    def cached(self, path=None):
+        '''
+        Return (path, size, document) for every cached document, least
+        recently used first. Given a path, return its document only if
+        it is cached and current, without parsing or touching it, or
+        None otherwise.
+        '''
+
+        if path is None:
+            with self.lock:
+                return [(path, entry.nbytes, entry.document) for path, entry in self.entries.items()]
+
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry.dirty:
+                return entry and entry.document
+
+        stamp = self.stamp(path)
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and (entry.dirty or entry.stamp == stamp):
+                return entry.document
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def _save(self, document):
+        started = time.time()
+        document.save()
+        if self.saved is not None:
+            self.saved(time.time() - started)
+
+    def _touch(self, path, entry):
+        # mark as most recently used
+        del self.entries[path]
+        self.entries[path] = entry
+
+    def _discard(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+    def _evict(self):
+        for path, entry in list(self.entries.items()):
+            if self.nbytes <= self.max_bytes:
+                break
+            if not entry.dirty:
+                self._discard(path)
@@ -0,0 +1,93 @@
+import time
+
+import tornado.locks
+from tornado import gen
+
+class DocumentLock(object):
+
+    def __init__(self):
+        self.lock = tornado.locks.Lock()
+        # requests holding or waiting for the lock
+        self.depth = 0
+
+class DocumentLocks(object):
+    '''
+    Hands out one FIFO lock per document, so edits to the same document
+    are applied one at a time in arrival order while edits to different
+    documents proceed independently. Must only be used from the IOLoop.
+
+        with (yield locks.acquire(path)):
+            ...
+    '''
+
+    def __init__(self):
+        self.locks = {}
+
+        self.acquisitions = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_depth = 0
+
+    @gen.coroutine
+    def acquire(self, path):
+        entry = self.locks.get(path)
+        if entry is None:
+            entry = self.locks[path] = DocumentLock()
+
+        entry.depth += 1
+        self.max_depth = max(self.max_depth, entry.depth)
+
+        start = time.time()
+        yield entry.lock.acquire()
+        wait = time.time() - start
+
+        self.acquisitions += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+        raise gen.Return(_Holder(self, path, entry))
+
+    def release(self, path, entry):
+        entry.lock.release()
+        entry.depth -= 1
+        if entry.depth == 0:
+            del self.locks[path]
+
+    def depth(self, path):
+        '''
+        Number of requests holding or waiting for the lock of a document.
+        '''
+
+        entry = self.locks.get(path)
+        if entry is None:
+            return 0
+        return entry.depth
+
+    def stats(self):
+        queued = sum(entry.depth - 1 for entry in self.locks.values())
+        if self.acquisitions:
+            mean_wait = self.total_wait / self.acquisitions
+        else:
+            mean_wait = 0.0
+
+        return {
+            "locked_documents": len(self.locks),
+            "queued": queued,
+            "max_depth": self.max_depth,
+            "acquisitions": self.acquisitions,
+            "mean_wait": mean_wait,
+            "max_wait": self.max_wait
+        }
+
+class _Holder(object):
+
+    def __init__(self, locks, path, entry):
+        self.locks = locks
+        self.path = path
+        self.entry = entry
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.locks.release(self.path, self.entry)
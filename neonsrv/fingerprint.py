@@ -0,0 +1,173 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+from cStringIO import StringIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from doccache import file_stamp
+
+# fingerprinted copies are written here, inside the static directory
+DIST_DIRECTORY = "dist"
+MANIFEST = "manifest.json"
+
+# precompressed variants, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE = (".js", ".css", ".svg", ".json", ".html", ".txt")
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+def hashed_name(path, data):
+    '''
+    Return path with a hash of data before its extension:
+    js/neon.min.js -> js/neon.min.0123456789ab.js
+    '''
+
+    root, ext = os.path.splitext(path)
+    return "%s.%s%s" % (root, hashlib.md5(data).hexdigest()[:12], ext)
+
+def rewrite_css(data, path, manifest):
+    '''
+    Point the relative urls in the stylesheet at path to the
+    fingerprinted copies of the files they refer to.
+    '''
+
+    directory = os.path.dirname(path)
+
+    def replace(match):
+        quote, url = match.groups()
+        if ":" in url or url.startswith("/") or url.startswith("#"):
+            return match.group(0)
+
+        # keep queries and fragments, as in font.eot?#iefix
+        pos = min([i for i in (url.find("?"), url.find("#")) if i >= 0] or [len(url)])
+        target = os.path.normpath(os.path.join(directory, url[:pos])).replace(os.sep, "/")
+        if target not in manifest:
+            return match.group(0)
+
+        hashed = os.path.relpath(manifest[target], directory or ".").replace(os.sep, "/")
+        return "url(%s%s%s)" % (quote, hashed + url[pos:], quote)
+
+    return CSS_URL.sub(replace, data)
+
+def write_atomic(path, data):
+    tmp = path + ".tmp"
+    fp = open(tmp, "wb")
+    try:
+        fp.write(data)
+    finally:
+        fp.close()
+    os.rename(tmp, path)
+
+def gzip_data(data, level=9):
+    buf = StringIO()
+    gz = gzip.GzipFile(filename="", mode="wb", fileobj=buf, compresslevel=level, mtime=0)
+    gz.write(data)
+    gz.close()
+    return buf.getvalue()
+
+def write_asset(path, data):
+    '''
+    Write a fingerprinted file and its compressed variants, where
+    they are smaller. Existing files are left alone, their name
+    already says what is in them.
+    '''
+
+    if os.path.exists(path):
+        return
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    if path.endswith(COMPRESSIBLE):
+        variants = {".gz": gzip_data(data)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data, quality=11)
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(data):
+                write_atomic(path + suffix, compressed)
+
+    # written last, so an interrupted build is redone next time
+    write_atomic(path, data)
+
+def build(static_path):
+    '''
+    Copy every file under static_path to the dist directory under
+    a name containing a hash of its contents, with gzip and, if the
+    brotli module is installed, brotli compressed variants of text
+    files. Stylesheets are rewritten to refer to the fingerprinted
+    copies. Writes and returns the manifest mapping each path to
+    its fingerprinted copy. Symbolic links to directories, such as
+    js/src, are not followed.
+    '''
+
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(static_path):
+        directory = os.path.relpath(dirpath, static_path)
+        if directory == ".":
+            dirnames[:] = [d for d in dirnames if d != DIST_DIRECTORY]
+        for f in filenames:
+            if not f.startswith("."):
+                paths.append(os.path.normpath(os.path.join(directory, f)).replace(os.sep, "/"))
+
+    # stylesheets refer to other files, so they come last
+    paths.sort(key=lambda p: (p.endswith(".css"), p))
+
+    output = os.path.join(static_path, DIST_DIRECTORY)
+    manifest = {}
+    for path in paths:
+        fp = open(os.path.join(static_path, path), "rb")
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+
+        if path.endswith(".css"):
+            data = rewrite_css(data, path, manifest)
+
+        manifest[path] = hashed_name(path, data)
+        write_asset(os.path.join(output, manifest[path]), data)
+
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    write_atomic(os.path.join(output, MANIFEST), json.dumps(manifest, indent=1, sort_keys=True))
+    return manifest
+
+class Manifest(object):
+    '''
+    The manifest written by build for a static directory, read
+    again whenever it changes. Without one, nothing is fingerprinted.
+    '''
+
+    def __init__(self, static_path):
+        self.path = os.path.join(static_path, DIST_DIRECTORY, MANIFEST)
+        self.stamp = None
+        self.paths = {}
+
+    def get(self, path):
+        '''
+        Return the fingerprinted name of a static path, or None.
+        '''
+
+        try:
+            stamp = file_stamp(self.path)
+        except OSError:
+            stamp = None
+
+        if stamp != self.stamp:
+            self.paths = {}
+            if stamp is not None:
+                fp = open(self.path)
+                try:
+                    self.paths = json.load(fp)
+                finally:
+                    fp.close()
+            self.stamp = stamp
+
+        return self.paths.get(path)
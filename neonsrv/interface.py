@@ -1,31 +1,106 @@
+import cgi
+import hashlib
 import json
 import mimetypes
 import os
-import shutil
-
-from pymei import XmlImport
 
 import tornado.web
+from tornado import gen
+
+from derivatives import JobQueue, make_derivatives
+from doclock import DocumentLocks
+from fingerprint import DIST_DIRECTORY, ENCODINGS, Manifest
+from journal import Journal
+from modifymei import read_mei
+from storage import compress_file, is_compressed, read_file
+from workers import EditExecutor
+from uploads import MultipartSpooler, link_or_copy, place
+from tornadoapi import documents, locks, executor, catalog, document_file
+import derivatives
+import tiles
 
 import conf
 
+# cutting tiles is slow, keep it away from the edit workers
+tile_executor = EditExecutor("thread", conf.TILE_WORKERS)
+tile_locks = DocumentLocks()
+
+derivative_jobs = JobQueue(conf.DERIVATIVE_WORKERS)
+
+def image_pyramid(name):
+    '''
+    Return the tile pyramid of the page image with the given name,
+    or raise a 404 if there is no such image.
+    '''
+
+    image_path = tiles.find_image(conf.MEI_DIRECTORY, name)
+    if image_path is None or tiles.Image is None:
+        raise tornado.web.HTTPError(404)
+    return tiles.TilePyramid(image_path, conf.TILE_SIZE, format=conf.TILE_FORMAT, quality=conf.TILE_QUALITY)
+
+def upload_directory():
+    '''
+    Return the directory uploads are spooled to, creating it if needed.
+    '''
+
+    directory = conf.UPLOAD_DIRECTORY or os.path.join(os.path.abspath(conf.MEI_DIRECTORY), ".uploads")
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return directory
+
+def validate_mei(path):
+    '''
+    Parse an MEI file, raising an exception if it is not valid.
+    '''
+
+    if read_mei(path) is None:
+        raise ValueError("invalid mei file")
+
+@tornado.web.stream_request_body
 class RootHandler(tornado.web.RequestHandler):
-    def get_files(self, document_type):
-        root_dir = os.path.abspath(conf.MEI_DIRECTORY)
-        mei_dir = os.path.join(root_dir, document_type)
+    def prepare(self):
+        # uploads are written to disk as they arrive instead of being
+        # buffered in memory by tornado
+        self.spooler = None
+        self.upload_error = None
+        if self.request.method != "POST":
+            return
+
+        self.request.connection.set_max_body_size(conf.MAX_UPLOAD_SIZE)
+        content_type, params = cgi.parse_header(self.request.headers.get("Content-Type", ""))
+        if content_type != "multipart/form-data":
+            raise tornado.web.HTTPError(400)
+        try:
+            self.spooler = MultipartSpooler(params.get("boundary", ""), upload_directory())
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+
+    def data_received(self, chunk):
+        if self.spooler is None or self.upload_error is not None:
+            return
+        try:
+            self.spooler.feed(chunk)
+        except ValueError, e:
+            # keep reading the body, fail once it is complete
+            self.upload_error = e
+            self.spooler.cleanup()
+
+    def on_finish(self):
+        if self.spooler is not None:
+            self.spooler.cleanup()
 
-        # only list mei files (not jpeg)
-        meiFiles = []
-        for f in os.listdir(mei_dir):
-            if f.endswith(".mei"):
-                meiFiles.append(f)
-        return meiFiles
+    def get_files(self, document_type, page_argument="page"):
+        # only list mei files (not jpeg), one page at a time
+        try:
+            number = max(int(self.get_argument(page_argument, 1)), 1)
+        except ValueError:
+            number = 1
+        return catalog.page(document_type, (number - 1) * conf.LISTING_PAGE_SIZE, conf.LISTING_PAGE_SIZE,
+                            filter=self.get_argument("q", None))
 
     def get_document_types(self):
-        mei_dir = os.path.abspath(conf.MEI_DIRECTORY)
-        
-        # list subdirectories in the mei root directory
-        return os.walk(mei_dir).next()[1] 
+        # list subdirectories in the mei root directory, except hidden ones
+        return catalog.document_types()
 
     def get(self, url):
         #default and permissions are set in server.py
@@ -41,19 +116,33 @@ class RootHandler(tornado.web.RequestHandler):
                     rootfiles=self.get_files(''),
                     document_types=self.get_document_types(),
                     errors="", 
+                    q=self.get_argument("q", ""),
                     prefix=conf.get_prefix())
 
         elif url == "demo.html":
             self.render(url, 
-                    squarenotefiles=self.get_files('squarenote'), 
-                    stafflessfiles=self.get_files('cheironomic'),
+                    squarenotefiles=self.get_files('squarenote', 'squarenote_page'), 
+                    stafflessfiles=self.get_files('cheironomic', 'cheironomic_page'),
                     document_types=self.get_document_types(),
                     errors="", 
+                    q=self.get_argument("q", ""),
                     prefix=conf.get_prefix())
 
-    def post(self):
-        mei = self.request.files.get("mei", [])
-        mei_img = self.request.files.get("mei_img", [])
+    @gen.coroutine
+    def post(self, url=None):
+        try:
+            if self.upload_error is not None:
+                raise self.upload_error
+            self.spooler.finish()
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+
+        for name, values in self.spooler.fields.items():
+            self.request.body_arguments.setdefault(name, []).extend(values)
+            self.request.arguments.setdefault(name, []).extend(values)
+
+        mei = self.spooler.files.get("mei", [])
+        mei_img = self.spooler.files.get("mei_img", [])
         document_type = self.get_argument("document_type")
         mei_root_directory = os.path.abspath(conf.MEI_DIRECTORY)
         mei_directory = os.path.join(mei_root_directory, document_type)
@@ -61,20 +150,20 @@ class RootHandler(tornado.web.RequestHandler):
         errors = ""
         mei_fn = ""
         if len(mei):
-            mei_fn = mei[0]["filename"]
-            contents = mei[0]["body"]
+            mei_fn = mei[0].filename
             try:
-                mei = XmlImport.documentFromText(contents)
+                # parsing a large file takes a while, keep it off the IOLoop
+                yield executor.run(validate_mei, mei[0].path)
+                if conf.COMPRESS_MEI:
+                    yield executor.run(compress_file, mei[0].path)
                 if os.path.exists(os.path.join(mei_directory, mei_fn)):
                     errors = "mei file already exists"
                 else:
-                    # write to working directory and backup
-                    fp = open(os.path.join(mei_directory, mei_fn), "w")
-                    fp.write(contents)
-                    fp.close()
-                    fp = open(os.path.join(mei_directory_backup, mei_fn), "w")
-                    fp.write(contents)
-                    fp.close()
+                    # move to working directory, the backup shares its
+                    # data until the working copy is first saved
+                    place(mei[0].path, os.path.join(mei_directory, mei_fn))
+                    link_or_copy(os.path.join(mei_directory, mei_fn), os.path.join(mei_directory_backup, mei_fn))
+                    catalog.invalidate(document_type)
             except Exception, e:
                 errors = "invalid mei file"
 
@@ -83,23 +172,28 @@ class RootHandler(tornado.web.RequestHandler):
             if mei_fn != "":
                 img_fn = os.path.splitext(mei_fn)[0] + ".jpg"
             else:
-                img_fn = mei_img[0]["filename"]
-            img_contents = mei_img[0]["body"]
+                img_fn = mei_img[0].filename
             try:
                 if os.path.exists(os.path.join(mei_directory, img_fn)):
                     errors += "image file already exists"
                 else:
-                    fp = open(os.path.join(mei_directory, img_fn), "w")
-                    fp.write(img_contents)
-                    fp.close()
+                    place(mei_img[0].path, os.path.join(mei_directory, img_fn))
+                    if derivatives.Image is not None:
+                        # previews are made in the background, don't wait for them
+                        job = derivative_jobs.submit("derivatives of %s" % img_fn, make_derivatives,
+                                                     os.path.join(mei_directory, img_fn),
+                                                     conf.PREVIEW_SIZE, conf.THUMBNAIL_SIZE, conf.DERIVATIVE_QUALITY)
+                        self.set_header("X-Job", job)
             except Exception, e:
                 errors += "invalid image file"
 
-        self.render("index.html", 
-                    squarenotefiles=self.get_files('squarenote'), 
-                    stafflessfiles=self.get_files('cheironomic'),
+        # the upload form is on the demo page
+        self.render("demo.html", 
+                    squarenotefiles=self.get_files('squarenote', 'squarenote_page'), 
+                    stafflessfiles=self.get_files('cheironomic', 'cheironomic_page'),
                     document_types=self.get_document_types(),
                     errors=errors, 
+                    q="",
                     prefix=conf.get_prefix())
 
 class SquareNoteEditorHandler(tornado.web.RequestHandler):
@@ -124,35 +218,276 @@ class StafflessEditorHandler(tornado.web.RequestHandler):
         imagepath = conf.PROD_IMAGE_PATH.replace("PAGE", page)
         self.render(conf.get_neonHtmlFileName(square=False), page=page, debug=dstr, prefix=conf.get_prefix(), imagepath=imagepath)
 
-class FileHandler(tornado.web.RequestHandler):
+class FileHandler(tornado.web.StaticFileHandler):
+    '''
+    Serves MEI files and page images from MEI_DIRECTORY. Files are
+    streamed in chunks, range requests are honoured, and clients can
+    revalidate with If-None-Match or If-Modified-Since. MEI files
+    stored compressed are sent as they are with Content-Encoding gzip,
+    or decompressed for the rare client that does not accept gzip.
+    MEI files of documents being edited come with the version they
+    hold in the X-Document-Version header, for clients following its
+    deltas, and are sent from memory while the file on disk is behind.
+    '''
+
+    compressed = False
+    inflate = False
+
     mimetypes.add_type("text/xml", ".mei")
 
-    def get(self, filename):
-        fullpath = os.path.join(conf.MEI_DIRECTORY, filename)
-        if not os.path.exists(os.path.abspath(fullpath)):
-            self.send_error(403)
+    def initialize(self, path=None, default_filename=None):
+        if path is None:
+            path = conf.MEI_DIRECTORY
+        super(FileHandler, self).initialize(os.path.abspath(path), default_filename)
+
+    @gen.coroutine
+    def get(self, filename, include_body=True):
+        fullpath = os.path.abspath(os.path.join(self.root, filename))
+        if not os.path.isfile(fullpath):
+            raise tornado.web.HTTPError(403)
+
+        if fullpath.endswith(".mei"):
+            # the file may hold later edits by the time it is sent,
+            # whose deltas the client then applies again, which does
+            # no harm
+            with (yield locks.acquire(fullpath)):
+                version, text = yield executor.run_for(fullpath, document_file, fullpath)
+            if version is not None:
+                self.set_header("X-Document-Version", str(version))
+            if text is not None:
+                self.get_text(fullpath, text, include_body)
+                return
+            self.compressed = is_compressed(fullpath)
+
+        if self.compressed and "gzip" not in self.request.headers.get("Accept-Encoding", ""):
+            self.inflate = True
+            yield self.get_inflated(fullpath, include_body)
         else:
-            fp = open(fullpath, "r")
-            response = fp.read()
-            # derive mime type from file for generic serving
-            self.set_header("Content-Type", mimetypes.guess_type(fullpath)[0]);
-            self.write(response)
+            yield super(FileHandler, self).get(filename, include_body)
 
-class DemoFileHandler(tornado.web.RequestHandler):
-    mimetypes.add_type("text/xml", ".mei")
+    def get_text(self, fullpath, text, include_body):
+        # edits not yet in the file are sent from memory
+        self.absolute_path = fullpath
+        self.set_header("Content-Type", "text/xml")
+        self.set_extra_headers(fullpath)
+        self.set_header("ETag", '"%s"' % hashlib.sha1(text).hexdigest())
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        if include_body:
+            self.write(text)
+
+    @gen.coroutine
+    def get_inflated(self, fullpath, include_body):
+        self.absolute_path = fullpath
+        self.set_header("Content-Type", "text/xml")
+        self.set_extra_headers(fullpath)
+        self.set_etag_header()
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        if include_body:
+            data = yield executor.run(read_file, fullpath)
+            self.write(data)
+
+    def compute_etag(self):
+        # the default hashes the whole file once and keeps the hash for
+        # the life of the process, which goes stale as soon as the
+        # document is edited. mtime and size change with every write.
+        st = os.stat(self.absolute_path)
+        if self.inflate:
+            return '"%x-%x-identity"' % (int(st.st_mtime * 1000000), st.st_size)
+        return '"%x-%x"' % (int(st.st_mtime * 1000000), st.st_size)
+
+    def set_extra_headers(self, path):
+        # documents change under edits, always revalidate
+        self.set_header("Cache-Control", "no-cache")
+        if self.compressed:
+            # gzip enabled in the settings adds Vary to every response
+            if not (self.settings.get("gzip") or self.settings.get("compress_response")):
+                self.set_header("Vary", "Accept-Encoding")
+            if not self.inflate:
+                self.set_header("Content-Encoding", "gzip")
+
+class AssetHandler(tornado.web.StaticFileHandler):
+    '''
+    Serves the static files. Files listed in the manifest written by
+    build/assets.py are linked to by their fingerprinted copy, which
+    is cached for good, and whose precompressed variant is sent to
+    clients that accept it. Other files, and all files in debug mode,
+    where static files are edited in place, are served as usual.
+    '''
+
+    # static path -> Manifest
+    manifests = {}
+
+    encoding = None
+
+    @classmethod
+    def manifest(cls, static_path):
+        if static_path not in cls.manifests:
+            cls.manifests[static_path] = Manifest(static_path)
+        return cls.manifests[static_path]
+
+    @classmethod
+    def make_static_url(cls, settings, path, include_version=True):
+        hashed = None
+        if not settings.get("debug"):
+            hashed = cls.manifest(settings["static_path"]).get(path)
+        if hashed is None:
+            return super(AssetHandler, cls).make_static_url(settings, path, include_version)
+        return settings.get("static_url_prefix", "/static/") + DIST_DIRECTORY + "/" + hashed
+
+    @property
+    def fingerprinted(self):
+        return self.path.startswith(DIST_DIRECTORY + "/")
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(AssetHandler, self).validate_absolute_path(root, absolute_path)
+        if absolute_path is None or not self.fingerprinted:
+            return absolute_path
 
-    def get(self, documentType, filename):
-        fullpath = os.path.join(conf.MEI_DIRECTORY, documentType, filename)
-        if not os.path.exists(os.path.abspath(fullpath)):
-            self.send_error(403)
+        accepted = [e.split(";")[0].strip() for e in self.request.headers.get("Accept-Encoding", "").split(",")]
+        for encoding, suffix in ENCODINGS:
+            if encoding in accepted and os.path.isfile(absolute_path + suffix):
+                self.encoding = encoding
+                return absolute_path + suffix
+        return absolute_path
+
+    def get_content_type(self):
+        if self.encoding is None:
+            return super(AssetHandler, self).get_content_type()
+
+        # the type of the file before it was compressed
+        mime_type, encoding = mimetypes.guess_type(os.path.splitext(self.absolute_path)[0])
+        return mime_type or "application/octet-stream"
+
+    def get_cache_time(self, path, modified, mime_type):
+        if self.fingerprinted:
+            return self.CACHE_MAX_AGE
+        return super(AssetHandler, self).get_cache_time(path, modified, mime_type)
+
+    def set_extra_headers(self, path):
+        if not self.fingerprinted:
+            return
+
+        # the content of a fingerprinted url never changes
+        self.set_header("Cache-Control", "public, max-age=%d, immutable" % self.CACHE_MAX_AGE)
+        if self.encoding is not None:
+            self.set_header("Content-Encoding", self.encoding)
+        # gzip enabled in the settings adds Vary to every response
+        if not (self.settings.get("gzip") or self.settings.get("compress_response")):
+            self.set_header("Vary", "Accept-Encoding")
+
+class DemoFileHandler(FileHandler):
+
+    def get(self, documentType, filename, include_body=True):
+        return super(DemoFileHandler, self).get(os.path.join(documentType, filename), include_body)
+
+    def head(self, documentType, filename):
+        return self.get(documentType, filename, include_body=False)
+
+class DeepZoomHandler(tornado.web.RequestHandler):
+    @gen.coroutine
+    def get(self, name):
+        pyramid = image_pyramid(name)
+        with (yield tile_locks.acquire(pyramid.image_path)):
+            dzi = yield tile_executor.run(pyramid.dzi)
+
+        self.set_header("Content-Type", "application/xml")
+        self.write(dzi)
+
+class TileHandler(FileHandler):
+    '''
+    Serves the tiles of page image pyramids, cutting a level the
+    first time one of its tiles is asked for.
+    '''
+
+    @gen.coroutine
+    def get(self, name, level, col, row, format, include_body=True):
+        pyramid = image_pyramid(name)
+        level = int(level)
+        if format != pyramid.format:
+            raise tornado.web.HTTPError(404)
+
+        if not pyramid.has_level(level):
+            with (yield tile_locks.acquire(pyramid.image_path)):
+                try:
+                    yield tile_executor.run(pyramid.cut_level, level)
+                except ValueError:
+                    raise tornado.web.HTTPError(404)
+
+        path = pyramid.tile_path(level, int(col), int(row))
+        if not os.path.isfile(path):
+            raise tornado.web.HTTPError(404)
+
+        yield tornado.web.StaticFileHandler.get(self, os.path.relpath(path, self.root), include_body)
+
+    def head(self, name, level, col, row, format):
+        return self.get(name, level, col, row, format, include_body=False)
+
+    def set_extra_headers(self, path):
+        # tiles only change when their page image is replaced
+        self.set_header("Cache-Control", "max-age=86400")
+
+class CatalogHandler(tornado.web.RequestHandler):
+
+    def get(self, document_type):
+        '''
+        List the MEI files of a document type, or of the root directory
+        along with the document types.
+        start, count: the slice of the list to return (count <= 1000)
+        q: only list files whose name contains q
+        sort: "name" or "mtime"; reverse: 1 to reverse the order
+        '''
+
+        try:
+            start = int(self.get_argument("start", 0))
+            count = min(int(self.get_argument("count", conf.LISTING_PAGE_SIZE)), 1000)
+            page = catalog.page(document_type, start, count,
+                                filter=self.get_argument("q", None),
+                                sort=self.get_argument("sort", "name"),
+                                reverse=bool(self.get_argument("reverse", None)))
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        except OSError:
+            raise tornado.web.HTTPError(404)
+
+        listing = {
+            "document_type": document_type,
+            "total": page.total,
+            "start": page.start,
+            "count": page.count,
+            "files": catalog.details(document_type, page.names)
+        }
+        if not document_type:
+            listing["document_types"] = catalog.document_types()
+
+        self.write(json.dumps(listing))
+        self.set_status(200)
+
+class JobHandler(tornado.web.RequestHandler):
+
+    def get(self, id):
+        '''
+        Report the status of a background job, or of the job queue if
+        no job is given.
+        '''
+
+        if not id:
+            status = derivative_jobs.stats()
         else:
-            fp = open(fullpath, "r")
-            response = fp.read()
-            # derive mime type from file for generic serving
-            self.set_header("Content-Type", mimetypes.guess_type(fullpath)[0]);
-            self.write(response)
+            status = derivative_jobs.status(id)
+            if status is None:
+                raise tornado.web.HTTPError(404)
+
+        self.write(json.dumps(status))
+        self.set_status(200)
 
 class FileRevertHandler(tornado.web.RequestHandler):
+    @gen.coroutine
     def post(self, documentType, filename):
         '''
         Move the given filename from the backup directory to the
@@ -164,5 +499,11 @@ class FileRevertHandler(tornado.web.RequestHandler):
         meibackup = os.path.join(mei_directory_backup, filename)
         
         if meibackup:
-            shutil.copy(meibackup, meiworking)
+            with (yield locks.acquire(meiworking)):
+                # the working copy is replaced rather than overwritten,
+                # since it may be a hard link to the backup
+                link_or_copy(meibackup, meiworking)
+                Journal(meiworking).remove()
+                documents.invalidate(meiworking)
+            catalog.changed(documentType)
 
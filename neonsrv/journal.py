@@ -0,0 +1,116 @@
+import json
+import os
+
+from doccache import file_stamp
+
+JOURNAL_SUFFIX = ".journal"
+
+def journal_stamp(path):
+    '''
+    Return the stamp of a journaled document, which changes when
+    either the snapshot or its journal changes.
+    '''
+
+    jpath = path + JOURNAL_SUFFIX
+    if os.path.exists(jpath):
+        return file_stamp(path) + file_stamp(jpath)
+    else:
+        return file_stamp(path) + (0, 0)
+
+class Journal(object):
+    '''
+    Append-only log of the operations applied to an MEI document since
+    its last snapshot. The file holds one JSON object per line. The first
+    line records the (mtime, size) stamp of the snapshot the operations
+    apply to, so a journal left behind by an interrupted compaction, or
+    a snapshot replaced behind our back, is recognized as stale.
+    '''
+
+    def __init__(self, path, max_ops=500, max_bytes=1024 * 1024):
+        self.snapshot_path = path
+        self.path = path + JOURNAL_SUFFIX
+
+        # size after which the journal should be folded into a snapshot
+        self.max_ops = max_ops
+        self.max_bytes = max_bytes
+
+        self.count = 0
+        self.nbytes = 0
+
+    @property
+    def full(self):
+        return self.count >= self.max_ops or self.nbytes >= self.max_bytes
+
+    def read(self):
+        '''
+        Return the list of entries that apply to the current snapshot.
+        '''
+
+        self.count = self.nbytes = 0
+        if not os.path.exists(self.path):
+            return []
+
+        fp = open(self.path, "r")
+        try:
+            lines = fp.readlines()
+        finally:
+            fp.close()
+
+        if not lines or tuple(json.loads(lines[0])["snapshot"]) != file_stamp(self.snapshot_path):
+            return []
+
+        entries = []
+        for line in lines[1:]:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # the last append was interrupted
+                break
+
+        self.count = len(entries)
+        self.nbytes = sum(len(line) for line in lines)
+        return entries
+
+    def append(self, entries):
+        '''
+        Append a list of entries, starting a new journal for the
+        current snapshot if there is none.
+        '''
+
+        if not entries:
+            return
+
+        lines = [json.dumps(e) + "\n" for e in entries]
+        if self.count == 0:
+            lines.insert(0, json.dumps({"snapshot": file_stamp(self.snapshot_path)}) + "\n")
+            mode = "w"
+        else:
+            mode = "a"
+
+        data = "".join(lines)
+        fp = open(self.path, mode)
+        try:
+            fp.write(data)
+        finally:
+            fp.close()
+
+        if mode == "w":
+            self.nbytes = 0
+        self.count += len(entries)
+        self.nbytes += len(data)
+
+    def reset(self, snapshot_tmp):
+        '''
+        Move a freshly written snapshot into place and start an empty
+        journal for it. The old journal is only removed after the new
+        snapshot is in place; until then its stamp no longer matches
+        and it is ignored.
+        '''
+
+        os.rename(snapshot_tmp, self.snapshot_path)
+        self.remove()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.count = self.nbytes = 0
@@ -0,0 +1,169 @@
+import bisect
+import threading
+import time
+
+# upper bounds in seconds, as used by the Prometheus client libraries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def escape(value):
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, escape(value)) for name, value in zip(names, values))
+
+class Metric(object):
+    '''
+    A named metric with one value, or set of values, for each
+    combination of label values it has been updated with. Updates
+    are thread safe and cheap enough to make on every request.
+    '''
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        '''
+        Return (name suffix, label names, label values, value) tuples.
+        '''
+
+        with self.lock:
+            return [("", self.labels, labels, value) for labels, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help.replace("\\", "\\\\").replace("\n", "\\n")),
+                 "# TYPE %s %s" % (self.name, self.type)]
+        for suffix, names, values, value in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, format_labels(names, values), format_value(value)))
+        return "\n".join(lines)
+
+class Counter(Metric):
+
+    type = "counter"
+
+    def inc(self, labels=(), amount=1):
+        labels = tuple(labels)
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    '''
+    A value that can go up and down. With collect given, the values
+    are instead read when the metrics are rendered: collect returns
+    (label values, value) pairs.
+    '''
+
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super(Gauge, self).__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[tuple(labels)] = value
+
+    def samples(self):
+        if self.collect is None:
+            return super(Gauge, self).samples()
+        return [("", self.labels, tuple(labels), value) for labels, value in sorted(self.collect())]
+
+class Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.histogram.observe(time.time() - self.started, self.labels)
+
+class Histogram(Metric):
+    '''
+    Counts observations, such as durations in seconds, in buckets
+    by their upper bound.
+    '''
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        labels = tuple(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # counts per bucket and past the last one, then the sum
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def time(self, labels=()):
+        '''
+        Return a context manager observing how long its block takes.
+        '''
+
+        return Timer(self, tuple(labels))
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, list(counts)) for labels, counts in self.values.items())
+
+        names = self.labels + ("le",)
+        samples = []
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                samples.append(("_bucket", names, labels + (format_value(float(bound)),), total))
+            samples.append(("_sum", self.labels, labels, counts[-1]))
+            samples.append(("_count", self.labels, labels, total))
+        return samples
+
+class Registry(object):
+    '''
+    The metrics of a process, rendered in the Prometheus text format.
+    '''
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self.add(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        return "".join(metric.render() + "\n" for metric in self.metrics)
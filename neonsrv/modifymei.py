@@ -1,24 +1,265 @@
+import os
+
 from pymei import MeiElement, MeiAttribute, XmlImport, XmlExport
 
+from changelog import ChangeLog
+from journal import Journal
+from seqindex import SequenceIndex
+from storage import is_compressed, read_file, write_file
+
+def to_str(value):
+    '''
+    Convert the unicode strings in decoded JSON to byte strings,
+    which is what the pymei bindings expect.
+    '''
+
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, list):
+        return [to_str(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((to_str(k), to_str(v)) for k, v in value.items())
+    else:
+        return value
+
+def read_mei(filename):
+    '''
+    Parse an MEI file, which may be gzip compressed.
+    '''
+
+    if is_compressed(filename):
+        return XmlImport.documentFromText(read_file(filename))
+    return XmlImport.read(filename)
+
+def element_data(element):
+    '''
+    Return an element and its descendants as plain data, for JSON.
+    '''
+
+    return {
+        "id": element.getId(),
+        "name": element.getName(),
+        "attributes": dict((a.getName(), a.getValue()) for a in element.getAttributes()),
+        "value": element.getValue(),
+        "children": [element_data(c) for c in element.getChildren()]
+    }
+
 class ModifyDocument:
+
+    # methods that edit the document, in the order they are defined
+    OPERATIONS = (
+        "insert_punctum", "move_neume", "delete_neume", "update_neume_head_shape",
+        "neumify", "ungroup", "insert_division", "move_division", "delete_division",
+        "add_dot", "delete_dot", "insert_clef", "move_clef", "update_clef_shape",
+        "delete_clef", "insert_custos", "insert_system", "insert_system_break",
+        "modify_system_break", "delete_system", "delete_system_break",
+        "update_system_zone", "move_custos", "delete_custos"
+    )
     
-    def __init__(self, filename):
-        self.mei = XmlImport.read(filename)
+    def __init__(self, filename, journal=None, debug=False, history=1000, compress=False):
+        self.mei = read_mei(filename)
         self.filename = filename
+        # whether the document is written out gzip compressed
+        self.compress = compress
+
+        # id -> element and element id -> zone id, kept current by
+        # add_child, add_child_before, remove_child and the zone helpers.
+        # In debug mode they are checked against the tree after every
+        # operation.
+        self.index = {}
+        self.facs = {}
+        # the surface new zones are added to
+        self.surface = None
+        self.index_subtree(self.mei.getRootElement())
+        self.index_structure()
+        self.debug = debug
+
+        # positions from which the n attribute of staves (per section)
+        # and staff definitions is out of date, see number_staves
+        self.stale_staves = {}
+        self.stale_staff_defs = None
+
+        # operations applied since the last save, for the journal and
+        # for rebuilding the document after a failed edit
+        self.journal = journal
+        self.pending = []
+
+        # the version of the document and the elements each of the
+        # last history edits touched, see delta. Replayed edits are
+        # part of the first version.
+        self.changes = ChangeLog(history)
+
+        if journal is not None:
+            self.replay(journal.read())
+
+    def apply(self, operation, *args, **kwargs):
+        '''
+        Apply the named operation and record it for the journal.
+        '''
+
+        self.changes.begin()
+        try:
+            result = getattr(self, operation)(*args, **kwargs)
+        finally:
+            # a failed operation may have changed the tree already
+            self.changes.end()
+
+        self.pending.append({"op": operation, "args": list(args), "kwargs": kwargs, "result": result})
+
+        if self.debug:
+            errors = self.check_index()
+            if errors:
+                raise AssertionError("element index out of date after %s: %s" % (operation, "; ".join(errors)))
+
+        return result
+
+    def replay(self, entries):
+        '''
+        Apply the operations recorded in a journal. Elements created
+        during replay get new generated ids, which are changed to the
+        recorded ids as soon as each operation returns, so the recorded
+        arguments of later operations refer to them as they are.
+        '''
+
+        for entry in entries:
+            args = to_str(entry["args"])
+            kwargs = to_str(entry["kwargs"])
+            result = getattr(self, str(entry["op"]))(*args, **kwargs)
+            self.restore_ids(to_str(entry["result"]), result)
+
+    def restore_ids(self, recorded, replayed):
+        '''
+        Rename the elements in the result of a replayed operation to
+        the ids in the recorded result.
+        '''
+
+        if isinstance(recorded, dict) and isinstance(replayed, dict):
+            for key in recorded:
+                self.restore_ids(recorded[key], replayed.get(key))
+        elif isinstance(recorded, list) and isinstance(replayed, list):
+            for r, n in zip(recorded, replayed):
+                self.restore_ids(r, n)
+        elif isinstance(recorded, str) and replayed and recorded != replayed:
+            self.rename(replayed, recorded)
+
+    def save(self):
+        '''
+        Persist the operations applied since the last save. Without
+        a journal the whole document is written out. With one, the
+        operations are appended to it, and the document is only
+        written out in full once the journal is full.
+        '''
+
+        if self.journal is None:
+            self.write_doc()
+            self.pending = []
+            return
+
+        self.journal.append(self.pending)
+        self.pending = []
+
+        if self.journal.full:
+            self.compact()
+
+    def compact(self):
+        '''
+        Fold the journal into a fresh snapshot of the document.
+        '''
+
+        if self.journal is None:
+            return
+
+        tmp = self.filename + ".tmp"
+        self.write_doc(filename=tmp)
+        self.journal.reset(tmp)
+        self.pending = []
+
+    @property
+    def version(self):
+        return self.changes.version
+
+    def delta(self, since):
+        '''
+        Return the elements and zones added, changed and removed after
+        the given version as {"added": [...], "changed": [...],
+        "removed": [ids]}, or None if the change history does not reach
+        back that far. Added and changed elements come with their
+        attributes, their subtree and their position: the id of their
+        parent and of the sibling they come before. An element that
+        moved is changed, and elements may also be listed with their
+        parent, so clients should apply removals first and replace
+        elements they already have.
+        '''
+
+        # staff numbers are derived lazily, but are part of the changes
+        self.number_staves()
+
+        changes = self.changes.since(since)
+        if changes is None:
+            return None
+
+        delta = {"added": [], "changed": [], "removed": []}
+        for id, kind in changes.items():
+            element = self.get_element(id)
+            if element is None:
+                # elements added and removed again were never seen
+                if kind != "added":
+                    delta["removed"].append(id)
+            elif kind == "added":
+                delta["added"].append(self.describe(element))
+            else:
+                delta["changed"].append(self.describe(element))
+        return delta
+
+    def describe(self, element):
+        '''
+        Return an element and its position as plain data, for JSON.
+        '''
+
+        data = element_data(element)
+        data["parent"] = None
+        data["before"] = None
+
+        parent = element.getParent()
+        if parent:
+            data["parent"] = parent.getId()
+            peers = [p.getId() for p in element.getPeers()]
+            position = peers.index(element.getId())
+            if position + 1 < len(peers):
+                data["before"] = peers[position + 1]
+        return data
 
     def write_doc(self, **kwargs):
         '''
         Write the modified MEI document out to a file,
-        clobbering the input file, if no filename parameter
+        replacing the input file, if no filename parameter
         is provided.
         '''
 
+        self.number_staves()
         if 'filename' in kwargs:
-            filename = kwargs['filename']
+            self.export(kwargs['filename'])
         else:
-            filename = self.filename
+            # write a new file and move it over the old one, so the
+            # backup, which may be a hard link to the input file, is
+            # left alone and readers never see a half written file
+            tmp = self.filename + ".tmp"
+            self.export(tmp)
+            os.rename(tmp, self.filename)
+
+    def text(self):
+        '''
+        Return the modified MEI document as text.
+        '''
+
+        self.number_staves()
+        return XmlExport.meiDocumentToText(self.mei)
 
-        XmlExport.write(self.mei, filename)
+    def export(self, filename):
+        if self.compress:
+            write_file(filename, XmlExport.meiDocumentToText(self.mei), compress=True)
+        else:
+            XmlExport.write(self.mei, filename)
 
     def insert_punctum(self, before_id, pname, oct, dot_form, ulx, uly, lrx, lry):
         '''
@@ -52,17 +293,17 @@ class ModifyDocument:
         # perform the insertion
         if before_id is None:
             # get last layer
-            layers = self.mei.getElementsByName("layer")
-            if len(layers):
-                layers[-1].addChild(punctum)
+            layer = self.last_layer()
+            if layer is not None:
+                self.add_child(layer, punctum)
         else:
-            before = self.mei.getElementById(before_id)
+            before = self.get_element(before_id)
 
             # get layer element
             parent = before.getParent()
 
             if parent and before:
-                parent.addChildBefore(before, punctum)
+                self.add_child_before(parent, before, punctum)
 
         # get the generated ID for the client
         result = {"id": punctum.getId()}
@@ -75,47 +316,47 @@ class ModifyDocument:
         If the neume moves position relative to other elements, re-insert
         the neume before a given MeiElement.
         '''
-        neume = self.mei.getElementById(id)
+        neume = self.get_element(id)
 
         # if the neume moves vertically, perform a pitch shift
         if pitch_info is not None:
             notes = neume.getDescendantsByName("note")
             if len(notes):
                 for n, pinfo in zip(notes, pitch_info):
-                    n.addAttribute("pname", str(pinfo["pname"]))
-                    n.addAttribute("oct", str(pinfo["oct"]))
+                    self.set_attribute(n, "pname", str(pinfo["pname"]))
+                    self.set_attribute(n, "oct", str(pinfo["oct"]))
 
         # update the position of the neume in the document
         # first, remove the neume
         parent = neume.getParent()
-        parent.removeChild(neume)
+        self.remove_child(parent, neume)
 
         # re-insert in the correct position
         if before_id is None:
             # get last layer
-            layers = self.mei.getElementsByName("layer")
-            if len(layers):
-                layers[-1].addChild(neume)
+            layer = self.last_layer()
+            if layer is not None:
+                self.add_child(layer, neume)
         else:
-            before = self.mei.getElementById(before_id)
+            before = self.get_element(before_id)
 
             # get layer element
             parent = before.getParent()
 
             if parent and before:
-                parent.addChildBefore(before, neume)
+                self.add_child_before(parent, before, neume)
 
         self.update_or_add_zone(neume, ulx, uly, lrx, lry)
 
     def delete_neume(self, ids):
         for id in ids:
-            element = self.mei.getElementById(id)
+            element = self.get_element(id)
             
             # remove the bounding box attached to this element
             self.remove_zone(element)
             
             # remove the element
-            element.getParent().removeChild(element)
+            self.remove_child(element.getParent(), element)
 
     def update_neume_head_shape(self, id, shape, ulx, uly, lrx, lry):
         """
@@ -124,7 +365,7 @@ class ModifyDocument:
         Update neume name, if the new head shape changes the name.
         """
 
-        neume = self.mei.getElementById(id)
+        neume = self.get_element(id)
         
         nc = neume.getChildrenByName("nc")[0]
 
@@ -162,7 +403,8 @@ class ModifyDocument:
             neume_name = "stropha"
             nc.setAttributes([])
 
-        neume.addAttribute("name", neume_name)
+        self.changed(nc)
+        self.set_attribute(neume, "name", neume_name)
 
         self.update_or_add_zone(neume, ulx, uly, lrx, lry)
         
@@ -202,7 +444,7 @@ class ModifyDocument:
 
         iNote = 0
         for id in ids:
-            ref_neume = self.mei.getElementById(str(id))
+            ref_neume = self.get_element(str(id))
             if ref_neume:
                 # get underlying notes
                 notes = ref_neume.getDescendantsByName("note")
@@ -238,27 +480,25 @@ class ModifyDocument:
         new_neume.setChildren(ncs)
 
         # insert the new neume
-        before = self.mei.getElementById(ids[0])
+        before = self.get_element(ids[0])
         parent = before.getParent()
 
         if before and parent:
-            parent.addChildBefore(before, new_neume)
+            self.add_child_before(parent, before, new_neume)
 
         # remove the old neumes from the mei document
         for id in ids:
-            neume = self.mei.getElementById(str(id))
+            neume = self.get_element(str(id))
             if neume:
                 # remove facs data
-                facs = neume.getAttribute("facs")
-                if facs:
-                    facsid = facs.value
-                    # Remove the zone if it exists
-                    zone = self.mei.getElementById(str(facsid))
-                    if zone and zone.name == "zone":
-                        zone.parent.removeChild(zone)
+                self.remove_zone(neume)
 
                 # now remove the neume
-                neume.parent.removeChild(neume)
+                self.remove_child(neume.parent, neume)
+
+        # the moved notes left the index with the old neumes
+        if new_neume.getParent():
+            self.index_subtree(new_neume)
 
         # update bounding box data
         self.update_or_add_zone(new_neume, ulx, uly, lrx, lry)
@@ -274,12 +514,13 @@ class ModifyDocument:
 
         newids = []
         for id, bbox in zip(ids, bboxes):
-            ref_neume = self.mei.getElementById(id)
+            ref_neume = self.get_element(id)
             parent = ref_neume.getParent()
 
             # get underlying notes
             notes = ref_neume.getDescendantsByName("note")
             nids = []
+            puncta = []
             for n, bb in zip(notes, bbox):
                 punctum = MeiElement("neume")
                 punctum.addAttribute("name", "punctum")
@@ -294,18 +535,23 @@ class ModifyDocument:
                 self.update_or_add_zone(punctum, str(bb["ulx"]), str(bb["uly"]), str(bb["lrx"]), str(bb["lry"]))
 
                 # insert the punctum before the reference neume
-                parent.addChildBefore(ref_neume, punctum)
+                self.add_child_before(parent, ref_neume, punctum)
+                puncta.append(punctum)
 
             newids.append(nids)
 
             # delete the old neume
-            neume = self.mei.getElementById(id)
+            neume = self.get_element(id)
             if neume:
                 # remove bounding box information
                 self.remove_zone(neume)
 
                 # now remove the neume
-                neume.getParent().removeChild(neume)
+                self.remove_child(neume.getParent(), neume)
+
+            # the moved notes left the index with the old neume
+            for punctum in puncta:
+                self.index_subtree(punctum)
         
         result = {"nids": newids}
         return result
@@ -323,13 +569,13 @@ class ModifyDocument:
         division.addAttribute("form", type)
         self.update_or_add_zone(division, ulx, uly, lrx, lry)
 
-        before = self.mei.getElementById(before_id)
+        before = self.get_element(before_id)
 
         # get layer element
         layer = before.getParent()
 
         if layer and before:
-            layer.addChildBefore(before, division)
+            self.add_child_before(layer, before, division)
 
             if type == "final":
                 # if final division, close layer and staff
@@ -348,44 +594,37 @@ class ModifyDocument:
                     # add element to the new staff/layer
                     new_layer.addChild(e)
                     # remove element from the current staff/layer
-                    layer.removeChild(e)
+                    self.remove_child(layer, e)
 
                 new_staff.addChild(new_layer)
 
                 # insert new staff into the document
-                staves = section_parent.getChildrenByName("staff")
-                s_ind = list(staves).index(staff)
-                if s_ind+1 < len(staves):
+                staves = self.staves_of(section_parent)
+                num_staves = len(staves)
+                s_ind = staves.position(staff.getId())
+                next_staff_id = staves.following(staff.getId())
+                if next_staff_id is not None:
                     # there are staff elements after the new staff to insert
-                    before_staff = staves[s_ind+1]
-
-                    # update staff numbers staves
-                    for i, s in enumerate(staves[s_ind+1:]):
-                        s.addAttribute("n", str(s_ind+i+3))
-
-                    section_parent.addChildBefore(before_staff, new_staff)
+                    before_staff = self.get_element(next_staff_id)
+                    self.add_child_before(section_parent, before_staff, new_staff)
                 else:
-                    section_parent.addChild(new_staff)
+                    self.add_child(section_parent, new_staff)
 
-                new_staff.addAttribute("n", str(s_ind+2))
+                # the new staff and the staves after it are numbered on output
+                self.renumber_staves(section_parent.getId(), s_ind+1)
                 
-                # insert and update staff definitions
-                staff_group = self.mei.getElementsByName("staffGrp")
-                if len(staff_group):
-                    staff_defs = staff_group[0].getChildrenByName("staffDef")
-                    if len(staff_defs) == len(staves):
+                # insert staff definition
+                if self.staff_group is not None:
+                    staff_defs = self.staff_defs
+                    if len(staff_defs) == num_staves:
                         staff_def = MeiElement("staffDef")
-                        staff_def.addAttribute("n", str(s_ind+2))
                         if s_ind+1 < len(staff_defs):
-                            before_staff_def = staff_defs[s_ind+1]
-
-                            # update staff number for all following staff defs
-                            for i, sd in enumerate(staff_defs[s_ind+1:]):
-                                sd.addAttribute("n", str(s_ind+i+3))
-
-                            staff_group[0].addChildBefore(before_staff_def, staff_def)
+                            before_staff_def = self.get_element(staff_defs.ids[s_ind+1])
+                            self.add_child_before(self.staff_group, before_staff_def, staff_def)
                         else:
-                            staff_group[0].addChild(staff_def)
+                            self.add_child(self.staff_group, staff_def)
+
+                        self.renumber_staff_defs(s_ind+1)
 
         result = {"id": division.getId()}
         return result
@@ -400,7 +639,7 @@ class ModifyDocument:
         comes from final divisions, where elements have to be shifted.
         '''
 
-        division = self.mei.getElementById(id)
+        division = self.get_element(id)
         self.update_or_add_zone(division, ulx, uly, lrx, lry)
 
         # move the position of the division in the document
@@ -414,31 +653,30 @@ class ModifyDocument:
             # if final division, close layer and staff
             staff = layer.getParent()
             section = staff.getParent()
-            staves = section.getChildrenByName("staff")
-            s_ind = list(staves).index(staff)
+            next_staff_id = self.staves_of(section).following(staff.getId())
 
-            if s_ind+1 < len(staves):
-                next_staff = staves[s_ind+1]
+            if next_staff_id is not None:
+                next_staff = self.get_element(next_staff_id)
                 next_staff_layer = next_staff.getChildrenByName("layer")
                 if len(next_staff_layer):
                     # add elements from subsequent staff/layer to this staff/layer
                     next_staff_elements = next_staff_layer[0].getChildren()
 
                     # remove the next staff/layer from the MEI document
-                    section.removeChild(next_staff)
+                    self.remove_child(section, next_staff)
 
                     for e in next_staff_elements:
-                        layer.addChild(e)
+                        self.add_child(layer, e)
 
         # remove the division from the document
-        layer.removeChild(division)
+        self.remove_child(layer, division)
         
-        before = self.mei.getElementById(before_id)
+        before = self.get_element(before_id)
         # get layer element
         layer_before = before.getParent()
 
         if layer_before and before:
-            layer_before.addChildBefore(before, division)
+            self.add_child_before(layer_before, before, division)
 
             if final_division:
                 # if final division, close layer and staff
@@ -457,26 +695,23 @@ class ModifyDocument:
                     # add element to the new staff/layer
                     new_layer.addChild(e)
                     # remove element from the current staff/layer
-                    layer.removeChild(e)
+                    self.remove_child(layer, e)
 
                 new_staff.addChild(new_layer)
 
                 # insert new staff into the document
-                staves = section.getChildrenByName("staff")
-                s_ind = list(staves).index(staff)
-                if s_ind+1 < len(staves):
+                staves = self.staves_of(section)
+                s_ind = staves.position(staff.getId())
+                next_staff_id = staves.following(staff.getId())
+                if next_staff_id is not None:
                     # there are staff elements after the new staff to insert
-                    before_staff = staves[s_ind+1]
-
-                    # update staff numbers staves
-                    for i, s in enumerate(staves[s_ind+1:]):
-                        s.addAttribute("n", str(s_ind+i+3))
-
-                    section.addChildBefore(before_staff, new_staff)
+                    before_staff = self.get_element(next_staff_id)
+                    self.add_child_before(section, before_staff, new_staff)
                 else:
-                    section.addChild(new_staff)
+                    self.add_child(section, new_staff)
 
-                new_staff.addAttribute("n", str(s_ind+2))
+                # the new staff and the staves after it are numbered on output
+                self.renumber_staves(section.getId(), s_ind+1)
 
     def delete_division(self, ids):
         '''
@@ -486,7 +721,7 @@ class ModifyDocument:
         '''
 
         for id in ids:
-            division = self.mei.getElementById(id)
+            division = self.get_element(id)
             self.remove_zone(division)
 
             if division.getAttribute("form").getValue() == "final":
@@ -494,47 +729,45 @@ class ModifyDocument:
                 staff = layer.getParent()
                 section = staff.getParent()
 
-                staves = section.getChildrenByName("staff")
-                s_ind = list(staves).index(staff)
+                staves = self.staves_of(section)
+                num_staves = len(staves)
+                s_ind = staves.position(staff.getId())
+                next_staff_id = staves.following(staff.getId())
 
                 # get elements from next staff/layer, if any
                 # and move them to the previous staff/layer
-                if s_ind+1 < len(staves):
-                    next_layer = staves[s_ind+1].getChildrenByName("layer")
+                if next_staff_id is not None:
+                    next_staff = self.get_element(next_staff_id)
+                    next_layer = next_staff.getChildrenByName("layer")
                     if len(next_layer):
                         elements = next_layer[0].getChildren()
 
                         # remove the next staff/layer
-                        section.removeChild(staves[s_ind+1])
+                        self.remove_child(section, next_staff)
 
                         # add these elements to the previous staff/layer
                         for e in elements:
-                            layer.addChild(e)
+                            self.add_child(layer, e)
 
                         # remove the staffDef for the removed layer
-                        staff_group = self.mei.getElementsByName("staffGrp")
-                        if len(staff_group):
-                            staff_defs = staff_group[0].getChildrenByName("staffDef")
-                            if len(staff_defs) == len(staves):
-                                # renumber subsequent staff defs
-                                for i, sd in enumerate(staff_defs[s_ind+2:]):
-                                    sd.addAttribute("n", str(s_ind+i+2))
+                        if self.staff_group is not None:
+                            staff_defs = self.staff_defs
+                            if len(staff_defs) == num_staves:
+                                self.remove_child(self.staff_group, self.get_element(staff_defs.ids[s_ind+1]))
+                                self.renumber_staff_defs(s_ind+1)
 
-                                staff_group[0].removeChild(staff_defs[s_ind+1])
-
-                        # renumber subsequent staves
-                        for i, s in enumerate(staves[s_ind+2:]):
-                            s.addAttribute("n", str(s_ind+i+2))
+                        # subsequent staves are renumbered on output
+                        self.renumber_staves(section.getId(), s_ind+1)
 
             # delete the division
-            division.getParent().removeChild(division)
+            self.remove_child(division.getParent(), division)
 
     def add_dot(self, id, form, ulx, uly, lrx, lry):
         '''
         Add a dot ornament to a given element.
         '''
 
-        punctum = self.mei.getElementById(id)
+        punctum = self.get_element(id)
         # check that a neume with one note is given
         notes = punctum.getDescendantsByName("note")
         if punctum.getName() == "neume" and len(notes) == 1:
@@ -543,7 +776,7 @@ class ModifyDocument:
                 if len(notes[0].getChildrenByName("dot")) == 0:
                     dot = MeiElement("dot")
                     dot.addAttribute("form", form)
-                    notes[0].addChild(dot)
+                    self.add_child(notes[0], dot)
 
             self.update_or_add_zone(punctum, ulx, uly, lrx, lry)
 
@@ -552,7 +785,7 @@ class ModifyDocument:
         Remove a dot ornament to a given element.
         '''
 
-        punctum = self.mei.getElementById(id)
+        punctum = self.get_element(id)
         # check that a punctum element was provided
         if punctum.getName() == "neume":
             note = punctum.getDescendantsByName("note")
@@ -560,7 +793,7 @@ class ModifyDocument:
                 dot = note[0].getChildrenByName("dot")
                 # if a dot exists
                 if len(dot) == 1:
-                    note[0].removeChild(dot[0])
+                    self.remove_child(note[0], dot[0])
 
             self.update_or_add_zone(punctum, ulx, uly, lrx, lry)
 
@@ -576,11 +809,11 @@ class ModifyDocument:
         clef.addAttribute("line", line)
 
         # perform clef insertion
-        before = self.mei.getElementById(before_id)
+        before = self.get_element(before_id)
         parent = before.getParent()
 
         if parent and before:
-            parent.addChildBefore(before, clef)
+            self.add_child_before(parent, before, clef)
 
         self.update_or_add_zone(clef, ulx, uly, lrx, lry)
         self.update_pitched_elements(pitch_info)
@@ -596,10 +829,10 @@ class ModifyDocument:
         octave) of all pitched elements on the affected staff.
         '''
 
-        clef = self.mei.getElementById(id)
+        clef = self.get_element(id)
 
         # update staff line the clef is on
-        clef.addAttribute("line", line)
+        self.set_attribute(clef, "line", line)
 
         self.update_or_add_zone(clef, ulx, uly, lrx, lry)
         self.update_pitched_elements(pitch_info)
@@ -612,10 +845,10 @@ class ModifyDocument:
         affected staff to correspond with the new clef shape.
         '''
 
-        clef = self.mei.getElementById(id)
+        clef = self.get_element(id)
 
         # update clef shape
-        clef.addAttribute("shape", shape.upper())
+        self.set_attribute(clef, "shape", shape.upper())
 
         self.update_or_add_zone(clef, ulx, uly, lrx, lry)
         self.update_pitched_elements(pitch_info)
@@ -630,11 +863,11 @@ class ModifyDocument:
         '''
 
         for c in clef_data:
-            clef = self.mei.getElementById(str(c["id"]))
+            clef = self.get_element(str(c["id"]))
             # remove the clef bounding box
             self.remove_zone(clef)
             # remove the clef
-            clef.getParent().removeChild(clef)
+            self.remove_child(clef.getParent(), clef)
 
             if c["pitchInfo"] is not None:
                 self.update_pitched_elements(c["pitchInfo"])
@@ -652,13 +885,13 @@ class ModifyDocument:
             custos.addAttribute("oct", oct)
 
         # insert the custos
-        before = self.mei.getElementById(before_id)
+        before = self.get_element(before_id)
 
         # get layer element
         parent = before.getParent()
 
         if parent and before:
-            parent.addChildBefore(before, custos)
+            self.add_child_before(parent, before, custos)
 
         # update the bounding box
         self.update_or_add_zone(custos, ulx, uly, lrx, lry)
@@ -675,8 +908,8 @@ class ModifyDocument:
         system = MeiElement("system")
 
         # add system to page
-        page = self.mei.getElementById(page_id)
-        page.addChild(system)
+        page = self.get_element(page_id)
+        self.add_child(page, system)
 
         # update system bounding box
         self.update_or_add_zone(system, ulx, uly, lrx, lry)
@@ -697,14 +930,14 @@ class ModifyDocument:
 
         # Perform insertion.  If we have no next reference, just add to last layer.
         if next_sb_id is None:
-            layers = self.mei.getElementsByName("layer")
-            if len(layers):
-                layers[-1].addChild(sb)
+            layer = self.last_layer()
+            if layer is not None:
+                self.add_child(layer, sb)
         else:
-            next_sb = self.mei.getElementById(str(next_sb_id))
+            next_sb = self.get_element(str(next_sb_id))
             parent = next_sb.getParent()
             if parent and next_sb:
-                parent.addChildBefore(next_sb, sb)
+                self.add_child_before(parent, next_sb, sb)
 
         result = {"id": sb.getId()}
         return result
@@ -715,8 +948,8 @@ class ModifyDocument:
         '''
 
         # modify system
-        sb = self.mei.getElementById(sb_id)
-        sb.addAttribute("n", order_number)
+        sb = self.get_element(sb_id)
+        self.set_attribute(sb, "n", order_number)
 
         result = {"id": sb_id}
         return result
@@ -728,11 +961,11 @@ class ModifyDocument:
         '''
 
         for id in ids:
-            system = self.mei.getElementById(id)
+            system = self.get_element(id)
             # remove the bounding box data
             self.remove_zone(system)
             # remove the system from the document
-            system.getParent().removeChild(system)
+            self.remove_child(system.getParent(), system)
 
     def delete_system_break(self, ids):
         '''
@@ -740,9 +973,9 @@ class ModifyDocument:
         '''
         
         for id in ids:
-            sb = self.mei.getElementById(id)
+            sb = self.get_element(id)
             # remove the system from the document
-            sb.getParent().removeChild(sb)
+            self.remove_child(sb.getParent(), sb)
 
     def update_system_zone(self, system_id, ulx, uly, lrx, lry):
         '''
@@ -750,7 +983,7 @@ class ModifyDocument:
         '''
 
         # modify system
-        system = self.mei.getElementById(system_id)
+        system = self.get_element(system_id)
         if system:
             self.update_or_add_zone(system, ulx, uly, lrx, lry)
 
@@ -760,10 +993,10 @@ class ModifyDocument:
         Also update the bounding box information.
         '''
 
-        custos = self.mei.getElementById(id)
+        custos = self.get_element(id)
         if pname and oct:
-            custos.addAttribute("pname", str(pname))
-            custos.addAttribute("oct", str(oct))
+            self.set_attribute(custos, "pname", str(pname))
+            self.set_attribute(custos, "oct", str(oct))
 
         self.update_or_add_zone(custos, ulx, uly, lrx, lry)
 
@@ -774,32 +1007,263 @@ class ModifyDocument:
         '''
 
         for id in ids:
-            custos = self.mei.getElementById(id)
+            custos = self.get_element(id)
             # remove the bounding box data
             self.remove_zone(custos)
             # remove the custos from the document
-            custos.getParent().removeChild(custos)
+            self.remove_child(custos.getParent(), custos)
 
     # HELPER FUNCTIONS
+    def get_element(self, id):
+        '''
+        Look up an element of the document by id.
+        Returns None if there is no such element.
+        '''
+
+        return self.index.get(id)
+
+    def set_attribute(self, element, name, value):
+        element.addAttribute(name, value)
+        self.changed(element)
+
+    def changed(self, element):
+        # elements that are not in the document yet are added, not changed
+        if element.getId() in self.index:
+            self.changes.record(element.getId(), "changed")
+
+    def add_child(self, parent, child):
+        parent.addChild(child)
+        self.index_subtree(child)
+        self.changes.record(child.getId(), "added")
+
+        order = self.order_of(parent, child)
+        if order is not None:
+            order.append(child.getId())
+
+    def add_child_before(self, parent, before, child):
+        parent.addChildBefore(before, child)
+        self.index_subtree(child)
+        self.changes.record(child.getId(), "added")
+
+        order = self.order_of(parent, child)
+        if order is not None:
+            if before.getId() in order:
+                order.insert_before(before.getId(), child.getId())
+            else:
+                order.rebuild(c.getId() for c in parent.getChildrenByName(child.getName()))
+
+    def remove_child(self, parent, child):
+        parent.removeChild(child)
+        self.unindex_subtree(child)
+        self.changes.record(child.getId(), "removed")
+
+        order = self.order_of(parent, child)
+        if order is not None and child.getId() in order:
+            order.remove(child.getId())
+
+    def index_structure(self):
+        '''
+        Record the order of the staves in each section and of the
+        staff definitions in the first staff group. Staves placed in
+        other elements are ordered once they are needed, see staves_of.
+        '''
+
+        sections = self.mei.getElementsByName("section")
+        self.sections = [section.getId() for section in sections]
+        self.staves = {}
+        for section in sections:
+            self.staves[section.getId()] = SequenceIndex(s.getId() for s in section.getChildrenByName("staff"))
+
+        staff_groups = self.mei.getElementsByName("staffGrp")
+        if len(staff_groups):
+            self.staff_group = staff_groups[0]
+            self.staff_defs = SequenceIndex(sd.getId() for sd in self.staff_group.getChildrenByName("staffDef"))
+        else:
+            self.staff_group = None
+            self.staff_defs = SequenceIndex()
+
+    def order_of(self, parent, child):
+        '''
+        Return the sequence index that orders child among its
+        siblings, if it is a staff or a staff definition.
+        '''
+
+        name = child.getName()
+        if name == "staff":
+            # the staves of other parents are ordered once they are needed
+            return self.staves.get(parent.getId())
+        elif name == "staffDef" and self.staff_group is not None and parent.getId() == self.staff_group.getId():
+            return self.staff_defs
+        return None
+
+    def staves_of(self, parent):
+        '''
+        Return the sequence index of the staves of a section, or of
+        any other element staves are placed in.
+        '''
+
+        staves = self.staves.get(parent.getId())
+        if staves is None:
+            staves = SequenceIndex(s.getId() for s in parent.getChildrenByName("staff"))
+            self.staves[parent.getId()] = staves
+        return staves
+
+    def renumber_staves(self, section_id, start):
+        '''
+        Mark the staff numbers of a section as out of date from
+        the given position on.
+        '''
+
+        stale = self.stale_staves.get(section_id)
+        if stale is None or start < stale:
+            self.stale_staves[section_id] = start
+
+    def renumber_staff_defs(self, start):
+        '''
+        Mark the staff definition numbers as out of date from
+        the given position on.
+        '''
+
+        if self.stale_staff_defs is None or start < self.stale_staff_defs:
+            self.stale_staff_defs = start
+
+    def number_staves(self):
+        '''
+        Set the n attribute of the staves and staff definitions that
+        moved since they were last numbered to their position, counting
+        from 1. Staff numbers are only derived when the document is
+        written out, or when a caller needs them, so inserting or
+        deleting a final division does not renumber every following
+        staff each time.
+        '''
+
+        for section_id, start in self.stale_staves.items():
+            for i, sid in enumerate(self.staves[section_id].ids[start:]):
+                self.set_attribute(self.get_element(sid), "n", str(start+i+1))
+        self.stale_staves = {}
+
+        if self.stale_staff_defs is not None:
+            start = self.stale_staff_defs
+            for i, sdid in enumerate(self.staff_defs.ids[start:]):
+                self.set_attribute(self.get_element(sdid), "n", str(start+i+1))
+            self.stale_staff_defs = None
+
+    def last_layer(self):
+        '''
+        Return the last layer of the document, or None.
+        '''
+
+        for section_id in reversed(self.sections):
+            for staff_id in reversed(self.staves[section_id].ids):
+                layers = self.get_element(staff_id).getChildrenByName("layer")
+                if len(layers):
+                    return layers[-1]
+
+        # staves outside sections
+        layers = self.mei.getElementsByName("layer")
+        if len(layers):
+            return layers[-1]
+        return None
+
+    def rename(self, id, new_id):
+        '''
+        Give the element with the given id another id, re-keying the
+        element index, the zone references and the staff order.
+        '''
+
+        element = self.index.pop(id, None)
+        if element is None:
+            return
+
+        element.setId(new_id)
+        self.index[new_id] = element
+
+        if id in self.facs:
+            self.facs[new_id] = self.facs.pop(id)
+        if element.getName() == "zone":
+            for eid, zone_id in self.facs.items():
+                if zone_id == id:
+                    self.index[eid].addAttribute("facs", new_id)
+                    self.facs[eid] = new_id
+
+        parent = element.getParent()
+        order = self.order_of(parent, element) if parent else None
+        if order is not None and id in order:
+            order.rebuild(c.getId() for c in parent.getChildrenByName(element.getName()))
+        if id in self.staves:
+            self.staves[new_id] = self.staves.pop(id)
+            self.sections = [new_id if s == id else s for s in self.sections]
+            if id in self.stale_staves:
+                self.stale_staves[new_id] = self.stale_staves.pop(id)
+
+    def index_subtree(self, element):
+        for e in [element] + list(element.getDescendants()):
+            self.index[e.getId()] = e
+
+            facs = e.getAttribute("facs")
+            if facs:
+                self.facs[e.getId()] = facs.getValue()
+
+            if self.surface is None and e.getName() == "surface":
+                self.surface = e
+
+    def unindex_subtree(self, element):
+        for e in [element] + list(element.getDescendants()):
+            self.index.pop(e.getId(), None)
+            self.facs.pop(e.getId(), None)
+
+    def check_index(self):
+        '''
+        Compare the element index with the document tree.
+        Returns a list of discrepancies.
+        '''
+
+        root = self.mei.getRootElement()
+        elements = [root] + list(root.getDescendants())
+        ids = set(e.getId() for e in elements)
+
+        errors = []
+        for id in ids - set(self.index):
+            errors.append("%s is not indexed" % id)
+        for id in set(self.index) - ids:
+            errors.append("%s is indexed but not in the document" % id)
+        for id, element in self.index.items():
+            if element.getId() != id:
+                errors.append("%s is indexed as %s" % (element.getId(), id))
+
+        facs = {}
+        for e in elements:
+            if e.getAttribute("facs"):
+                facs[e.getId()] = e.getAttribute("facs").getValue()
+        if facs != self.facs:
+            errors.append("zone references out of date")
+
+        for parent_id, staves in self.staves.items():
+            parent = self.index.get(parent_id)
+            if parent is not None and [st.getId() for st in parent.getChildrenByName("staff")] != staves.ids:
+                errors.append("staff order of %s out of date" % parent_id)
+        if self.staff_group is not None and [sd.getId() for sd in self.staff_group.getChildrenByName("staffDef")] != self.staff_defs.ids:
+            errors.append("staffDef order out of date")
+
+        return errors
+
     def update_or_add_zone(self, element, ulx, uly, lrx, lry):
         '''
         Update the bounding box information attached to an element
         '''
 
-        facsid = element.getAttribute("facs")
-        if facsid:
-            zone = self.mei.getElementById(facsid.getValue())
-        else:
+        zone = self.get_zone(element)
+        if zone is None:
             zone = MeiElement("zone")
-            element.addAttribute("facs", zone.getId())
-            surfaces = self.mei.getElementsByName("surface")
-            if len(surfaces):
-                surfaces[0].addChild(zone)
+            self.set_attribute(element, "facs", zone.getId())
+            self.facs[element.getId()] = zone.getId()
+            if self.surface is not None:
+                self.add_child(self.surface, zone)
 
-        zone.addAttribute("ulx", ulx)
-        zone.addAttribute("uly", uly)
-        zone.addAttribute("lrx", lrx)
-        zone.addAttribute("lry", lry)
+        self.set_attribute(zone, "ulx", ulx)
+        self.set_attribute(zone, "uly", uly)
+        self.set_attribute(zone, "lrx", lrx)
+        self.set_attribute(zone, "lry", lry)
 
     def remove_zone(self, element):
         '''
@@ -807,19 +1271,30 @@ class ModifyDocument:
         from the document
         '''
 
-        facs_id = element.getAttribute("facs")
-        if facs_id:
-            zone = self.mei.getElementById(facs_id.getValue())
-            zone.getParent().removeChild(zone)
+        zone = self.get_zone(element)
+        if zone is not None:
+            self.remove_child(zone.getParent(), zone)
+            del self.facs[element.getId()]
+
+    def get_zone(self, element):
+        '''
+        Return the zone holding the bounding box of an element,
+        or None if it has none.
+        '''
+
+        zone = self.index.get(self.facs.get(element.getId()))
+        if zone is not None and zone.getName() == "zone":
+            return zone
+        return None
 
     def update_pitched_elements(self, pitch_info):
         for ele in pitch_info:
-            pitched_ele = self.mei.getElementById(str(ele["id"]))
+            pitched_ele = self.get_element(str(ele["id"]))
             if pitched_ele.getName() == "custos":
-                pitched_ele.addAttribute("pname", str(ele["noteInfo"]["pname"]))
-                pitched_ele.addAttribute("oct", str(ele["noteInfo"]["oct"]))
+                self.set_attribute(pitched_ele, "pname", str(ele["noteInfo"]["pname"]))
+                self.set_attribute(pitched_ele, "oct", str(ele["noteInfo"]["oct"]))
             elif pitched_ele.getName() == "neume":
                 notes = pitched_ele.getDescendantsByName("note")
                 for n_info, n in zip(ele["noteInfo"], notes):
-                    n.addAttribute("pname", str(n_info["pname"]))
-                    n.addAttribute("oct", str(n_info["oct"]))
+                    self.set_attribute(n, "pname", str(n_info["pname"]))
+                    self.set_attribute(n, "oct", str(n_info["oct"]))
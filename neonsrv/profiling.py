@@ -0,0 +1,171 @@
+import cProfile
+import fnmatch
+import os
+import random
+import re
+import sys
+import time
+
+# file suffix of each output format
+FORMATS = {"pstats": ".prof", "collapsed": ".collapsed"}
+
+def frame_name(code):
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+class StackProfiler(object):
+    '''
+    Records the time spent in each distinct call stack of the calling
+    thread, for flame graphs. Stacks start at the function enable is
+    called from.
+    '''
+
+    def __init__(self):
+        self.stacks = {}
+        self.stack = []
+        self.last = None
+
+    def enable(self):
+        self.last = time.time()
+        sys.setprofile(self.trace)
+
+    def disable(self):
+        sys.setprofile(None)
+        self.stack = []
+
+    def trace(self, frame, event, arg):
+        now = time.time()
+        if self.stack:
+            key = ";".join(self.stack)
+            self.stacks[key] = self.stacks.get(key, 0.0) + now - self.last
+
+        if event == "call":
+            self.stack.append(frame_name(frame.f_code))
+        elif event == "c_call":
+            self.stack.append("%s (builtin)" % getattr(arg, "__name__", "?"))
+        elif event in ("return", "c_return", "c_exception") and self.stack:
+            self.stack.pop()
+
+        self.last = time.time()
+
+    def dump(self, path):
+        '''
+        Write the stacks in the collapsed format of flamegraph.pl:
+        one line per stack, with the microseconds spent in it.
+        '''
+
+        fp = open(path, "w")
+        try:
+            for stack, seconds in sorted(self.stacks.items()):
+                fp.write("%s %d\n" % (stack, seconds * 1000000))
+        finally:
+            fp.close()
+
+class Profile(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.name is None:
+            self.profile = None
+        elif self.profiler.format == "collapsed":
+            self.profile = StackProfiler()
+        else:
+            self.profile = cProfile.Profile()
+
+        if self.profile is not None:
+            self.profile.enable()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profiler.save(self.profile, self.name)
+
+class Profiler(object):
+    '''
+    Profiles the work done for a sample of requests: a fraction rate
+    of them, and every request whose path matches one of the regular
+    expressions in routes or whose file matches one of the patterns
+    in files. Profiles are written to directory, in the pstats format
+    or as collapsed stacks, and the oldest are removed once there are
+    more than keep. Without a directory nothing is profiled.
+    '''
+
+    def __init__(self, directory, rate=0.0, routes=(), files=(), format="pstats", keep=100):
+        if format not in FORMATS:
+            raise ValueError("unknown profile format %r" % format)
+
+        self.directory = directory
+        self.rate = rate
+        self.routes = [re.compile(route) for route in routes]
+        self.files = list(files)
+        self.format = format
+        self.keep = keep
+
+    def wants(self, path, file):
+        '''
+        Return whether a request for path, about file, is profiled.
+        '''
+
+        if not self.directory:
+            return False
+        if any(route.search(path) for route in self.routes):
+            return True
+        if file is not None and any(fnmatch.fnmatch(file, pattern) for pattern in self.files):
+            return True
+        return self.rate > 0 and random.random() < self.rate
+
+    def profile(self, name):
+        '''
+        Return a context manager profiling its block in the calling
+        thread and saving the profile under name. With name None,
+        nothing is profiled.
+        '''
+
+        return Profile(self, name)
+
+    def save(self, profile, name):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        name = re.sub(r"[^\w.-]+", "_", name)
+        filename = "%s-%03d-%d-%s%s" % (time.strftime("%Y%m%d-%H%M%S"), time.time() * 1000 % 1000,
+                                        os.getpid(), name, FORMATS[self.format])
+        path = os.path.join(self.directory, filename)
+
+        # readers only ever see complete profiles
+        tmp = path + ".tmp"
+        if isinstance(profile, StackProfiler):
+            profile.dump(tmp)
+        else:
+            profile.dump_stats(tmp)
+        os.rename(tmp, path)
+
+        for old in self.recent()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, old["name"]))
+            except OSError:
+                pass
+
+    def recent(self):
+        '''
+        Return the name, size and time of the saved profiles, newest first.
+        '''
+
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(tuple(FORMATS.values())):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            profiles.append({"name": name, "size": st.st_size, "time": st.st_mtime})
+
+        profiles.sort(key=lambda p: (p["time"], p["name"]), reverse=True)
+        return profiles
@@ -0,0 +1,229 @@
+import bisect
+import hashlib
+import re
+import urllib
+
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.log import app_log
+
+# requests that use the state of one document or page image: parsed
+# documents, their locks, versions and edit sockets, tile cutting.
+# The key is the path of the file.
+DOCUMENT_ROUTES = [re.compile(pattern) for pattern in (
+    r"/edit/(.+?\.mei)(?:/|$)",
+    r"/file/(.+\.mei)$",
+    r"/delta/(.+)$",
+    r"/tiles/(.+?)(?:\.dzi$|_files/)",
+)]
+
+# set on requests passed on to another process, which handles them
+# whatever it thinks their owner is. Only trusted on the 127.0.0.1
+# listeners the processes pass requests to each other on.
+FORWARDED_HEADER = "X-Neon-Forwarded"
+
+# headers that only concern one connection
+HOP_HEADERS = ("Connection", "Keep-Alive", "Proxy-Connection", "Transfer-Encoding",
+               "Te", "Trailer", "Upgrade", "Content-Length")
+
+def document_key(path, prefix=""):
+    '''
+    Return the file a request path is about, or None if it is not
+    about a document or page image.
+    '''
+
+    if prefix and path.startswith(prefix):
+        path = path[len(prefix):]
+
+    for pattern in DOCUMENT_ROUTES:
+        match = pattern.match(path)
+        if match:
+            return urllib.unquote(match.group(1))
+    return None
+
+class HashRing(object):
+    '''
+    Consistent hashing of keys to nodes. Each node is placed on the
+    ring replicas times, and a key belongs to the node that follows
+    its hash, so adding or removing a node only moves the keys of
+    that node.
+    '''
+
+    def __init__(self, nodes, replicas=100):
+        self.nodes = list(nodes)
+        self.ring = sorted((self.hash("%s-%d" % (node, i)), node)
+                           for node in self.nodes for i in range(replicas))
+        self.hashes = [h for h, node in self.ring]
+
+    @staticmethod
+    def hash(key):
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+    def node(self, key):
+        '''
+        Return the node a key belongs to.
+        '''
+
+        if not self.ring:
+            return None
+        i = bisect.bisect(self.hashes, self.hash(key)) % len(self.ring)
+        return self.ring[i][1]
+
+class AffinityApplication(tornado.web.Application):
+    '''
+    The application of one of several server processes, numbered
+    worker, that also listen on 127.0.0.1 at ports[worker]. Each
+    document belongs to one process. Requests for it that reach
+    another process are passed on to its owner, so everything kept
+    in memory about a document lives in one process, without any
+    locking across processes. Other requests are handled wherever
+    they arrive.
+
+    The application serving the 127.0.0.1 port is created with trusted
+    set, and handles the requests other processes pass on to it. Clients
+    of the public port cannot claim a request was passed on.
+    '''
+
+    def __init__(self, handlers, worker, ports, prefix="", trusted=False, **settings):
+        super(AffinityApplication, self).__init__(handlers, **settings)
+        self.worker = worker
+        self.ports = ports
+        self.prefix = prefix
+        self.trusted = trusted
+        self.ring = HashRing(range(len(ports)))
+
+    def owner(self, path):
+        '''
+        Return the number of the process that handles a request path.
+        '''
+
+        key = document_key(path, self.prefix)
+        if key is None:
+            return self.worker
+        return self.ring.node(key)
+
+    def find_handler(self, request, **kwargs):
+        if not self.trusted:
+            request.headers.pop(FORWARDED_HEADER, None)
+
+        owner = self.owner(request.path)
+        if owner == self.worker or FORWARDED_HEADER in request.headers:
+            return super(AffinityApplication, self).find_handler(request, **kwargs)
+
+        if request.headers.get("Upgrade", "").lower() == "websocket":
+            handler = SocketProxyHandler
+        else:
+            handler = ProxyHandler
+        return self.get_handler_delegate(request, handler, {"port": self.ports[owner]})
+
+class ProxyHandler(tornado.web.RequestHandler):
+    '''
+    Passes a request on to the process listening on 127.0.0.1 at port,
+    and its response back.
+    '''
+
+    SUPPORTED_METHODS = ("GET", "HEAD", "POST", "PUT", "DELETE", "OPTIONS")
+
+    def initialize(self, port):
+        self.port = port
+
+    @gen.coroutine
+    def forward(self, *args):
+        headers = self.request.headers.copy()
+        for name in HOP_HEADERS:
+            headers.pop(name, None)
+        headers[FORWARDED_HEADER] = "1"
+        headers.setdefault("X-Real-Ip", self.request.remote_ip)
+
+        body = self.request.body if self.request.method in ("POST", "PUT") else None
+        request = HTTPRequest("http://127.0.0.1:%d%s" % (self.port, self.request.uri),
+                              method=self.request.method, headers=headers, body=body,
+                              follow_redirects=False, decompress_response=False,
+                              allow_nonstandard_methods=True, request_timeout=600)
+        response = yield AsyncHTTPClient().fetch(request, raise_error=False)
+        if response.code == 599:
+            app_log.error("server process at port %d unavailable: %s", self.port, response.error)
+            raise tornado.web.HTTPError(502)
+
+        self.clear()
+        self.set_status(response.code, response.reason)
+        for name in list(self._headers.keys()):
+            self.clear_header(name)
+        for name, value in response.headers.get_all():
+            if name not in HOP_HEADERS:
+                self.add_header(name, value)
+
+        if response.body and response.code not in (204, 304) and self.request.method != "HEAD":
+            self.write(response.body)
+
+    get = head = post = put = delete = options = forward
+
+class SocketProxyHandler(tornado.websocket.WebSocketHandler):
+    '''
+    Relays the messages of a WebSocket to and from the process
+    listening on 127.0.0.1 at port.
+    '''
+
+    def initialize(self, port):
+        self.port = port
+        self.upstream = None
+        # messages received before the upstream socket is open
+        self.pending = []
+
+    @gen.coroutine
+    def open(self, *args):
+        request = HTTPRequest("ws://127.0.0.1:%d%s" % (self.port, self.request.uri),
+                              headers={FORWARDED_HEADER: "1"})
+        try:
+            upstream = yield tornado.websocket.websocket_connect(request)
+        except Exception, e:
+            app_log.error("server process at port %d unavailable: %s", self.port, e)
+            self.close(1011, "document server unavailable")
+            return
+
+        if self.pending is None:
+            # closed in the meantime
+            upstream.close()
+            return
+
+        self.upstream = upstream
+        for message in self.pending:
+            upstream.write_message(message)
+        self.pending = None
+
+        # newer tornado versions only deliver messages once open returns
+        tornado.ioloop.IOLoop.current().spawn_callback(self.relay, upstream)
+
+    @gen.coroutine
+    def relay(self, upstream):
+        '''
+        Pass the messages of the upstream socket on until either
+        socket closes.
+        '''
+
+        while True:
+            message = yield upstream.read_message()
+            if message is None:
+                self.close(upstream.close_code, upstream.close_reason)
+                return
+            try:
+                self.write_message(message)
+            except tornado.websocket.WebSocketClosedError:
+                upstream.close()
+                return
+
+    def on_message(self, message):
+        if self.upstream is None:
+            self.pending.append(message)
+        else:
+            self.upstream.write_message(message)
+
+    def on_close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+        self.pending = None
@@ -0,0 +1,96 @@
+from bisect import bisect_left
+
+class SequenceIndex(object):
+    '''
+    An ordered sequence of unique ids that answers "position of",
+    "next after" and "last" without scanning. Every id carries an
+    integer order key; keys are kept sorted, so positions are found by
+    bisection. New ids get a key halfway between their neighbours, and
+    the keys are spread out again when two neighbours run out of room.
+    '''
+
+    SPACING = 1 << 16
+
+    def __init__(self, ids=()):
+        self.rebuild(ids)
+
+    def rebuild(self, ids):
+        self.ids = list(ids)
+        self.keys = [(i + 1) * self.SPACING for i in range(len(self.ids))]
+        self.key_of = dict(zip(self.ids, self.keys))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self.key_of
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def position(self, id):
+        '''
+        Return the position of id in the sequence.
+        '''
+
+        return bisect_left(self.keys, self.key_of[id])
+
+    def following(self, id):
+        '''
+        Return the id following the given id, or None if it is the last.
+        '''
+
+        pos = self.position(id) + 1
+        if pos < len(self.ids):
+            return self.ids[pos]
+        return None
+
+    def after(self, id):
+        '''
+        Return the ids following the given id.
+        '''
+
+        return self.ids[self.position(id) + 1:]
+
+    def last(self):
+        if self.ids:
+            return self.ids[-1]
+        return None
+
+    def append(self, id):
+        if self.keys:
+            key = self.keys[-1] + self.SPACING
+        else:
+            key = self.SPACING
+        self.ids.append(id)
+        self.keys.append(key)
+        self.key_of[id] = key
+
+    def insert_before(self, before_id, id):
+        '''
+        Insert id in front of before_id.
+        '''
+
+        pos = self.position(before_id)
+        if pos > 0:
+            low = self.keys[pos - 1]
+        else:
+            low = 0
+        high = self.keys[pos]
+
+        if high - low < 2:
+            # no room between the neighbours, spread all keys out again
+            self.ids.insert(pos, id)
+            self.rebuild(self.ids)
+            return
+
+        key = (low + high) // 2
+        self.ids.insert(pos, id)
+        self.keys.insert(pos, key)
+        self.key_of[id] = key
+
+    def remove(self, id):
+        pos = self.position(id)
+        del self.ids[pos]
+        del self.keys[pos]
+        del self.key_of[id]
@@ -0,0 +1,74 @@
+import gzip
+import os
+import shutil
+
+GZIP_MAGIC = "\x1f\x8b"
+
+def is_compressed(path):
+    '''
+    Return whether a file is gzip compressed.
+    '''
+
+    fp = open(path, "rb")
+    try:
+        return fp.read(2) == GZIP_MAGIC
+    finally:
+        fp.close()
+
+def read_file(path):
+    '''
+    Return the contents of a file, decompressed if it is gzip
+    compressed.
+    '''
+
+    fp = open(path, "rb")
+    try:
+        compressed = fp.read(2) == GZIP_MAGIC
+        fp.seek(0)
+        if compressed:
+            return gzip.GzipFile(fileobj=fp, mode="rb").read()
+        return fp.read()
+    finally:
+        fp.close()
+
+def gzip_writer(fp, level):
+    # no name or time in the header, so equal contents compress equally
+    return gzip.GzipFile(filename="", mode="wb", fileobj=fp, compresslevel=level, mtime=0)
+
+def write_file(path, data, compress=False, level=6):
+    '''
+    Write data to a file, gzip compressed if compress is set.
+    '''
+
+    fp = open(path, "wb")
+    try:
+        if compress:
+            gz = gzip_writer(fp, level)
+            gz.write(data)
+            gz.close()
+        else:
+            fp.write(data)
+    finally:
+        fp.close()
+
+def compress_file(path, level=6):
+    '''
+    Gzip compress a file in place, unless it is compressed already.
+    '''
+
+    if is_compressed(path):
+        return
+
+    tmp = path + ".tmp"
+    src = open(path, "rb")
+    try:
+        dst = open(tmp, "wb")
+        try:
+            gz = gzip_writer(dst, level)
+            shutil.copyfileobj(src, gz)
+            gz.close()
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    os.rename(tmp, path)
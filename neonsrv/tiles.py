@@ -0,0 +1,201 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from doccache import file_stamp
+
+# directory next to the page images where their pyramids are kept
+TILE_DIRECTORY = "tiles"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+def find_image(root, name):
+    '''
+    Return the path of the page image called name (a path relative
+    to root without extension), or None if there is none.
+    '''
+
+    root = os.path.abspath(root)
+    base = os.path.abspath(os.path.join(root, name))
+    if not base.startswith(root + os.sep):
+        return None
+
+    for ext in IMAGE_EXTENSIONS:
+        if os.path.isfile(base + ext):
+            return base + ext
+    return None
+
+def level_count(width, height):
+    '''
+    Number of levels in the pyramid of an image, from 1x1 up to
+    full resolution.
+    '''
+
+    return (max(width, height) - 1).bit_length() + 1
+
+def level_size(width, height, level):
+    '''
+    Size of the image at the given level.
+    '''
+
+    scale = 2 ** (level_count(width, height) - 1 - level)
+    return (int(math.ceil(width / float(scale))), int(math.ceil(height / float(scale))))
+
+def tile_grid(size, tile_size):
+    '''
+    Number of columns and rows of tiles an image of the given size is cut into.
+    '''
+
+    return (int(math.ceil(size[0] / float(tile_size))), int(math.ceil(size[1] / float(tile_size))))
+
+def tile_box(size, col, row, tile_size, overlap):
+    '''
+    The (left, top, right, bottom) box of a tile, including the pixels
+    it shares with its neighbours.
+    '''
+
+    left = max(col * tile_size - overlap, 0)
+    top = max(row * tile_size - overlap, 0)
+    right = min((col + 1) * tile_size + overlap, size[0])
+    bottom = min((row + 1) * tile_size + overlap, size[1])
+    return (left, top, right, bottom)
+
+class TilePyramid(object):
+    '''
+    Deep Zoom tile pyramid of a page image, kept on disk in a directory
+    next to the image. Each level halves the size of the one above,
+    down to a single pixel at level 0. Levels are cut one at a time
+    when first needed, so opening a page only costs the levels it is
+    displayed at. Tiles cut from an older version of the image are
+    thrown away.
+
+    The pyramid itself is not locked; callers must make sure a level
+    is not cut by two threads at the same time.
+    '''
+
+    INFO = "pyramid.json"
+
+    def __init__(self, image_path, tile_size=256, overlap=1, format="jpg", quality=85):
+        self.image_path = image_path
+        self.path = os.path.join(os.path.dirname(image_path), TILE_DIRECTORY, os.path.basename(image_path))
+
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.format = format
+        self.quality = quality
+
+    def info(self):
+        '''
+        Return the width, height and number of levels of the image,
+        starting a new pyramid if the image has changed.
+        '''
+
+        info_path = os.path.join(self.path, self.INFO)
+        settings = [self.tile_size, self.overlap, self.format, self.quality]
+        stamp = list(file_stamp(self.image_path))
+
+        try:
+            fp = open(info_path, "r")
+            try:
+                info = json.load(fp)
+            finally:
+                fp.close()
+        except (IOError, ValueError):
+            info = None
+
+        if info is not None and info["stamp"] == stamp and info["settings"] == settings:
+            return info
+
+        # tiles are missing or stale
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+        width, height = Image.open(self.image_path).size
+        info = {
+            "stamp": stamp,
+            "settings": settings,
+            "width": width,
+            "height": height,
+            "levels": level_count(width, height)
+        }
+
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        fp = os.fdopen(fd, "w")
+        try:
+            json.dump(info, fp)
+        finally:
+            fp.close()
+        os.rename(tmp, info_path)
+
+        return info
+
+    def dzi(self):
+        '''
+        Return the Deep Zoom descriptor of the pyramid.
+        '''
+
+        info = self.info()
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="%d" Overlap="%d" Format="%s">'
+                '<Size Width="%d" Height="%d"/></Image>\n'
+                % (self.tile_size, self.overlap, self.format, info["width"], info["height"]))
+
+    def level_path(self, level):
+        return os.path.join(self.path, str(level))
+
+    def tile_path(self, level, col, row):
+        return os.path.join(self.level_path(level), "%d_%d.%s" % (col, row, self.format))
+
+    def has_level(self, level):
+        return os.path.isdir(self.level_path(level))
+
+    def cut_level(self, level):
+        '''
+        Cut all tiles of a level. Raises ValueError if the pyramid has
+        no such level.
+        '''
+
+        info = self.info()
+        if not 0 <= level < info["levels"]:
+            raise ValueError("no level %d" % level)
+        if self.has_level(level):
+            return
+
+        if self.format == "jpg":
+            mode = "RGB"
+            options = {"format": "JPEG", "quality": self.quality}
+        else:
+            mode = "RGBA"
+            options = {"format": "PNG"}
+
+        size = level_size(info["width"], info["height"], level)
+        image = Image.open(self.image_path)
+        if size != image.size:
+            # let the JPEG decoder scale down by up to 8x first, which
+            # is far cheaper than decoding the full resolution scan
+            image.draft("RGB", size)
+        if image.mode not in ("L", mode):
+            image = image.convert(mode)
+        if size != image.size:
+            image = image.resize(size, Image.ANTIALIAS)
+
+        # cut into a scratch directory, so a level is never seen half done
+        tmp = tempfile.mkdtemp(dir=self.path)
+        try:
+            cols, rows = tile_grid(size, self.tile_size)
+            for col in range(cols):
+                for row in range(rows):
+                    tile = image.crop(tile_box(size, col, row, self.tile_size, self.overlap))
+                    tile.save(os.path.join(tmp, "%d_%d.%s" % (col, row, self.format)), **options)
+            os.rename(tmp, self.level_path(level))
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
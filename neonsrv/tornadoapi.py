@@ -1,17 +1,426 @@
 import os
 
-from modifymei import ModifyDocument
+from catalog import Catalog
+from doccache import DocumentCache, file_stamp
+from doclock import DocumentLocks
+from journal import Journal, JOURNAL_SUFFIX, journal_stamp
+from metrics import CONTENT_TYPE, Registry
+from modifymei import ModifyDocument, to_str
+from profiling import Profiler
+from workers import EditExecutor
 
 import tornado.web
+import tornado.websocket
+from tornado import gen
+from tornado.log import access_log, app_log
 import json
 
 import conf
 
+# request and document metrics of this process, served at /metrics.
+# With the process edit executor, documents are parsed, edited and
+# written in the worker processes, whose timings are not reported.
+metrics = Registry()
+request_seconds = metrics.histogram("neon_request_duration_seconds",
+    "Time from receiving a request to finishing the response.", ("handler", "method"))
+requests_total = metrics.counter("neon_requests_total",
+    "Requests handled, by response status.", ("handler", "method", "code"))
+parse_seconds = metrics.histogram("neon_document_parse_seconds",
+    "Time spent parsing MEI files, including replaying their journals.")
+mutate_seconds = metrics.histogram("neon_document_mutate_seconds",
+    "Time spent applying edit operations to parsed documents.", ("operation",))
+serialize_seconds = metrics.histogram("neon_document_serialize_seconds",
+    "Time spent writing edited documents out, or appending to their journals.")
+
+def load_document(fname):
+    '''
+    Parse an MEI file, replaying its journal in journal mode.
+    '''
+
+    if conf.JOURNAL:
+        journal = Journal(fname, conf.JOURNAL_MAX_OPS, conf.JOURNAL_MAX_BYTES)
+    else:
+        journal = None
+
+    with parse_seconds.time():
+        return ModifyDocument(fname, journal=journal, debug=conf.DEBUG_INDEX,
+                              history=conf.DELTA_HISTORY, compress=conf.COMPRESS_MEI)
+
+# parsed MEI documents shared by all edit handlers. Worker processes
+# cannot be flushed from the IOLoop, so they always write through.
+documents = DocumentCache(load_document, conf.DOCUMENT_CACHE_SIZE,
+                          write_behind=conf.WRITE_BEHIND and conf.EDIT_EXECUTOR != "process",
+                          quiet=conf.WRITE_BEHIND_QUIET,
+                          max_delay=conf.WRITE_BEHIND_MAX_DELAY,
+                          stamp=journal_stamp if conf.JOURNAL else file_stamp,
+                          saved=serialize_seconds.observe)
+
+# serializes edits to the same document
+locks = DocumentLocks()
+
+# parses, modifies and writes documents off the IOLoop
+executor = EditExecutor(conf.EDIT_EXECUTOR, conf.EDIT_WORKERS)
+
+# listings of the MEI files of each document type
+catalog = Catalog(conf.MEI_DIRECTORY, max_age=conf.LISTING_MAX_AGE)
+
+# path of a document -> set of EditSocketHandlers following its edits
+subscribers = {}
+
+# profiles the edit work done for a sample of requests
+profiler = Profiler(conf.PROFILE_DIRECTORY, conf.PROFILE_RATE, conf.PROFILE_ROUTES,
+                    conf.PROFILE_FILES, conf.PROFILE_FORMAT, conf.PROFILE_KEEP)
+
+def document_sizes():
+    root = os.path.abspath(conf.MEI_DIRECTORY)
+    return [((os.path.relpath(path, root),), size) for path, size, md in documents.cached()]
+
+def document_elements():
+    root = os.path.abspath(conf.MEI_DIRECTORY)
+    return [((os.path.relpath(path, root),), len(md.index)) for path, size, md in documents.cached()]
+
+# read from the document cache when the metrics are rendered
+metrics.gauge("neon_document_bytes", "Size on disk of the cached documents.", ("document",), collect=document_sizes)
+metrics.gauge("neon_document_elements", "Number of elements in the cached documents.", ("document",), collect=document_elements)
+
+def log_request(handler):
+    '''
+    Record the latency of a finished request, then log it the way
+    tornado does by default. Used as the log_function setting.
+    '''
+
+    request_time = handler.request.request_time()
+    name = type(handler).__name__
+    request_seconds.observe(request_time, (name, handler.request.method))
+    requests_total.inc((name, handler.request.method, str(handler.get_status())))
+
+    if handler.get_status() < 400:
+        log_method = access_log.info
+    elif handler.get_status() < 500:
+        log_method = access_log.warning
+    else:
+        log_method = access_log.error
+    log_method("%d %s %.2fms", handler.get_status(), handler._request_summary(), 1000.0 * request_time)
+
+class VersionConflict(Exception):
+    '''
+    Raised when an edit is based on a version of a document other than
+    the current one. Carries the current version and the changes made
+    since the version the edit was based on, or None.
+    '''
+
+    def __init__(self, version, delta):
+        Exception.__init__(self, version, delta)
+        self.version = version
+        self.delta = delta
+
+def document_path(file):
+    '''
+    Return the path of an MEI file given relative to MEI_DIRECTORY.
+    '''
+
+    return os.path.join(os.path.abspath(conf.MEI_DIRECTORY), file)
+
+def parse_operations(data):
+    '''
+    Convert decoded JSON operations to (operation, args, kwargs) tuples.
+    data: [{"method": "delete_neume", "args": [["m-1", "m-2"]]}, ...]
+    args may also be an object of keyword arguments. Raises ValueError
+    for anything else.
+    '''
+
+    if not isinstance(data, list):
+        raise ValueError("expected a list of operations")
+
+    operations = []
+    for op in data:
+        if not isinstance(op, dict):
+            raise ValueError("expected an operation object")
+
+        method = to_str(op.get("method"))
+        if method not in ModifyDocument.OPERATIONS:
+            raise ValueError("unknown operation %r" % method)
+
+        args = to_str(op.get("args", []))
+        if isinstance(args, dict):
+            operations.append((method, (), args))
+        elif isinstance(args, list):
+            operations.append((method, args, {}))
+        else:
+            raise ValueError("invalid arguments for %s" % method)
+
+    return operations
+
+def parse_version(value):
+    '''
+    Return the document version in an If-Match header or a version
+    argument, or None if any version will do.
+    '''
+
+    value = value.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"')
+    if value in ("", "*"):
+        return None
+    return int(value)
+
+def delta_response(version, delta):
+    '''
+    Return the JSON response for the changes made to a document up to
+    version, see ModifyDocument.delta.
+    '''
+
+    if delta is None:
+        return {"version": version, "full": True}
+    return dict(delta, version=version, full=False)
+
+def apply_operations(fname, operations, durable=False, changes=False, base=None):
+    '''
+    Apply a list of (operation, args, kwargs) tuples to the cached
+    document in order and commit the document once. Returns the
+    results, the new version of the document and, with changes set,
+    what the operations changed (see ModifyDocument.delta). With base
+    set, raises VersionConflict unless the document is still at that
+    version. Runs in the edit executor while the caller holds the lock
+    of the document.
+    '''
+
+    md = documents.get(fname)
+    since = md.version
+    if base is not None and base != since:
+        raise VersionConflict(since, md.delta(base))
+
+    # edits committed before this batch, but not yet saved
+    unsaved = list(md.pending)
+    try:
+        results = []
+        for operation, args, kwargs in operations:
+            with mutate_seconds.time((operation,)):
+                results.append(md.apply(operation, *args, **kwargs))
+        documents.commit(fname, md, durable=durable)
+    except:
+        # the shared tree may be partially modified
+        restore_document(fname, unsaved)
+        raise
+
+    delta = md.delta(since) if changes else None
+    return results, md.version, delta
+
+def restore_document(fname, unsaved):
+    '''
+    Undo a failed edit: drop the cached document, or, if it has
+    unsaved edits, replace it with the file parsed again with those
+    edits applied, so the whole failed batch is undone and the unsaved
+    edits are still written out later.
+    '''
+
+    if not unsaved:
+        documents.invalidate(fname)
+        return
+
+    md = load_document(fname)
+    md.replay(unsaved)
+    md.pending = unsaved
+    documents.replace(fname, md)
+
+def profile_name(handler, file):
+    '''
+    Return the name to profile the work done for a request under,
+    or None if the request is not profiled.
+    '''
+
+    if profiler.wants(handler.request.path, file):
+        return "%s-%s" % (type(handler).__name__, file)
+    return None
+
+def profiled(profile, fn, *args):
+    '''
+    Run fn(*args), profiled under the given name unless it is None.
+    Runs in the edit executor, so the document work is profiled and
+    not whatever else the IOLoop is doing.
+    '''
+
+    with profiler.profile(profile):
+        return fn(*args)
+
+def publish(fname, since, version, delta, exclude=None):
+    '''
+    Push the changes made to a document to the sockets following it.
+    '''
+
+    message = delta_response(version, delta)
+    if delta is not None:
+        message["since"] = since
+    message = json.dumps({"changes": message})
+
+    for subscriber in list(subscribers.get(fname, ())):
+        if subscriber is not exclude:
+            subscriber.send(message)
+
+def flush_document(fname):
+    '''
+    Write out unwritten edits of a document. Runs in the edit executor
+    while the caller holds the lock of the document.
+    '''
+
+    documents.flush(fname)
+
+def document_file(fname):
+    '''
+    Return the version of a cached document and, if the file on disk
+    does not hold all of its edits, the text of the document, else
+    None. The first read of a file with a journal folds the journal
+    into it instead. Files of documents that are not cached have no
+    version. Runs in the edit executor while the caller holds the lock
+    of the document.
+    '''
+
+    journal = conf.JOURNAL and os.path.exists(fname + JOURNAL_SUFFIX)
+    md = documents.cached(fname)
+    if md is None:
+        if not journal:
+            return None, None
+        md = documents.get(fname)
+        md.compact()
+        documents.update(fname)
+        return md.version, None
+
+    if md.pending or journal:
+        return md.version, md.text()
+    return md.version, None
+
+def document_delta(fname, since):
+    '''
+    Return the current version of a document and its changes since
+    the given version, see ModifyDocument.delta. Runs in the edit
+    executor while the caller holds the lock of the document.
+    '''
+
+    md = documents.get(fname)
+    return md.version, md.delta(since)
+
+@gen.coroutine
+def flush_documents(paths):
+    '''
+    Write out unwritten edits of the given documents without blocking
+    the IOLoop or racing with edits in progress.
+    '''
+
+    for fname in paths:
+        with (yield locks.acquire(fname)):
+            yield executor.run_for(fname, flush_document, fname)
+
+@gen.coroutine
+def edit_document(fname, operations, durable=False, source=None, base=None, profile=None):
+    '''
+    Apply operations to a document under its lock and push the
+    changes to the sockets following it, except the source socket.
+    Returns the results and the new version of the document. Raises
+    VersionConflict if base is given and the document has changed
+    since that version. With profile set, the edit is profiled under
+    that name.
+    '''
+
+    with (yield locks.acquire(fname)):
+        followed = bool(subscribers.get(fname))
+        try:
+            results, version, delta = yield executor.run_for(fname, profiled, profile, apply_operations,
+                                                              fname, operations, durable, followed, base)
+        except VersionConflict:
+            raise
+        except:
+            # the document may have been parsed again
+            if followed:
+                publish(fname, None, None, None)
+            raise
+
+        # published under the lock, so changes arrive in order
+        if followed:
+            publish(fname, version - len(operations), version, delta, exclude=source)
+
+    raise gen.Return((results, version))
+
+class EditHandler(tornado.web.RequestHandler):
+
+    @gen.coroutine
+    def modify(self, file, operation, *args):
+        '''
+        Apply the named ModifyDocument operation to the cached
+        document and commit the document.
+        '''
+
+        results = yield self.apply(file, [(operation, args, {})])
+        raise gen.Return(results[0])
+
+    @gen.coroutine
+    def apply(self, file, operations):
+        '''
+        Apply a list of (operation, args, kwargs) tuples to the cached
+        document in order and commit the document once. Edits to the
+        same document are applied in arrival order, and the work is done
+        in the edit executor so the IOLoop stays responsive. Returns the
+        list of operation results. In write behind mode, clients can pass
+        durable=1 to have the document written to disk before the
+        response is sent.
+
+        The new version of the document is returned as the ETag. Clients
+        can pass the version their view is based on as If-Match or as the
+        version argument; if the document has changed since, nothing is
+        applied and the response is a 409 with the changes made since
+        that version, as from the delta handler.
+        '''
+
+        fname = document_path(file)
+        durable = bool(self.get_argument("durable", None))
+        try:
+            base = parse_version(self.request.headers.get("If-Match") or self.get_argument("version", ""))
+        except ValueError:
+            raise tornado.web.HTTPError(400, "invalid document version")
+
+        try:
+            results, version = yield edit_document(fname, operations, durable, base=base,
+                                                   profile=profile_name(self, file))
+        except VersionConflict, e:
+            self.set_status(409)
+            self.set_header("ETag", '"%d"' % e.version)
+            raise tornado.web.Finish(json.dumps(delta_response(e.version, e.delta)))
+
+        self.set_header("ETag", '"%d"' % version)
+        catalog.changed(os.path.dirname(file))
+        raise gen.Return(results)
+
+#####################################################
+#              BATCH HANDLER CLASS                  #
+#####################################################
+class BatchHandler(EditHandler):
+
+    @gen.coroutine
+    def post(self, file):
+        '''
+        Apply an ordered list of operations with a single write.
+        data: [{"method": "delete_neume", "args": [["m-1", "m-2"]]}, ...]
+        args may also be an object of keyword arguments. Responds with
+        {"results": [...]}, one result per operation.
+        '''
+
+        data = json.loads(self.get_argument("data", ""))
+        try:
+            operations = parse_operations(data)
+        except ValueError, e:
+            raise tornado.web.HTTPError(400, str(e))
+
+        results = yield self.apply(file, operations)
+
+        self.write(json.dumps({"results": results}))
+        self.set_status(200)
+
 #####################################################
 #              NEUME HANDLER CLASSES                #
 #####################################################
-class InsertNeumeHandler(tornado.web.RequestHandler):
+class InsertNeumeHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         before_id = str(self.get_argument("beforeid", None))
         pname = str(self.get_argument("pname", ""))
@@ -24,17 +433,14 @@ class InsertNeumeHandler(tornado.web.RequestHandler):
         ulx = str(self.get_argument("ulx", None))
         uly = str(self.get_argument("uly", None))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        result = md.insert_punctum(before_id, pname, oct, dot_form, ulx, uly, lrx, lry)
-        md.write_doc()
+        result = yield self.modify(file, "insert_punctum", before_id, pname, oct, dot_form, ulx, uly, lrx, lry)
 
         self.write(json.dumps(result))
         self.set_status(200)
 
-class ChangeNeumePitchHandler(tornado.web.RequestHandler):
+class ChangeNeumePitchHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         data = json.loads(self.get_argument("data", ""))
 
@@ -49,29 +455,23 @@ class ChangeNeumePitchHandler(tornado.web.RequestHandler):
 
         pitch_info = data["pitchInfo"]
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.move_neume(id, before_id, pitch_info, ulx, uly, lrx, lry)
-        md.write_doc()
+        yield self.modify(file, "move_neume", id, before_id, pitch_info, ulx, uly, lrx, lry)
 
         self.set_status(200)
 
-class DeleteNeumeHandler(tornado.web.RequestHandler):
+class DeleteNeumeHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         ids = str(self.get_argument("ids", ""))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.delete_neume(ids.split(","))
-        md.write_doc()
+        yield self.modify(file, "delete_neume", ids.split(","))
 
         self.set_status(200)
 
-class UpdateNeumeHeadShapeHandler(tornado.web.RequestHandler):
+class UpdateNeumeHeadShapeHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         id = str(self.get_argument("id", ""))
         head_shape = str(self.get_argument("shape", ""))
@@ -80,16 +480,13 @@ class UpdateNeumeHeadShapeHandler(tornado.web.RequestHandler):
         ulx = str(self.get_argument("ulx", None))
         uly = str(self.get_argument("uly", None))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.update_neume_head_shape(id, head_shape, ulx, uly, lrx, lry)
-        md.write_doc()
+        yield self.modify(file, "update_neume_head_shape", id, head_shape, ulx, uly, lrx, lry)
 
         self.set_status(200)
 
-class NeumifyNeumeHandler(tornado.web.RequestHandler):
+class NeumifyNeumeHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):        
         data = json.loads(self.get_argument("data", ""))
         nids = str(data["nids"]).split(",")
@@ -105,29 +502,22 @@ class NeumifyNeumeHandler(tornado.web.RequestHandler):
         except KeyError:
             ulx = uly = lrx = lry = None
         
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        result = md.neumify(nids, type_id, liquescence, head_shapes, ulx, uly, lrx, lry)
-        md.write_doc()
+        result = yield self.modify(file, "neumify", nids, type_id, liquescence, head_shapes, ulx, uly, lrx, lry)
 
         self.write(json.dumps(result))
 
         self.set_status(200)
 
-class UngroupNeumeHandler(tornado.web.RequestHandler):
+class UngroupNeumeHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         data = json.loads(self.get_argument("data", ""))
 
         nids = str(data["nids"]).split(",")
         bboxes = data["bbs"]
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        result = md.ungroup(nids, bboxes)
-        md.write_doc()
+        result = yield self.modify(file, "ungroup", nids, bboxes)
 
         self.write(json.dumps(result))
 
@@ -136,8 +526,9 @@ class UngroupNeumeHandler(tornado.web.RequestHandler):
 #####################################################
 #              DIVISION HANDLER CLASSES             #
 #####################################################
-class InsertDivisionHandler(tornado.web.RequestHandler):
+class InsertDivisionHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         div_type = str(self.get_argument("type", ""))
         before_id = str(self.get_argument("beforeid", None))
@@ -148,17 +539,14 @@ class InsertDivisionHandler(tornado.web.RequestHandler):
         ulx = str(self.get_argument("ulx", None))
         uly = str(self.get_argument("uly", None))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        result = md.insert_division(before_id, div_type, ulx, uly, lrx, lry)
-        md.write_doc()
+        result = yield self.modify(file, "insert_division", before_id, div_type, ulx, uly, lrx, lry)
 
         self.write(json.dumps(result))
         self.set_status(200)
 
-class MoveDivisionHandler(tornado.web.RequestHandler):
+class MoveDivisionHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         id = str(self.get_argument("id", ""))
         before_id = str(self.get_argument("beforeid", None))
@@ -169,29 +557,23 @@ class MoveDivisionHandler(tornado.web.RequestHandler):
         lrx = str(self.get_argument("lrx", None))
         lry = str(self.get_argument("lry", None))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.move_division(id, before_id, ulx, uly, lrx, lry)
-        md.write_doc()
+        yield self.modify(file, "move_division", id, before_id, ulx, uly, lrx, lry)
 
         self.set_status(200)
 
-class DeleteDivisionHandler(tornado.web.RequestHandler):
+class DeleteDivisionHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         ids = str(self.get_argument("ids", ""))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.delete_division(ids.split(","))
-        md.write_doc()
+        yield self.modify(file, "delete_division", ids.split(","))
 
         self.set_status(200)
 
-class AddDotHandler(tornado.web.RequestHandler):
+class AddDotHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):  
         id = str(self.get_argument("id", ""))
         dot_form = str(self.get_argument("dotform", ""))
@@ -202,16 +584,13 @@ class AddDotHandler(tornado.web.RequestHandler):
         lrx = str(self.get_argument("lrx", None))
         lry = str(self.get_argument("lry", None))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.add_dot(id, dot_form, ulx, uly, lrx, lry)
-        md.write_doc()
+        yield self.modify(file, "add_dot", id, dot_form, ulx, uly, lrx, lry)
 
         self.set_status(200)
 
-class DeleteDotHandler(tornado.web.RequestHandler):
+class DeleteDotHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         id = str(self.get_argument("id", ""))
 
@@ -221,19 +600,16 @@ class DeleteDotHandler(tornado.web.RequestHandler):
         lrx = str(self.get_argument("lrx", None))
         lry = str(self.get_argument("lry", None))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.delete_dot(id, ulx, uly, lrx, lry)
-        md.write_doc()
+        yield self.modify(file, "delete_dot", id, ulx, uly, lrx, lry)
 
         self.set_status(200)
 
 #####################################################
 #              CLEF HANDLER CLASSES                 #
 #####################################################
-class MoveClefHandler(tornado.web.RequestHandler):
+class MoveClefHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         data = json.loads(self.get_argument("data", ""))
         clef_id = str(data["id"])
@@ -246,16 +622,13 @@ class MoveClefHandler(tornado.web.RequestHandler):
 
         line = str(data["line"])
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.move_clef(clef_id, line, data["pitchInfo"], ulx, uly, lrx, lry)
-        md.write_doc()
+        yield self.modify(file, "move_clef", clef_id, line, data["pitchInfo"], ulx, uly, lrx, lry)
 
         self.set_status(200)
 
-class UpdateClefShapeHandler(tornado.web.RequestHandler):
+class UpdateClefShapeHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):        
         data = json.loads(self.get_argument("data", ""))
         clef_id = str(data["id"])
@@ -268,16 +641,13 @@ class UpdateClefShapeHandler(tornado.web.RequestHandler):
 
         shape = str(data["shape"])
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.update_clef_shape(clef_id, shape, data["pitchInfo"], ulx, uly, lrx, lry)
-        md.write_doc()
+        yield self.modify(file, "update_clef_shape", clef_id, shape, data["pitchInfo"], ulx, uly, lrx, lry)
 
         self.set_status(200)
 
-class InsertClefHandler(tornado.web.RequestHandler):
+class InsertClefHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         data = json.loads(self.get_argument("data", ""))
         shape = str(data["shape"]).upper()
@@ -290,33 +660,27 @@ class InsertClefHandler(tornado.web.RequestHandler):
         lrx = str(data["lrx"])
         lry = str(data["lry"])
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        result = md.insert_clef(line, shape, data["pitchInfo"], before_id, ulx, uly, lrx, lry)
-        md.write_doc()
+        result = yield self.modify(file, "insert_clef", line, shape, data["pitchInfo"], before_id, ulx, uly, lrx, lry)
 
         self.write(json.dumps(result))
 
         self.set_status(200)
 
-class DeleteClefHandler(tornado.web.RequestHandler):
+class DeleteClefHandler(EditHandler):
+    @gen.coroutine
     def post(self, file):
         clefs_to_delete = json.loads(self.get_argument("data", ""))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.delete_clef(clefs_to_delete)
-        md.write_doc()
+        yield self.modify(file, "delete_clef", clefs_to_delete)
 
         self.set_status(200)
 
 #####################################################
 #              CUSTOS HANDLER CLASSES               #
 #####################################################
-class InsertCustosHandler(tornado.web.RequestHandler):
+class InsertCustosHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         pname = str(self.get_argument("pname", ""))
         oct = str(self.get_argument("oct", ""))
@@ -328,18 +692,15 @@ class InsertCustosHandler(tornado.web.RequestHandler):
         lrx = str(self.get_argument("lrx", None))
         lry = str(self.get_argument("lry", None))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        result = md.insert_custos(pname, oct, before_id, ulx, uly, lrx, lry)
-        md.write_doc()
+        result = yield self.modify(file, "insert_custos", pname, oct, before_id, ulx, uly, lrx, lry)
 
         self.write(json.dumps(result))
 
         self.set_status(200)
 
-class MoveCustosHandler(tornado.web.RequestHandler):
+class MoveCustosHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         custos_id = str(self.get_argument("id", ""))
         pname = self.get_argument("pname", "")
@@ -351,32 +712,26 @@ class MoveCustosHandler(tornado.web.RequestHandler):
         lrx = str(self.get_argument("lrx", None))
         lry = str(self.get_argument("lry", None))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.move_custos(custos_id, pname, oct, ulx, uly, lrx, lry)
-        md.write_doc()
+        yield self.modify(file, "move_custos", custos_id, pname, oct, ulx, uly, lrx, lry)
 
         self.set_status(200)
 
-class DeleteCustosHandler(tornado.web.RequestHandler):
+class DeleteCustosHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         custos_ids = str(self.get_argument("ids", "")).split(",")
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.delete_custos(custos_ids)
-        md.write_doc()
+        yield self.modify(file, "delete_custos", custos_ids)
 
         self.set_status(200)
 
 #####################################################
 #           STAFF/SYSTEM HANDLER CLASSES            #
 #####################################################
-class InsertSystemHandler(tornado.web.RequestHandler):
+class InsertSystemHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         page_id = str(self.get_argument("pageid", None))
         ulx = str(self.get_argument("ulx", None))
@@ -384,77 +739,62 @@ class InsertSystemHandler(tornado.web.RequestHandler):
         lrx = str(self.get_argument("lrx", None))
         lry = str(self.get_argument("lry", None))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        result = md.insert_system(page_id, ulx, uly, lrx, lry)
-        md.write_doc()
+        result = yield self.modify(file, "insert_system", page_id, ulx, uly, lrx, lry)
 
         self.write(json.dumps(result))
 
         self.set_status(200)
 
-class InsertSystemBreakHandler(tornado.web.RequestHandler):
+class InsertSystemBreakHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         system_id = self.get_argument("systemid", None)
         order_number = self.get_argument("ordernumber", None)
         next_sb_id = self.get_argument("nextsbid", None)
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        result = md.insert_system_break(system_id, order_number, next_sb_id)
-        md.write_doc()
+        result = yield self.modify(file, "insert_system_break", system_id, order_number, next_sb_id)
 
         self.write(json.dumps(result))
 
         self.set_status(200)
 
-class ModifySystemBreakHandler(tornado.web.RequestHandler):
+class ModifySystemBreakHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         sb_id = str(self.get_argument("sbid"))
         order_number = str(self.get_argument("ordernumber"))
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        result = md.modify_system_break(sb_id, order_number)
-        md.write_doc()
+        result = yield self.modify(file, "modify_system_break", sb_id, order_number)
 
         self.write(json.dumps(result))
 
         self.set_status(200)
 
-class DeleteSystemBreakHandler(tornado.web.RequestHandler):
+class DeleteSystemBreakHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         sb_ids = str(self.get_argument("sbids", "")).split(",")
 
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.delete_system(sb_ids)
-        md.write_doc()
+        yield self.modify(file, "delete_system", sb_ids)
 
         self.set_status(200)
 
-class DeleteSystemHandler(tornado.web.RequestHandler):
+class DeleteSystemHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         system_ids = str(self.get_argument("sids", "")).split(",")
         
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.delete_system(system_ids)
-        md.write_doc()
+        yield self.modify(file, "delete_system", system_ids)
 
         self.set_status(200)
 
-class UpdateSystemZoneHandler(tornado.web.RequestHandler):
+class UpdateSystemZoneHandler(EditHandler):
 
+    @gen.coroutine
     def post(self, file):
         system_id = str(self.get_argument("sid"))
         ulx = str(self.get_argument("ulx"))
@@ -462,10 +802,180 @@ class UpdateSystemZoneHandler(tornado.web.RequestHandler):
         lrx = str(self.get_argument("lrx"))
         lry = str(self.get_argument("lry"))
         
-        mei_directory = os.path.abspath(conf.MEI_DIRECTORY)
-        fname = os.path.join(mei_directory, file)
-        md = ModifyDocument(fname)
-        md.update_system_zone(system_id, ulx, uly, lrx, lry)
-        md.write_doc()
+        yield self.modify(file, "update_system_zone", system_id, ulx, uly, lrx, lry)
+
+        self.set_status(200)
+
+#####################################################
+#              EDIT SOCKET HANDLER CLASS            #
+#####################################################
+class EditSocketHandler(tornado.websocket.WebSocketHandler):
+    '''
+    A WebSocket for editing a document and following the edits made
+    to it by others. Clients send the operations of the batch handler:
+    {"id": 1, "operations": [{"method": "delete_neume", "args": [...]}, ...]}
+    or a single {"id": 1, "method": ..., "args": ...}, and get a reply
+    {"reply": 1, "results": [...], "version": 17} or {"reply": 1,
+    "error": "..."}. A request may carry the version it is based on
+    as "version"; if the document has changed since, the error is
+    "conflict" and the changes since that version come as "conflict".
+    The changes of every edit made by someone else
+    are pushed as {"changes": {...}}, in the format of the delta
+    handler with the version they apply to added as since.
+    '''
+
+    def open(self, file):
+        self.file = file
+        self.fname = document_path(file)
+        if not os.path.isfile(self.fname):
+            self.close(4004, "no such document")
+            return
+
+        subscribers.setdefault(self.fname, set()).add(self)
+
+    def on_close(self):
+        followers = subscribers.get(self.fname)
+        if followers is not None:
+            followers.discard(self)
+            if not followers:
+                del subscribers[self.fname]
+
+    @gen.coroutine
+    def on_message(self, message):
+        # the next message is only read once this one is applied
+        reply = None
+        try:
+            request = json.loads(message)
+            if not isinstance(request, dict):
+                raise ValueError("expected an object")
+            reply = request.get("id")
+            operations = parse_operations(request.get("operations", [request]))
+            base = request.get("version")
+            if base is not None and not isinstance(base, (int, long)):
+                raise ValueError("invalid document version")
+        except ValueError, e:
+            self.send(json.dumps({"reply": reply, "error": str(e)}))
+            return
+
+        try:
+            results, version = yield edit_document(self.fname, operations, bool(request.get("durable")), source=self,
+                                                   base=base, profile=profile_name(self, self.file))
+        except VersionConflict, e:
+            self.send(json.dumps({"reply": reply, "error": "conflict", "conflict": delta_response(e.version, e.delta)}))
+            return
+        except Exception, e:
+            app_log.exception("edit of %s failed", self.file)
+            self.send(json.dumps({"reply": reply, "error": str(e)}))
+            return
+
+        catalog.changed(os.path.dirname(self.file))
+        self.send(json.dumps({"reply": reply, "results": results, "version": version}))
+
+    def send(self, message):
+        try:
+            self.write_message(message)
+        except tornado.websocket.WebSocketClosedError:
+            pass
+
+#####################################################
+#              DELTA HANDLER CLASS                  #
+#####################################################
+class DeltaHandler(tornado.web.RequestHandler):
+
+    @gen.coroutine
+    def get(self, file):
+        '''
+        Report the elements and zones added, changed or removed since
+        the version given by the since argument:
+        {"version": 17, "full": false, "added": [...], "changed": [...], "removed": [...]}.
+        When the document was parsed again since, or the changes are
+        older than the history kept, responds with {"version": 17,
+        "full": true}, and the client should fetch the whole file and
+        continue from the version in its X-Document-Version header,
+        or from the one reported here if it has none.
+        '''
+
+        try:
+            since = int(self.get_argument("since"))
+        except ValueError:
+            raise tornado.web.HTTPError(400, "since must be a version number")
+
+        fname = document_path(file)
+        if not os.path.isfile(fname):
+            raise tornado.web.HTTPError(404)
+
+        with (yield locks.acquire(fname)):
+            version, delta = yield executor.run_for(fname, profiled, profile_name(self, file), document_delta, fname, since)
+
+        self.set_header("ETag", '"%d"' % version)
+        self.write(json.dumps(delta_response(version, delta)))
+        self.set_status(200)
+
+#####################################################
+#              STATUS HANDLER CLASS                 #
+#####################################################
+class StatusHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        '''
+        Report document cache, edit queue and worker statistics.
+        '''
+
+        self.write(json.dumps({
+            "cache": documents.stats(),
+            "locks": locks.stats(),
+            "executor": executor.stats()
+        }))
+        self.set_status(200)
+
+#####################################################
+#              METRICS HANDLER CLASS                #
+#####################################################
+class MetricsHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        '''
+        Serve the metrics of this process in the Prometheus text
+        format, to the addresses in METRICS_ADDRESSES only.
+        '''
+
+        if self.request.remote_ip not in conf.METRICS_ADDRESSES:
+            raise tornado.web.HTTPError(403)
+
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(metrics.render())
+        self.set_status(200)
+
+#####################################################
+#              PROFILES HANDLER CLASS               #
+#####################################################
+class ProfilesHandler(tornado.web.RequestHandler):
+
+    def get(self, name):
+        '''
+        List the most recent profiles, newest first, or download the
+        named one. Served to the addresses in METRICS_ADDRESSES only.
+        '''
+
+        if self.request.remote_ip not in conf.METRICS_ADDRESSES:
+            raise tornado.web.HTTPError(403)
+
+        profiles = profiler.recent()
+        if not name:
+            self.write(json.dumps({"format": profiler.format, "profiles": profiles}))
+            self.set_status(200)
+            return
+
+        if name not in [p["name"] for p in profiles]:
+            raise tornado.web.HTTPError(404)
+
+        fp = open(os.path.join(profiler.directory, name), "rb")
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
 
+        self.set_header("Content-Type", "application/octet-stream")
+        self.set_header("Content-Disposition", "attachment; filename=%s" % name)
+        self.write(data)
         self.set_status(200)
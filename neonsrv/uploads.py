@@ -0,0 +1,211 @@
+import cgi
+import errno
+import os
+import shutil
+import tempfile
+
+from tornado.httputil import HTTPHeaders
+
+def link_or_copy(src, dst):
+    '''
+    Make dst a hard link to src, replacing dst if it exists. Falls
+    back to a copy where hard links are not supported. Only safe as
+    long as neither file is modified in place.
+    '''
+
+    tmp = dst + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.rename(tmp, dst)
+
+def place(src, dst):
+    '''
+    Move the file src to dst, raising OSError with errno EEXIST if
+    dst already exists.
+    '''
+
+    try:
+        # unlike a rename, linking never replaces an existing file
+        os.link(src, dst)
+    except OSError, e:
+        if e.errno == errno.EEXIST:
+            raise
+        # no hard links, e.g. a different file system
+        if os.path.exists(dst):
+            raise OSError(errno.EEXIST, "file exists", dst)
+        shutil.copyfile(src, dst)
+    os.remove(src)
+
+class SpooledFile(object):
+
+    def __init__(self, filename, content_type, path):
+        # browsers may send the full client side path
+        self.filename = os.path.basename(filename.replace("\\", "/"))
+        self.content_type = content_type
+        self.path = path
+        self.size = 0
+
+class MultipartSpooler(object):
+    '''
+    Incremental multipart/form-data parser. File parts are written to
+    temporary files in directory as the body arrives, so an upload is
+    never held in memory as a whole. Plain fields are kept in memory
+    and may be at most max_field_size bytes each. Malformed bodies
+    raise ValueError. As with tornado, parts without a filename are
+    plain fields.
+
+        spooler = MultipartSpooler(boundary, directory)
+        spooler.feed(chunk)
+        ...
+        spooler.finish()
+        spooler.fields, spooler.files
+        spooler.cleanup()
+    '''
+
+    MAX_HEADER_SIZE = 16 * 1024
+
+    def __init__(self, boundary, directory, max_field_size=64 * 1024):
+        if boundary.startswith('"') and boundary.endswith('"'):
+            boundary = boundary[1:-1]
+        if not boundary:
+            raise ValueError("missing multipart boundary")
+
+        self.delimiter = "\r\n--" + boundary
+        self.directory = directory
+        self.max_field_size = max_field_size
+
+        # name -> list of values / SpooledFiles, like request.arguments
+        self.fields = {}
+        self.files = {}
+
+        # the first delimiter is not preceded by a line break
+        self.buffer = "\r\n"
+        self.state = "preamble"
+        self.name = None
+        self.part = None
+        self.fp = None
+        self.nbytes = 0
+
+    def feed(self, data):
+        self.buffer += data
+        while self.step():
+            pass
+
+    def finish(self):
+        '''
+        Check that the whole body has been received.
+        '''
+
+        if self.state != "epilogue":
+            raise ValueError("incomplete multipart body")
+
+    def cleanup(self):
+        '''
+        Remove spooled files that have not been moved elsewhere.
+        '''
+
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+        for files in self.files.values():
+            for f in files:
+                if os.path.exists(f.path):
+                    os.remove(f.path)
+
+    def step(self):
+        # consume as much of the buffer as possible in the current
+        # state; returns whether there may be more to do
+        if self.state == "preamble":
+            pos = self.buffer.find(self.delimiter)
+            if pos < 0:
+                self.buffer = self.buffer[-len(self.delimiter):]
+                return False
+            self.buffer = self.buffer[pos + len(self.delimiter):]
+            self.state = "delimiter"
+            return True
+
+        elif self.state == "delimiter":
+            if len(self.buffer) < 2:
+                return False
+            if self.buffer.startswith("--"):
+                self.state = "epilogue"
+            elif self.buffer.startswith("\r\n"):
+                self.state = "headers"
+            else:
+                raise ValueError("malformed multipart delimiter")
+            self.buffer = self.buffer[2:]
+            return True
+
+        elif self.state == "headers":
+            pos = self.buffer.find("\r\n\r\n")
+            if pos < 0:
+                if len(self.buffer) > self.MAX_HEADER_SIZE:
+                    raise ValueError("multipart headers too large")
+                return False
+            self.start_part(HTTPHeaders.parse(self.buffer[:pos]))
+            self.buffer = self.buffer[pos + 4:]
+            self.state = "body"
+            return True
+
+        elif self.state == "body":
+            pos = self.buffer.find(self.delimiter)
+            if pos < 0:
+                # keep what could be the start of a delimiter
+                keep = len(self.delimiter) - 1
+                if len(self.buffer) > keep:
+                    self.write(self.buffer[:-keep])
+                    self.buffer = self.buffer[-keep:]
+                return False
+            self.write(self.buffer[:pos])
+            self.buffer = self.buffer[pos + len(self.delimiter):]
+            self.end_part()
+            self.state = "delimiter"
+            return True
+
+        else:
+            # ignore anything after the closing delimiter
+            self.buffer = ""
+            return False
+
+    def start_part(self, headers):
+        disposition, params = cgi.parse_header(headers.get("Content-Disposition", ""))
+        if disposition != "form-data" or not params.get("name"):
+            raise ValueError("invalid multipart part")
+
+        name = params["name"]
+        if params.get("filename"):
+            fd, path = tempfile.mkstemp(dir=self.directory)
+            self.fp = os.fdopen(fd, "wb")
+            self.part = SpooledFile(params["filename"], headers.get("Content-Type", "application/octet-stream"), path)
+            self.files.setdefault(name, []).append(self.part)
+        else:
+            self.part = []
+        self.name = name
+        self.nbytes = 0
+
+    def write(self, data):
+        if not data:
+            return
+
+        self.nbytes += len(data)
+        if self.fp is not None:
+            self.fp.write(data)
+            self.part.size = self.nbytes
+        else:
+            if self.nbytes > self.max_field_size:
+                raise ValueError("multipart field too large")
+            self.part.append(data)
+
+    def end_part(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+        else:
+            self.fields.setdefault(self.name, []).append("".join(self.part))
+        self.part = None
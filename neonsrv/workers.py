@@ -0,0 +1,104 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from tornado import gen
+
+def _timed(fn, args, kwargs):
+    # runs in the worker; returns the result with the start and end times
+    started = time.time()
+    result = fn(*args, **kwargs)
+    return result, started, time.time()
+
+class EditExecutor(object):
+    '''
+    Runs document work off the IOLoop in a pool of worker threads or
+    processes, recording how long jobs wait in the queue separately
+    from how long they run. With processes, the function and its
+    arguments must be picklable, and work for the same key always runs
+    in the same process, see run_for.
+    '''
+
+    def __init__(self, kind="thread", workers=4):
+        if kind == "process":
+            # one pool per process, to choose the process a job runs in
+            self.executors = [ProcessPoolExecutor(1) for i in range(workers)]
+        elif kind == "thread":
+            self.executors = [ThreadPoolExecutor(workers)]
+        else:
+            raise ValueError("unknown executor kind %r" % kind)
+
+        self.kind = kind
+        self.workers = workers
+
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.queued_time = 0.0
+        self.run_time = 0.0
+        self.max_queued_time = 0.0
+        self.max_run_time = 0.0
+        self.submitted = 0
+
+    def run(self, fn, *args, **kwargs):
+        '''
+        Run fn(*args, **kwargs) in a worker and return its result.
+        '''
+
+        return self.run_for(None, fn, *args, **kwargs)
+
+    @gen.coroutine
+    def run_for(self, key, fn, *args, **kwargs):
+        '''
+        Run fn(*args, **kwargs) in a worker and return its result. With
+        processes, work for the same key, such as the path of a document,
+        always runs in the same process, so what that process keeps in
+        memory about it, like a cached document, stays consistent.
+        '''
+
+        submitted = time.time()
+        with self.lock:
+            self.pending += 1
+            self.submitted += 1
+            if key is None:
+                executor = self.executors[self.submitted % len(self.executors)]
+            else:
+                executor = self.executors[hash(key) % len(self.executors)]
+
+        try:
+            result, started, finished = yield executor.submit(_timed, fn, args, kwargs)
+        except:
+            with self.lock:
+                self.pending -= 1
+                self.failed += 1
+            raise
+
+        with self.lock:
+            self.pending -= 1
+            self.completed += 1
+            self.queued_time += started - submitted
+            self.run_time += finished - started
+            self.max_queued_time = max(self.max_queued_time, started - submitted)
+            self.max_run_time = max(self.max_run_time, finished - started)
+
+        raise gen.Return(result)
+
+    def stats(self):
+        with self.lock:
+            completed = self.completed or 1
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "pending": self.pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "mean_queued_time": self.queued_time / completed,
+                "mean_run_time": self.run_time / completed,
+                "max_queued_time": self.max_queued_time,
+                "max_run_time": self.max_run_time
+            }
+
+    def shutdown(self, wait=True):
+        for executor in self.executors:
+            executor.shutdown(wait)
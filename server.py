@@ -1,23 +1,29 @@
 #!/usr/bin/python
 
 import os
+import signal
 
 import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
 
 import conf
 import neonsrv.interface
+import neonsrv.routing
 import neonsrv.tornadoapi
 
-assert tornado.version_info > (2, 0, 0)
+assert tornado.version_info >= (4, 2, 0)
 
 settings = {
     "static_path": os.path.join(os.path.dirname(__file__), "static"),
     "template_path": os.path.join(os.path.dirname(__file__), "templates"),
     "static_url_prefix": conf.APP_ROOT + "static/",
+    "static_handler_class": neonsrv.interface.AssetHandler,
     "debug": conf.DEBUG,
     "cookie_secret": "ONEcookieAHAHAHAHTWOcookiesAHAHAHAH",
+    "log_function": neonsrv.tornadoapi.log_request,
     "gzip": True
 }
 
@@ -28,9 +34,13 @@ def abs_path(relpath):
 rules = [
     (abs_path(r"/editor/(.*?)"), neonsrv.interface.SquareNoteEditorHandler),
     (abs_path(r"/stafflesseditor/(.*?)"), neonsrv.interface.StafflessEditorHandler),
+    (abs_path(r"/tiles/(.*)\.dzi"), neonsrv.interface.DeepZoomHandler),
+    (abs_path(r"/tiles/(.*)_files/(\d+)/(\d+)_(\d+)\.(jpg|png)"), neonsrv.interface.TileHandler),
     (abs_path(r"/file/(.*)/(.*?)"), neonsrv.interface.DemoFileHandler),
     (abs_path(r"/file/(.*?)"), neonsrv.interface.FileHandler),
     (abs_path(r"/edit/(.*?)/(.*?)/revert"), neonsrv.interface.FileRevertHandler),
+    (abs_path(r"/edit/(.*?)/batch"), neonsrv.tornadoapi.BatchHandler),
+    (abs_path(r"/edit/(.*?)/socket"), neonsrv.tornadoapi.EditSocketHandler),
     (abs_path(r"/edit/(.*?)/insert/neume"), neonsrv.tornadoapi.InsertNeumeHandler),
     (abs_path(r"/edit/(.*?)/move/neume"), neonsrv.tornadoapi.ChangeNeumePitchHandler),
     (abs_path(r"/edit/(.*?)/delete/neume"), neonsrv.tornadoapi.DeleteNeumeHandler),
@@ -55,6 +65,12 @@ rules = [
     (abs_path(r"/edit/(.*?)/delete/systembreak"), neonsrv.tornadoapi.DeleteSystemBreakHandler),
     (abs_path(r"/edit/(.*?)/delete/system"), neonsrv.tornadoapi.DeleteSystemHandler),
     (abs_path(r"/edit/(.*?)/update/system/zone"), neonsrv.tornadoapi.UpdateSystemZoneHandler),
+    (abs_path(r"/delta/(.*)"), neonsrv.tornadoapi.DeltaHandler),
+    (abs_path(r"/status"), neonsrv.tornadoapi.StatusHandler),
+    (abs_path(r"/metrics"), neonsrv.tornadoapi.MetricsHandler),
+    (abs_path(r"/profiles/?(.*)"), neonsrv.tornadoapi.ProfilesHandler),
+    (abs_path(r"/jobs/?(.*)"), neonsrv.interface.JobHandler),
+    (abs_path(r"/catalog/?(.*)"), neonsrv.interface.CatalogHandler),
     (abs_path(r"\/?(.*?)"), neonsrv.interface.RootHandler)
 ]
 
@@ -99,8 +115,62 @@ if __name__ == "__main__":
     settings["visible_pages"] = visible_pages
     settings["default"] = default
 
-    application = tornado.web.Application(rules, **settings)
-    
-    server = tornado.httpserver.HTTPServer(application)
-    server.listen(port)
-    tornado.ioloop.IOLoop.instance().start()
+    servers = []
+    if conf.SERVER_PROCESSES > 1:
+        # forked processes cannot reload themselves
+        settings["autoreload"] = False
+
+        sockets = tornado.netutil.bind_sockets(port)
+        first_port = conf.WORKER_PORT or port + 1
+        ports = [first_port + i for i in range(conf.SERVER_PROCESSES)]
+
+        def stop_workers(sig, frame):
+            # the workers are in our process group and shut down cleanly,
+            # after which fork_processes exits
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            os.killpg(0, signal.SIGTERM)
+        signal.signal(signal.SIGTERM, stop_workers)
+
+        # only the workers return, each owning a share of the documents
+        worker = tornado.process.fork_processes(conf.SERVER_PROCESSES)
+        application = neonsrv.routing.AffinityApplication(rules, worker, ports, prefix=conf.get_prefix(), **settings)
+
+        server = tornado.httpserver.HTTPServer(application)
+        server.add_sockets(sockets)
+        servers.append(server)
+
+        # for requests passed on by the other workers
+        internal = neonsrv.routing.AffinityApplication(rules, worker, ports, prefix=conf.get_prefix(),
+                                                       trusted=True, **settings)
+        server = tornado.httpserver.HTTPServer(internal)
+        server.listen(ports[worker], "127.0.0.1")
+        servers.append(server)
+    else:
+        application = tornado.web.Application(rules, **settings)
+
+        server = tornado.httpserver.HTTPServer(application)
+        server.listen(port)
+        servers.append(server)
+
+    io_loop = tornado.ioloop.IOLoop.instance()
+    documents = neonsrv.tornadoapi.documents
+
+    # write out edits held in memory once they are due
+    if documents.write_behind:
+        flush_due = lambda: neonsrv.tornadoapi.flush_documents(documents.due())
+        tornado.ioloop.PeriodicCallback(flush_due, 250).start()
+
+    def shutdown():
+        for server in servers:
+            server.stop()
+        io_loop.stop()
+
+    signal.signal(signal.SIGTERM, lambda sig, frame: io_loop.add_callback_from_signal(shutdown))
+
+    try:
+        io_loop.start()
+    finally:
+        neonsrv.tornadoapi.executor.shutdown()
+        neonsrv.interface.tile_executor.shutdown()
+        neonsrv.interface.derivative_jobs.shutdown()
+        documents.flush_all()
@@ -26,6 +26,7 @@ THE SOFTWARE.
     {
         var elem = $(element);
         var mei;
+        var bgTiles;
         var rendEng;
         var startTime;
 
@@ -35,6 +36,7 @@ THE SOFTWARE.
             glyphpath: "",
             meipath: "",
             bgimgpath: "",
+            bgtilepath: "",
             bgimgopacity: 0.60,
             apiprefix: "",
             origwidth: null,
@@ -116,6 +118,22 @@ THE SOFTWARE.
             console.log("loading background image ...");
             var dfd = $.Deferred();
 
+            if (settings.bgtilepath) {
+                loadTiles().then(dfd.resolve, function() {
+                    // no tiles for this image, use the full image
+                    bgTiles = null;
+                    loadBackgroundImage(dfd);
+                });
+            }
+            else {
+                loadBackgroundImage(dfd);
+            }
+
+            // return promise
+            return dfd.promise();
+        };
+
+        var loadBackgroundImage = function(dfd) {
             if (settings.bgimgpath && !settings.origwidth && !settings.origheight) {
                 fabric.Image.fromURL(settings.bgimgpath, function(img) {
                     settings.origwidth = img.width;
@@ -127,6 +145,71 @@ THE SOFTWARE.
                 // immediately resolve
                 dfd.resolve();
             }
+        };
+
+        // asynchronous function
+        // draws the smallest level of the deep zoom pyramid that is at least
+        // as wide as the canvas, instead of loading the full resolution scan
+        var loadTiles = function() {
+            var dfd = $.Deferred();
+
+            $.get(settings.bgtilepath, function(dzi) {
+                var image = $(dzi).find("Image");
+                var tileSize = parseInt(image.attr("TileSize"));
+                var overlap = parseInt(image.attr("Overlap"));
+                var format = image.attr("Format");
+                var width = parseInt($(dzi).find("Size").attr("Width"));
+                var height = parseInt($(dzi).find("Size").attr("Height"));
+
+                var maxLevel = 0;
+                while (Math.pow(2, maxLevel) < Math.max(width, height)) {
+                    maxLevel++;
+                }
+                var level = maxLevel;
+                while (level > 0 && Math.ceil(width / Math.pow(2, maxLevel - level + 1)) >= settings.width) {
+                    level--;
+                }
+                var scale = Math.pow(2, maxLevel - level);
+                var levelWidth = Math.ceil(width / scale);
+                var levelHeight = Math.ceil(height / scale);
+
+                bgTiles = document.createElement("canvas");
+                bgTiles.width = levelWidth;
+                bgTiles.height = levelHeight;
+                var ctx = bgTiles.getContext("2d");
+
+                var levelpath = settings.bgtilepath.replace(/\.dzi$/, "_files/") + level + "/";
+                var tiles = [];
+                for (var col = 0; col * tileSize < levelWidth; col++) {
+                    for (var row = 0; row * tileSize < levelHeight; row++) {
+                        tiles.push(loadTile(ctx, levelpath + col + "_" + row + "." + format,
+                                            Math.max(col * tileSize - overlap, 0),
+                                            Math.max(row * tileSize - overlap, 0)));
+                    }
+                }
+
+                $.when.apply($, tiles).then(function() {
+                    settings.origwidth = width;
+                    settings.origheight = height;
+                    dfd.resolve();
+                }, dfd.reject);
+            }).fail(dfd.reject);
+
+            // return promise
+            return dfd.promise();
+        };
+
+        // asynchronous function
+        var loadTile = function(ctx, url, x, y) {
+            var dfd = $.Deferred();
+
+            var tile = new Image();
+            tile.onload = function() {
+                ctx.drawImage(tile, x, y);
+                dfd.resolve();
+            };
+            tile.onerror = dfd.reject;
+            tile.src = url;
 
             // return promise
             return dfd.promise();
@@ -174,7 +257,7 @@ THE SOFTWARE.
             var canvas = $("<canvas>").attr("id", settings.canvasid);
 
             var canvasDims = [settings.origwidth, settings.origheight];
-            if (!settings.bgimgpath) {
+            if (!settings.bgimgpath && !bgTiles) {
                 // derive canvas dimensions from mei facs
                 canvasDims = page.calcDimensions($(mei).find("zone"));
             }
@@ -191,12 +274,17 @@ THE SOFTWARE.
             elem.prepend(canvas);
 
             var canvasOpts = {renderOnAddition: false};
-            if (settings.bgimgpath) {
+            if (settings.bgimgpath && !bgTiles) {
                 $.extend(canvasOpts, {backgroundImage: settings.bgimgpath,
                                       backgroundImageOpacity: settings.bgimgopacity,
                                       backgroundImageStretch: true});
             }
             rendEng.setCanvas(new fabric.Canvas(settings.canvasid, canvasOpts));
+            if (bgTiles) {
+                rendEng.canvas.backgroundImage = bgTiles;
+                rendEng.canvas.backgroundImageOpacity = settings.bgimgopacity;
+                rendEng.canvas.backgroundImageStretch = true;
+            }
 
             if (Toe.debug) {
                 // add FPS debug element
@@ -224,7 +312,7 @@ THE SOFTWARE.
 
             // instantiate appropriate GUI elements
             var gui = new Toe.View.GUI(settings.apiprefix, settings.meipath, rendEng,
-                                      {sldr_bgImgOpacity: settings.bgimgpath, 
+                                      {sldr_bgImgOpacity: settings.bgimgpath || settings.bgtilepath, 
                                        initBgImgOpacity: settings.bgimgopacity});
 
             // handle user interactions with glyphs on the digital music score
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.catalog import Catalog
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for d in ("squarenote", "cheironomic", ".uploads"):
+            os.mkdir(os.path.join(self.dir, d))
+        for name in ("b.mei", "a.mei", "c.mei", "a.jpg"):
+            self.touch("squarenote", name)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def touch(self, document_type, name, mtime=None):
+        path = os.path.join(self.dir, document_type, name)
+        open(path, "w").close()
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def testDocumentTypes(self):
+        self.assertEqual(["cheironomic", "squarenote"], Catalog(self.dir).document_types())
+
+    def testPage(self):
+        catalog = Catalog(self.dir)
+        page = catalog.page("squarenote", 1, 1)
+        self.assertEqual(["b.mei"], list(page))
+        self.assertEqual(3, page.total)
+        self.assertEqual(2, page.number)
+        self.assertEqual(3, page.pages)
+
+        self.assertEqual(["a.mei", "b.mei", "c.mei"], list(catalog.page("squarenote")))
+        self.assertEqual(["c.mei"], list(catalog.page("squarenote", filter="C")))
+        self.assertEqual(["c.mei", "b.mei", "a.mei"], list(catalog.page("squarenote", reverse=True)))
+        self.assertRaises(ValueError, catalog.page, "../", 0)
+
+    def testSortByDate(self):
+        catalog = Catalog(self.dir)
+        self.touch("squarenote", "a.mei", 300)
+        self.touch("squarenote", "b.mei", 100)
+        self.touch("squarenote", "c.mei", 200)
+        self.assertEqual(["b.mei", "c.mei", "a.mei"], list(catalog.page("squarenote", sort="mtime")))
+
+        # modifying a file does not touch its directory
+        self.touch("squarenote", "b.mei", 400)
+        catalog.changed("squarenote")
+        self.assertEqual(["c.mei", "a.mei", "b.mei"], list(catalog.page("squarenote", sort="mtime")))
+
+    def testCached(self):
+        """ A directory is only listed again once it changes """
+        catalog = Catalog(self.dir)
+        catalog.page("squarenote")
+        listing = catalog.listing("squarenote")
+        self.assertTrue(listing is catalog.listing("squarenote"))
+
+        catalog.invalidate("squarenote")
+        self.touch("squarenote", "d.mei")
+        self.assertEqual(4, catalog.page("squarenote").total)
+
+    def testSaveKeepsListing(self):
+        """ Replacing a file does not list its directory again """
+        catalog = Catalog(self.dir)
+        listing = catalog.listing("squarenote")
+        self.touch("squarenote", "a.mei.tmp")
+        os.rename(os.path.join(self.dir, "squarenote", "a.mei.tmp"), os.path.join(self.dir, "squarenote", "a.mei"))
+        self.touch("squarenote", "a.mei.journal")
+        self.assertTrue(listing is catalog.listing("squarenote"))
+
+    def testMaxAge(self):
+        """ Files added by others are listed once the listing is old """
+        catalog = Catalog(self.dir, max_age=0)
+        catalog.page("squarenote")
+        self.touch("squarenote", "d.mei")
+        self.assertEqual(4, catalog.page("squarenote").total)
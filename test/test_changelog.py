@@ -0,0 +1,54 @@
+#!/usr/bin/python
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.changelog import ChangeLog
+
+class ChangeLogTest(unittest.TestCase):
+
+    def edit(self, log, *changes):
+        log.begin()
+        for id, kind in changes:
+            log.record(id, kind)
+        log.end()
+
+    def testVersions(self):
+        log = ChangeLog(version=100)
+        self.edit(log, ("n-1", "added"))
+        self.edit(log, ("n-1", "changed"), ("n-2", "removed"))
+        self.assertEqual(102, log.version)
+
+        self.assertEqual({"n-1": "added", "n-2": "removed"}, log.since(100))
+        self.assertEqual({"n-1": "changed", "n-2": "removed"}, log.since(101))
+        self.assertEqual({}, log.since(102))
+        self.assertEqual(None, log.since(103))
+
+    def testFirstKind(self):
+        """ Only the first change to an element within an edit counts """
+        log = ChangeLog(version=0)
+        self.edit(log, ("n-1", "removed"), ("n-1", "added"))
+        self.assertEqual({"n-1": "removed"}, log.since(0))
+
+    def testOutsideEdit(self):
+        log = ChangeLog(version=0)
+        log.record("s-1", "changed")
+        self.assertEqual({}, log.since(0))
+
+        self.edit(log)
+        log.record("s-1", "changed")
+        self.assertEqual({"s-1": "changed"}, log.since(0))
+        self.assertRaises(ValueError, log.record, "s-1", "moved")
+
+    def testTruncated(self):
+        """ Versions older than the history need a full fetch """
+        log = ChangeLog(history=2, version=0)
+        for i in range(3):
+            self.edit(log, ("n-%d" % i, "added"))
+
+        self.assertEqual(None, log.since(0))
+        self.assertEqual({"n-1": "added", "n-2": "added"}, log.since(1))
+
+    def testStartsAtTime(self):
+        self.assertTrue(ChangeLog().version > 1000000000000)
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.derivatives import Image, JobQueue, derivative_path, make_derivatives
+
+def fail():
+    raise ValueError("broken image")
+
+class JobQueueTest(unittest.TestCase):
+
+    def testJobs(self):
+        queue = JobQueue(workers=2)
+        done = queue.submit("add", lambda a, b: a + b, 1, b=2)
+        failed = queue.submit("fail", fail)
+        queue.shutdown()
+
+        self.assertEqual("done", queue.status(done)["state"])
+        self.assertEqual(3, queue.status(done)["result"])
+        self.assertEqual("failed", queue.status(failed)["state"])
+        self.assertEqual("broken image", queue.status(failed)["error"])
+        self.assertEqual(None, queue.status("unknown"))
+        self.assertEqual(1, queue.stats()["completed"])
+        self.assertEqual(1, queue.stats()["failed"])
+
+    def testReturnsImmediately(self):
+        """ Submitting does not wait for the job """
+        queue = JobQueue(workers=1)
+        event = threading.Event()
+        job = queue.submit("wait", event.wait)
+        self.assertTrue(queue.status(job)["state"] in ("queued", "running"))
+        event.set()
+        queue.shutdown()
+        self.assertEqual("done", queue.status(job)["state"])
+
+    def testHistory(self):
+        """ Only the most recent finished jobs are kept """
+        queue = JobQueue(workers=1, history=2)
+        jobs = []
+        for i in range(4):
+            jobs.append(queue.submit("job", int, i))
+            queue.executor.submit(int).result()
+        queue.shutdown()
+
+        self.assertEqual(None, queue.status(jobs[0]))
+        self.assertEqual(3, queue.status(jobs[3])["result"])
+
+@unittest.skipIf(Image is None, "requires PIL")
+class DerivativesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "page.jpg")
+        Image.new("RGB", (3000, 1500), (255, 255, 255)).save(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testDerivatives(self):
+        self.assertEqual(["progressive", "preview", "thumbnail"], make_derivatives(self.path, 1000, 160))
+
+        self.assertEqual((1000, 500), Image.open(derivative_path(self.path, "preview")).size)
+        self.assertEqual((160, 80), Image.open(derivative_path(self.path, "thumbnail")).size)
+
+        progressive = Image.open(derivative_path(self.path, "progressive"))
+        self.assertEqual((3000, 1500), progressive.size)
+        self.assertTrue(progressive.info.get("progressive"))
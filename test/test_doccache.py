@@ -0,0 +1,202 @@
+#!/usr/bin/python
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.doccache import DocumentCache
+
+class FakeDocument(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.contents = open(path).read()
+        self.writes = 0
+
+    def save(self):
+        fp = open(self.path, "w")
+        fp.write(self.contents)
+        fp.close()
+        self.writes += 1
+
+class DocumentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.loads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def loader(self, path):
+        self.loads.append(path)
+        return FakeDocument(path)
+
+    def make_file(self, name, contents):
+        path = os.path.join(self.dir, name)
+        fp = open(path, "w")
+        fp.write(contents)
+        fp.close()
+        return path
+
+    def testSharedDocument(self):
+        """ Repeated gets return the same parsed document """
+        cache = DocumentCache(self.loader, 1024)
+        path = self.make_file("a.mei", "<mei/>")
+        self.assertTrue(cache.get(path) is cache.get(path))
+        self.assertEqual(1, len(self.loads))
+
+    def testChangedOnDisk(self):
+        """ A file that changes size is parsed again """
+        cache = DocumentCache(self.loader, 1024)
+        path = self.make_file("a.mei", "<mei/>")
+        cache.get(path)
+        self.make_file("a.mei", "<mei></mei>")
+        cache.get(path)
+        self.assertEqual(2, len(self.loads))
+
+    def testUpdateAfterWrite(self):
+        """ Our own writes do not cause a reparse """
+        cache = DocumentCache(self.loader, 1024)
+        path = self.make_file("a.mei", "<mei/>")
+        cache.get(path)
+        self.make_file("a.mei", "<mei></mei>")
+        cache.update(path)
+        cache.get(path)
+        self.assertEqual(1, len(self.loads))
+        self.assertEqual(len("<mei></mei>"), cache.nbytes)
+
+    def testLRUEviction(self):
+        """ The least recently used document is evicted over budget """
+        cache = DocumentCache(self.loader, 20)
+        a = self.make_file("a.mei", "x" * 10)
+        b = self.make_file("b.mei", "x" * 10)
+        c = self.make_file("c.mei", "x" * 10)
+        cache.get(a)
+        cache.get(b)
+        cache.get(a)
+        cache.get(c)
+        self.assertEqual([a, c], list(cache.entries.keys()))
+        self.assertEqual(20, cache.nbytes)
+
+    def testDisabled(self):
+        """ A budget of 0 disables caching """
+        cache = DocumentCache(self.loader, 0)
+        path = self.make_file("a.mei", "<mei/>")
+        cache.get(path)
+        cache.get(path)
+        self.assertEqual(2, len(self.loads))
+        self.assertEqual(0, len(cache.entries))
+
+    def testInvalidate(self):
+        cache = DocumentCache(self.loader, 1024)
+        path = self.make_file("a.mei", "<mei/>")
+        cache.get(path)
+        cache.invalidate(path)
+        cache.get(path)
+        self.assertEqual(2, len(self.loads))
+
+    def testWriteThrough(self):
+        cache = DocumentCache(self.loader, 1024)
+        path = self.make_file("a.mei", "<mei/>")
+        doc = cache.get(path)
+        doc.contents = "<mei></mei>"
+        cache.commit(path, doc)
+        self.assertEqual(1, doc.writes)
+        self.assertEqual("<mei></mei>", open(path).read())
+
+    def testWriteBehindCoalesces(self):
+        """ Several commits are written out once """
+        cache = DocumentCache(self.loader, 1024, write_behind=True, quiet=0.05, max_delay=10)
+        path = self.make_file("a.mei", "<mei/>")
+        doc = cache.get(path)
+        doc.contents = "<mei></mei>"
+        cache.commit(path, doc)
+        cache.commit(path, doc)
+        cache.flush_due()
+        self.assertEqual(0, doc.writes)
+        # the cached document is used although the file on disk is stale
+        self.assertTrue(cache.get(path) is doc)
+        time.sleep(0.1)
+        cache.flush_due()
+        self.assertEqual(1, doc.writes)
+        self.assertEqual("<mei></mei>", open(path).read())
+        self.assertTrue(cache.get(path) is doc)
+
+    def testWriteBehindMaxDelay(self):
+        cache = DocumentCache(self.loader, 1024, write_behind=True, quiet=10, max_delay=0)
+        path = self.make_file("a.mei", "<mei/>")
+        doc = cache.get(path)
+        cache.commit(path, doc)
+        cache.flush_due()
+        self.assertEqual(1, doc.writes)
+
+    def testDurableCommit(self):
+        cache = DocumentCache(self.loader, 1024, write_behind=True)
+        path = self.make_file("a.mei", "<mei/>")
+        doc = cache.get(path)
+        cache.commit(path, doc)
+        cache.commit(path, doc, durable=True)
+        self.assertEqual(1, doc.writes)
+        cache.flush_all()
+        self.assertEqual(1, doc.writes)
+
+    def testDirtyNotEvicted(self):
+        cache = DocumentCache(self.loader, 10, write_behind=True)
+        a = self.make_file("a.mei", "x" * 10)
+        b = self.make_file("b.mei", "x" * 10)
+        doc = cache.get(a)
+        cache.commit(a, doc)
+        cache.get(b)
+        self.assertEqual([a], list(cache.entries.keys()))
+        cache.invalidate(a, discard_changes=False)
+        self.assertEqual([a], list(cache.entries.keys()))
+        cache.flush_all()
+        cache.invalidate(a, discard_changes=False)
+        self.assertEqual([], list(cache.entries.keys()))
+
+    def testReplace(self):
+        """ A replaced document stays dirty and is written out """
+        cache = DocumentCache(self.loader, 1024, write_behind=True)
+        path = self.make_file("a.mei", "<mei/>")
+        doc = cache.get(path)
+        cache.commit(path, doc)
+        rebuilt = FakeDocument(path)
+        rebuilt.contents = "<mei></mei>"
+        cache.replace(path, rebuilt)
+        self.assertTrue(cache.get(path) is rebuilt)
+        cache.flush_all()
+        self.assertEqual((0, 1), (doc.writes, rebuilt.writes))
+        self.assertEqual("<mei></mei>", open(path).read())
+
+    def testSavedAndCached(self):
+        """ Writes are timed, cached documents can be listed """
+        times = []
+        cache = DocumentCache(self.loader, 1024, saved=times.append)
+        path = self.make_file("a.mei", "<mei/>")
+        document = cache.get(path)
+        cache.commit(path, document)
+        self.assertEqual(1, len(times))
+        self.assertEqual([(path, 6, document)], cache.cached())
+
+    def testCachedPath(self):
+        """ A single document is only returned if cached and current """
+        cache = DocumentCache(self.loader, 1024, write_behind=True)
+        path = self.make_file("a.mei", "<mei/>")
+        self.assertEqual(None, cache.cached(path))
+        self.assertEqual([], self.loads)
+
+        document = cache.get(path)
+        self.assertTrue(cache.cached(path) is document)
+
+        cache.commit(path, document)
+        self.make_file("a.mei", "<mei></mei>")
+        self.assertTrue(cache.cached(path) is document)
+
+        cache.flush_all()
+        self.make_file("a.mei", "<mei></mei><!-- -->")
+        self.assertEqual(None, cache.cached(path))
+        self.assertEqual(1, len(self.loads))
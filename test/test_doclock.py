@@ -0,0 +1,53 @@
+#!/usr/bin/python
+import os
+import sys
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.doclock import DocumentLocks
+
+class DocumentLocksTest(AsyncTestCase):
+
+    @gen.coroutine
+    def edit(self, locks, path, name, order):
+        with (yield locks.acquire(path)):
+            order.append((name, "start"))
+            yield gen.moment
+            yield gen.moment
+            order.append((name, "end"))
+
+    @gen_test
+    def testSameDocumentInOrder(self):
+        """ Edits to one document run one at a time in arrival order """
+        locks = DocumentLocks()
+        order = []
+        yield [self.edit(locks, "a.mei", i, order) for i in range(3)]
+        self.assertEqual([(0, "start"), (0, "end"),
+                          (1, "start"), (1, "end"),
+                          (2, "start"), (2, "end")], order)
+        self.assertEqual(3, locks.stats()["max_depth"])
+        self.assertEqual({}, locks.locks)
+
+    @gen_test
+    def testDifferentDocumentsInterleave(self):
+        """ Edits to different documents do not wait for each other """
+        locks = DocumentLocks()
+        order = []
+        yield [self.edit(locks, "a.mei", "a", order), self.edit(locks, "b.mei", "b", order)]
+        self.assertEqual([("a", "start"), ("b", "start"), ("a", "end"), ("b", "end")], order)
+        self.assertEqual(1, locks.stats()["max_depth"])
+
+    @gen_test
+    def testDepth(self):
+        locks = DocumentLocks()
+        holder = yield locks.acquire("a.mei")
+        waiter = locks.acquire("a.mei")
+        self.assertEqual(2, locks.depth("a.mei"))
+        self.assertEqual(1, locks.stats()["queued"])
+        holder.__exit__(None, None, None)
+        holder = yield waiter
+        self.assertEqual(1, locks.depth("a.mei"))
+        holder.__exit__(None, None, None)
+        self.assertEqual(0, locks.depth("a.mei"))
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.fingerprint import DIST_DIRECTORY, Manifest, build, hashed_name, rewrite_css
+
+CSS = ".icon { background: url(\"../img/icons.png\"); }\n" * 20
+
+class FingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.write("js/neon.js", "var neon = 1;\n" * 50)
+        self.write("img/icons.png", "\x89PNG")
+        self.write("css/neon.css", CSS)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data):
+        path = os.path.join(self.dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fp = open(path, "wb")
+        fp.write(data)
+        fp.close()
+
+    def dist(self, path):
+        return os.path.join(self.dir, DIST_DIRECTORY, path)
+
+    def testHashedName(self):
+        self.assertEqual(hashed_name("js/a.js", "x"), hashed_name("js/a.js", "x"))
+        self.assertNotEqual(hashed_name("js/a.js", "x"), hashed_name("js/a.js", "y"))
+        self.assertTrue(hashed_name("js/a.min.js", "x").startswith("js/a.min."))
+        self.assertTrue(hashed_name("js/a.min.js", "x").endswith(".js"))
+
+    def testRewriteCss(self):
+        manifest = {"img/icons.png": "img/icons.0123.png"}
+        self.assertEqual("url('../img/icons.0123.png?#x')", rewrite_css("url('../img/icons.png?#x')", "css/a.css", manifest))
+        self.assertEqual("url(data:image/png;base64,AA)", rewrite_css("url(data:image/png;base64,AA)", "css/a.css", manifest))
+        self.assertEqual("url(other.png)", rewrite_css("url(other.png)", "css/a.css", manifest))
+
+    def testBuild(self):
+        manifest = build(self.dir)
+        self.assertEqual(["css/neon.css", "img/icons.png", "js/neon.js"], sorted(manifest))
+
+        js = self.dist(manifest["js/neon.js"])
+        self.assertEqual("var neon = 1;\n" * 50, open(js, "rb").read())
+        self.assertEqual("var neon = 1;\n" * 50, gzip.open(js + ".gz").read())
+
+        # images are not compressed, stylesheets refer to hashed images
+        self.assertFalse(os.path.exists(self.dist(manifest["img/icons.png"]) + ".gz"))
+        css = open(self.dist(manifest["css/neon.css"])).read()
+        self.assertTrue("../" + manifest["img/icons.png"] in css)
+
+        # the dist directory itself is not fingerprinted again
+        self.assertEqual(manifest, build(self.dir))
+
+    def testManifest(self):
+        manifest = Manifest(self.dir)
+        self.assertEqual(None, manifest.get("js/neon.js"))
+
+        build(self.dir)
+        hashed = manifest.get("js/neon.js")
+        self.assertTrue(hashed.startswith("js/neon."))
+
+        # a new build is picked up
+        time.sleep(0.01)
+        self.write("js/neon.js", "var neon = 2;")
+        build(self.dir)
+        self.assertNotEqual(hashed, manifest.get("js/neon.js"))
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.journal import Journal, journal_stamp
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "a.mei")
+        self.write(self.path, "<mei/>")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, contents):
+        fp = open(path, "w")
+        fp.write(contents)
+        fp.close()
+
+    def testAppendAndRead(self):
+        journal = Journal(self.path)
+        self.assertEqual([], journal.read())
+        journal.append([{"op": "delete_neume", "args": [["m-1"]]}])
+        journal.append([{"op": "delete_custos", "args": [["m-2"]]}])
+        self.assertEqual(2, journal.count)
+
+        entries = Journal(self.path).read()
+        self.assertEqual(["delete_neume", "delete_custos"], [e["op"] for e in entries])
+
+    def testStaleJournal(self):
+        """ A journal for an older snapshot is ignored and replaced """
+        journal = Journal(self.path)
+        journal.append([{"op": "delete_neume"}])
+        time.sleep(0.01)
+        self.write(self.path, "<mei></mei>")
+        self.assertEqual([], journal.read())
+        journal.append([{"op": "delete_custos"}])
+        self.assertEqual(["delete_custos"], [e["op"] for e in Journal(self.path).read()])
+
+    def testInterruptedAppend(self):
+        journal = Journal(self.path)
+        journal.append([{"op": "delete_neume"}])
+        fp = open(journal.path, "a")
+        fp.write('{"op": "dele')
+        fp.close()
+        self.assertEqual(["delete_neume"], [e["op"] for e in Journal(self.path).read()])
+
+    def testFull(self):
+        journal = Journal(self.path, max_ops=2)
+        journal.append([{"op": "delete_neume"}])
+        self.assertFalse(journal.full)
+        journal.append([{"op": "delete_neume"}])
+        self.assertTrue(journal.full)
+
+    def testReset(self):
+        journal = Journal(self.path)
+        journal.append([{"op": "delete_neume"}])
+        tmp = self.path + ".tmp"
+        self.write(tmp, "<mei>snapshot</mei>")
+        journal.reset(tmp)
+        self.assertEqual("<mei>snapshot</mei>", open(self.path).read())
+        self.assertFalse(os.path.exists(journal.path))
+        self.assertEqual(0, journal.count)
+
+    def testStamp(self):
+        before = journal_stamp(self.path)
+        Journal(self.path).append([{"op": "delete_neume"}])
+        self.assertNotEqual(before, journal_stamp(self.path))
+        self.assertEqual(before[:2], journal_stamp(self.path)[:2])
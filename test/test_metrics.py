@@ -0,0 +1,57 @@
+#!/usr/bin/python
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.metrics import Registry
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def lines(self):
+        return self.registry.render().splitlines()
+
+    def testCounter(self):
+        counter = self.registry.counter("requests_total", "Requests.", ("handler", "code"))
+        counter.inc(("FileHandler", "200"))
+        counter.inc(("FileHandler", "200"), 2)
+        counter.inc(("FileHandler", "404"))
+        self.assertEqual(["# HELP requests_total Requests.",
+                          "# TYPE requests_total counter",
+                          'requests_total{handler="FileHandler",code="200"} 3',
+                          'requests_total{handler="FileHandler",code="404"} 1'], self.lines())
+
+    def testHistogram(self):
+        histogram = self.registry.histogram("seconds", "Time.", ("operation",), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, ("neumify",))
+        self.assertEqual(["# HELP seconds Time.",
+                          "# TYPE seconds histogram",
+                          'seconds_bucket{operation="neumify",le="0.1"} 2',
+                          'seconds_bucket{operation="neumify",le="1.0"} 3',
+                          'seconds_bucket{operation="neumify",le="+Inf"} 4',
+                          'seconds_sum{operation="neumify"} 3.65',
+                          'seconds_count{operation="neumify"} 4'], self.lines())
+
+    def testTimer(self):
+        histogram = self.registry.histogram("seconds", "Time.")
+        with histogram.time():
+            pass
+        self.assertTrue("seconds_count 1" in self.lines())
+
+    def testCollectedGauge(self):
+        """ Collected gauges are read when rendered """
+        sizes = {"a.mei": 10}
+        self.registry.gauge("bytes", "Size.", ("document",),
+                            collect=lambda: [((path,), size) for path, size in sizes.items()])
+        self.assertTrue('bytes{document="a.mei"} 10' in self.lines())
+        sizes["a.mei"] = 20
+        self.assertTrue('bytes{document="a.mei"} 20' in self.lines())
+
+    def testEscaping(self):
+        gauge = self.registry.gauge("bytes", "Size.", ("document",))
+        gauge.set(1, ('say "hi"\\\n',))
+        self.assertEqual('bytes{document="say \\"hi\\"\\\\\\n"} 1', self.lines()[-1])
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+try:
+    import pymei
+except ImportError:
+    pymei = None
+
+if pymei is not None:
+    from neonsrv.journal import Journal
+    from neonsrv.modifymei import ModifyDocument
+
+DATA = os.path.join(os.path.dirname(__file__), "data", "allneumes.mei")
+
+BBOX = ("10", "20", "30", "40")
+
+@unittest.skipIf(pymei is None, "requires pymei")
+class ModifyDocumentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "allneumes.mei")
+        shutil.copy(DATA, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open(self, path=None, journal=False):
+        # debug checks the index against the tree after every operation
+        path = path or self.path
+        return ModifyDocument(path, journal=Journal(path) if journal else None, debug=True)
+
+    def layer(self, md, i):
+        return md.mei.getElementsByName("layer")[i]
+
+    def neume(self, md, i, n=1):
+        return self.layer(md, i).getChildrenByName("neume")[n]
+
+    def zones(self, md):
+        return len(md.mei.getElementsByName("zone"))
+
+    def staff_numbers(self, md):
+        return [s.getAttribute("n").getValue() for s in md.mei.getElementsByName("staff")]
+
+    def pitch_info(self, md, i):
+        info = []
+        for e in self.layer(md, i).getChildren():
+            if e.getName() == "neume":
+                info.append({"id": e.getId(), "noteInfo": [{"pname": "a", "oct": "3"} for n in e.getDescendantsByName("note")]})
+            elif e.getName() == "custos":
+                info.append({"id": e.getId(), "noteInfo": {"pname": "a", "oct": "3"}})
+        return info
+
+    def testNeumeOperations(self):
+        md = self.open()
+        zones = self.zones(md)
+
+        punctum = md.apply("insert_punctum", self.neume(md, 0).getId(), "g", "3", None, *BBOX)["id"]
+        other = md.apply("insert_punctum", None, "a", "3", "aug", *BBOX)["id"]
+        self.assertEqual(zones + 2, self.zones(md))
+        self.assertEqual(md.get_element(md.get_element(punctum).getAttribute("facs").getValue()),
+                         md.get_zone(md.get_element(punctum)))
+
+        md.apply("move_neume", punctum, self.neume(md, 1).getId(), [{"pname": "c", "oct": "4"}], *BBOX)
+        md.apply("update_neume_head_shape", punctum, "quilisma", *BBOX)
+        md.apply("add_dot", punctum, "aug", *BBOX)
+        md.apply("delete_dot", punctum, *BBOX)
+
+        second = md.apply("insert_punctum", self.neume(md, 1).getId(), "b", "3", None, *BBOX)["id"]
+        neume = md.apply("neumify", [punctum, second], "pes", None, ["punctum", "punctum"], *BBOX)["id"]
+        self.assertEqual(None, md.get_element(punctum))
+        nids = md.apply("ungroup", [neume], [[dict(zip(("ulx", "uly", "lrx", "lry"), BBOX))] * 2])["nids"]
+        self.assertEqual(2, len(nids[0]))
+
+        md.apply("delete_neume", nids[0] + [other])
+        self.assertEqual(zones, self.zones(md))
+
+    def testDivisions(self):
+        md = self.open()
+        staves = len(md.mei.getElementsByName("staff"))
+
+        minor = md.apply("insert_division", self.neume(md, 2).getId(), "minor", *BBOX)["id"]
+        md.apply("move_division", minor, self.neume(md, 3).getId(), *BBOX)
+        md.apply("delete_division", [minor])
+
+        final = md.apply("insert_division", self.neume(md, 2, 2).getId(), "final", *BBOX)["id"]
+        self.assertEqual(staves + 1, len(md.mei.getElementsByName("staff")))
+        self.assertEqual(staves + 1, len(md.mei.getElementsByName("staffDef")))
+
+        md.apply("move_division", final, self.neume(md, 5).getId(), *BBOX)
+        self.assertEqual(staves + 1, len(md.mei.getElementsByName("staff")))
+
+        # staff numbers are derived when the document is written
+        md.write_doc()
+        self.assertEqual([str(n + 1) for n in range(staves + 1)], self.staff_numbers(md))
+
+        md.apply("delete_division", [final])
+        self.assertEqual(staves, len(md.mei.getElementsByName("staff")))
+        md.write_doc()
+        self.assertEqual([str(n + 1) for n in range(staves)], self.staff_numbers(self.open()))
+
+    def testStavesOutsideSections(self):
+        """ Staves may be placed in other elements than sections """
+        path = os.path.join(self.dir, "ending.mei")
+        fp = open(path, "w")
+        fp.write(open(DATA).read().replace("<section ", "<ending ").replace("</section>", "</ending>"))
+        fp.close()
+
+        md = self.open(path)
+        final = md.apply("insert_division", self.neume(md, 2, 2).getId(), "final", *BBOX)["id"]
+        md.apply("move_division", final, self.neume(md, 5).getId(), *BBOX)
+        md.apply("delete_division", [final])
+        md.apply("insert_punctum", None, "g", "3", None, *BBOX)
+        md.write_doc()
+
+    def testClefsAndCustos(self):
+        md = self.open()
+        clef = md.apply("insert_clef", "3", "f", self.pitch_info(md, 1), self.neume(md, 1).getId(), *BBOX)["id"]
+        md.apply("move_clef", clef, "2", self.pitch_info(md, 1), *BBOX)
+        md.apply("update_clef_shape", clef, "c", self.pitch_info(md, 1), *BBOX)
+        md.apply("delete_clef", [{"id": clef, "pitchInfo": self.pitch_info(md, 1)}])
+
+        custos = md.apply("insert_custos", "a", "3", self.neume(md, 1).getId(), *BBOX)["id"]
+        md.apply("move_custos", custos, "b", "3", *BBOX)
+        md.apply("delete_custos", [custos])
+
+    def testSystems(self):
+        md = self.open()
+        page = md.mei.getElementsByName("page")[0].getId()
+        sb = md.mei.getElementsByName("sb")[1].getId()
+
+        system = md.apply("insert_system", page, *BBOX)["id"]
+        new_sb = md.apply("insert_system_break", system, 2, sb)["id"]
+        md.apply("modify_system_break", new_sb, "3")
+        md.apply("update_system_zone", system, *BBOX)
+        md.apply("delete_system_break", [new_sb])
+        md.apply("delete_system", [system])
+
+    def testDelta(self):
+        md = self.open()
+        since = md.version
+        neume = self.neume(md, 0).getId()
+        punctum = md.apply("insert_punctum", self.neume(md, 1).getId(), "g", "3", None, *BBOX)["id"]
+        md.apply("delete_neume", [neume])
+
+        delta = md.delta(since)
+        self.assertEqual(since + 2, md.version)
+        self.assertTrue(punctum in [e["id"] for e in delta["added"]])
+        self.assertTrue(neume in delta["removed"])
+        self.assertEqual(None, md.delta(since - 1))
+
+    def testJournalReplay(self):
+        """ Replayed elements keep their ids, zones and references """
+        md = self.open(journal=True)
+        neume = self.neume(md, 0).getId()
+        sb = md.mei.getElementsByName("sb")[2].getId()
+        page = md.mei.getElementsByName("page")[0].getId()
+
+        punctum = md.apply("insert_punctum", neume, "g", "3", None, *BBOX)["id"]
+        system = md.apply("insert_system", page, *BBOX)["id"]
+        new_sb = md.apply("insert_system_break", system, 3, sb)["id"]
+        md.save()
+        zones = self.zones(md)
+
+        replayed = self.open(journal=True)
+        self.assertEqual([], replayed.check_index())
+        self.assertEqual(zones, self.zones(replayed))
+        self.assertEqual(system, replayed.get_element(new_sb).getAttribute("systemref").getValue())
+
+        # the zone of the replayed punctum is updated, not added again
+        replayed.apply("move_neume", punctum, neume, None, "50", "60", "70", "80")
+        replayed.apply("update_system_zone", system, *BBOX)
+        self.assertEqual(zones, self.zones(replayed))
+        self.assertEqual("50", replayed.get_zone(replayed.get_element(punctum)).getAttribute("ulx").getValue())
+
+        replayed.apply("delete_neume", [punctum])
+        self.assertEqual(zones - 1, self.zones(replayed))
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.profiling import Profiler
+
+def work(n):
+    return sum(square(i) for i in range(n))
+
+def square(i):
+    return i * i
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testWants(self):
+        profiler = Profiler(self.dir, routes=[r"/neumify$"], files=["squarenote/page1*.mei"])
+        self.assertTrue(profiler.wants("/edit/squarenote/a.mei/neumify", "squarenote/a.mei"))
+        self.assertTrue(profiler.wants("/edit/squarenote/page12.mei/ungroup", "squarenote/page12.mei"))
+        self.assertFalse(profiler.wants("/edit/squarenote/a.mei/ungroup", "squarenote/a.mei"))
+
+        self.assertTrue(Profiler(self.dir, rate=1.0).wants("/edit/a.mei/ungroup", "a.mei"))
+        self.assertFalse(Profiler(None, rate=1.0).wants("/edit/a.mei/ungroup", "a.mei"))
+
+    def testPstats(self):
+        profiler = Profiler(self.dir)
+        with profiler.profile("NeumifyNeumeHandler-squarenote/a.mei"):
+            work(100)
+
+        profiles = profiler.recent()
+        self.assertEqual(1, len(profiles))
+        self.assertTrue(profiles[0]["name"].endswith("-NeumifyNeumeHandler-squarenote_a.mei.prof"))
+
+        stats = pstats.Stats(os.path.join(self.dir, profiles[0]["name"]))
+        self.assertTrue("square" in [name for filename, line, name in stats.stats])
+
+    def testCollapsed(self):
+        profiler = Profiler(self.dir, format="collapsed")
+        with profiler.profile("a"):
+            work(100)
+
+        lines = open(os.path.join(self.dir, profiler.recent()[0]["name"])).read().splitlines()
+        stacks = [line.rsplit(" ", 1)[0].split(";") for line in lines]
+        self.assertTrue(any(stack[0].startswith("work ") and stack[-1].startswith("square ") for stack in stacks))
+
+    def testNotProfiled(self):
+        profiler = Profiler(self.dir)
+        with profiler.profile(None):
+            work(10)
+        self.assertEqual([], profiler.recent())
+
+    def testKeep(self):
+        profiler = Profiler(self.dir, keep=2)
+        for i in range(4):
+            with profiler.profile("p%d" % i):
+                work(10)
+        self.assertEqual(2, len(profiler.recent()))
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+import os
+import sys
+import unittest
+
+import tornado.httpserver
+import tornado.web
+import tornado.websocket
+from tornado.testing import AsyncHTTPTestCase, bind_unused_port, gen_test
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.routing import AffinityApplication, HashRing, document_key
+
+class HashRingTest(unittest.TestCase):
+
+    def testSpread(self):
+        ring = HashRing(range(4))
+        counts = [0] * 4
+        for i in range(4000):
+            counts[ring.node("squarenote/page%d.mei" % i)] += 1
+        self.assertTrue(min(counts) > 500, counts)
+
+    def testConsistent(self):
+        """ Adding a node only moves keys to the new node """
+        before = HashRing(range(4))
+        after = HashRing(range(5))
+        for i in range(1000):
+            key = "squarenote/page%d.mei" % i
+            self.assertTrue(after.node(key) in (before.node(key), 4))
+
+    def testEmpty(self):
+        self.assertEqual(None, HashRing([]).node("page.mei"))
+
+class DocumentKeyTest(unittest.TestCase):
+
+    def testKeys(self):
+        self.assertEqual("squarenote/a b.mei", document_key("/edit/squarenote/a%20b.mei/insert/neume"))
+        self.assertEqual("squarenote/a.mei", document_key("/edit/squarenote/a.mei/batch"))
+        self.assertEqual("squarenote/a.mei", document_key("/neon/file/squarenote/a.mei", "/neon"))
+        self.assertEqual("squarenote/a.mei", document_key("/delta/squarenote/a.mei"))
+        self.assertEqual("squarenote/a", document_key("/tiles/squarenote/a_files/9/0_0.jpg"))
+        self.assertEqual(None, document_key("/file/squarenote/a.jpg"))
+        self.assertEqual(None, document_key("/catalog/squarenote"))
+
+class WorkerHandler(tornado.web.RequestHandler):
+
+    def get(self, *args):
+        self.set_header("X-Worker", str(self.application.worker))
+        self.write("%d %s" % (self.application.worker, self.request.uri))
+
+    def post(self, *args):
+        self.write("%d %s" % (self.application.worker, self.request.body))
+
+class WorkerSocketHandler(tornado.websocket.WebSocketHandler):
+
+    def on_message(self, message):
+        self.write_message("%d %s" % (self.application.worker, message))
+
+class AffinityTest(AsyncHTTPTestCase):
+
+    def setUp(self):
+        # a second process, listening on a port of its own
+        sock, port = bind_unused_port()
+        self.ports = [None, port]
+        super(AffinityTest, self).setUp()
+        self.ports[0] = self.get_http_port()
+
+        self.other = tornado.httpserver.HTTPServer(self.make_app(1, trusted=True))
+        self.other.add_sockets([sock])
+
+    def tearDown(self):
+        self.other.stop()
+        super(AffinityTest, self).tearDown()
+
+    def make_app(self, worker, trusted=False):
+        return AffinityApplication([(r"/edit/(.*?)/socket", WorkerSocketHandler),
+                                    (r"/(.*)", WorkerHandler)], worker, self.ports, trusted=trusted)
+
+    def get_app(self):
+        return self.make_app(0)
+
+    def document(self, owner):
+        ring = HashRing(range(2))
+        for i in range(100):
+            if ring.node("squarenote/%d.mei" % i) == owner:
+                return "squarenote/%d.mei" % i
+
+    def testOwned(self):
+        response = self.fetch("/file/" + self.document(0))
+        self.assertEqual("0", response.headers["X-Worker"])
+
+    def testForwarded(self):
+        path = "/edit/%s/insert/neume?x=1" % self.document(1)
+        response = self.fetch(path)
+        self.assertEqual("1", response.headers["X-Worker"])
+        self.assertEqual("1 " + path, response.body)
+
+        response = self.fetch("/edit/%s/batch" % self.document(1), method="POST", body="data=[]")
+        self.assertEqual("1 data=[]", response.body)
+
+    def testForwardedByClient(self):
+        """ Clients of the public port cannot bypass the owner """
+        response = self.fetch("/file/" + self.document(1), headers={"X-Neon-Forwarded": "1"})
+        self.assertEqual("1", response.headers["X-Worker"])
+
+    def testOtherRequests(self):
+        self.assertEqual("0", self.fetch("/catalog/squarenote").headers["X-Worker"])
+
+    @gen_test
+    def testSocket(self):
+        url = "ws://127.0.0.1:%d/edit/%s/socket" % (self.get_http_port(), self.document(1))
+        socket = yield tornado.websocket.websocket_connect(url)
+        socket.write_message("hello")
+        self.assertEqual("1 hello", (yield socket.read_message()))
+        socket.close()
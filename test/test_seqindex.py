@@ -0,0 +1,45 @@
+#!/usr/bin/python
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.seqindex import SequenceIndex
+
+class SequenceIndexTest(unittest.TestCase):
+
+    def testPositions(self):
+        seq = SequenceIndex(["a", "b", "c"])
+        self.assertEqual(1, seq.position("b"))
+        self.assertEqual("c", seq.following("b"))
+        self.assertEqual(None, seq.following("c"))
+        self.assertEqual(["b", "c"], seq.after("a"))
+        self.assertEqual("c", seq.last())
+
+    def testInsertAndRemove(self):
+        seq = SequenceIndex(["a", "c"])
+        seq.insert_before("c", "b")
+        seq.insert_before("a", "start")
+        seq.append("d")
+        self.assertEqual(["start", "a", "b", "c", "d"], seq.ids)
+        self.assertEqual(2, seq.position("b"))
+        seq.remove("a")
+        self.assertEqual(1, seq.position("b"))
+        self.assertFalse("a" in seq)
+        self.assertEqual(4, len(seq))
+
+    def testRespacing(self):
+        """ Keys are spread out again when inserting repeatedly at one spot """
+        seq = SequenceIndex(["a", "z"])
+        for i in range(40):
+            seq.insert_before("z", i)
+        self.assertEqual(["a"] + list(range(40)) + ["z"], seq.ids)
+        for i, id in enumerate(seq.ids):
+            self.assertEqual(i, seq.position(id))
+        self.assertEqual(sorted(seq.keys), seq.keys)
+
+    def testEmpty(self):
+        seq = SequenceIndex()
+        self.assertEqual(None, seq.last())
+        seq.append("a")
+        self.assertEqual(0, seq.position("a"))
@@ -0,0 +1,52 @@
+#!/usr/bin/python
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.storage import compress_file, is_compressed, read_file, write_file
+
+MEI = "<mei>" + "<neume name=\"punctum\"/>" * 100 + "</mei>"
+
+class StorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "page.mei")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testPlain(self):
+        write_file(self.path, MEI)
+        self.assertFalse(is_compressed(self.path))
+        self.assertEqual(MEI, open(self.path).read())
+        self.assertEqual(MEI, read_file(self.path))
+
+    def testCompressed(self):
+        write_file(self.path, MEI, compress=True)
+        self.assertTrue(is_compressed(self.path))
+        self.assertTrue(os.path.getsize(self.path) < len(MEI))
+        self.assertEqual(MEI, gzip.open(self.path).read())
+        self.assertEqual(MEI, read_file(self.path))
+
+    def testCompressFile(self):
+        write_file(self.path, MEI)
+        compress_file(self.path)
+        compressed = open(self.path, "rb").read()
+        self.assertEqual(MEI, read_file(self.path))
+
+        # compressing again leaves the file alone
+        compress_file(self.path)
+        self.assertEqual(compressed, open(self.path, "rb").read())
+
+    def testDeterministic(self):
+        """ Equal documents compress to equal files """
+        write_file(self.path, MEI, compress=True)
+        other = os.path.join(self.dir, "other.mei")
+        write_file(other, MEI)
+        compress_file(other)
+        self.assertEqual(open(self.path, "rb").read(), open(other, "rb").read())
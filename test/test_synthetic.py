@@ -0,0 +1,40 @@
+#!/usr/bin/python
+import os
+import sys
+import unittest
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bench.synthetic import MEI_NS, XML_ID, generate
+
+class SyntheticTest(unittest.TestCase):
+
+    def elements(self, root, name):
+        return root.findall(".//{%s}%s" % (MEI_NS, name))
+
+    def testSize(self):
+        root = ET.fromstring(generate(systems=3, neumes=10, notes=2, extra_zones=5))
+        self.assertEqual(3, len(self.elements(root, "staff")))
+        self.assertEqual(3, len(self.elements(root, "staffDef")))
+        self.assertEqual(3, len(self.elements(root, "system")))
+        self.assertEqual(30, len(self.elements(root, "neume")))
+        self.assertEqual(60, len(self.elements(root, "note")))
+        self.assertEqual(3, len(self.elements(root, "division")))
+        self.assertEqual(3, len(self.elements(root, "custos")))
+
+        # systems, clefs, neumes, divisions, custodes and the extra zones
+        self.assertEqual(3 + 3 + 30 + 3 + 3 + 5, len(self.elements(root, "zone")))
+
+    def testReferences(self):
+        """ Every facs and systemref refers to an element """
+        root = ET.fromstring(generate(systems=2, neumes=9))
+        ids = set(e.get(XML_ID) for e in root.iter())
+        self.assertEqual(len(list(root.iter())), len(ids))
+        for e in root.iter():
+            for attr in ("facs", "systemref", "pageref"):
+                if e.get(attr) is not None:
+                    self.assertTrue(e.get(attr) in ids)
+
+    def testRepeatable(self):
+        self.assertEqual(generate(systems=2, seed=1), generate(systems=2, seed=1))
+        self.assertNotEqual(generate(systems=2, seed=1), generate(systems=2, seed=2))
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.tiles import Image, TilePyramid, find_image, level_count, level_size, tile_box, tile_grid
+
+class GeometryTest(unittest.TestCase):
+
+    def testLevels(self):
+        self.assertEqual(1, level_count(1, 1))
+        self.assertEqual(11, level_count(1000, 700))
+        self.assertEqual(11, level_count(1024, 700))
+        self.assertEqual(30, level_count(2 ** 29, 1))
+        self.assertEqual((1000, 700), level_size(1000, 700, 10))
+        self.assertEqual((500, 350), level_size(1000, 700, 9))
+        self.assertEqual((125, 88), level_size(1000, 700, 7))
+        self.assertEqual((1, 1), level_size(1000, 700, 0))
+
+    def testTiles(self):
+        self.assertEqual((4, 3), tile_grid((1000, 700), 256))
+        self.assertEqual((0, 0, 257, 257), tile_box((1000, 700), 0, 0, 256, 1))
+        self.assertEqual((255, 511, 513, 700), tile_box((1000, 700), 1, 2, 256, 1))
+        self.assertEqual((767, 0, 1000, 257), tile_box((1000, 700), 3, 0, 256, 1))
+
+class FindImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "squarenote"))
+        open(os.path.join(self.dir, "squarenote", "page.png"), "w").close()
+        open(os.path.join(self.dir, "outside.png"), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testFind(self):
+        self.assertEqual(os.path.join(self.dir, "squarenote", "page.png"), find_image(self.dir, "squarenote/page"))
+        self.assertEqual(None, find_image(self.dir, "squarenote/other"))
+
+    def testOutsideRoot(self):
+        """ Names may not escape the root directory """
+        self.assertEqual(None, find_image(os.path.join(self.dir, "squarenote"), "../outside"))
+
+@unittest.skipIf(Image is None, "requires PIL")
+class TilePyramidTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "page.jpg")
+        Image.new("RGB", (600, 300), (255, 0, 0)).save(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testCutLevel(self):
+        pyramid = TilePyramid(self.path)
+        self.assertFalse(pyramid.has_level(10))
+        pyramid.cut_level(10)
+        self.assertEqual(["0_0.jpg", "0_1.jpg", "1_0.jpg", "1_1.jpg", "2_0.jpg", "2_1.jpg"],
+                         sorted(os.listdir(pyramid.level_path(10))))
+        self.assertEqual((89, 45), Image.open(pyramid.tile_path(10, 2, 1)).size)
+
+        # only the requested level is cut
+        self.assertFalse(pyramid.has_level(9))
+        self.assertRaises(ValueError, pyramid.cut_level, 11)
+
+    def testDescriptor(self):
+        dzi = TilePyramid(self.path, tile_size=512).dzi()
+        self.assertTrue('TileSize="512"' in dzi)
+        self.assertTrue('<Size Width="600" Height="300"/>' in dzi)
+
+    def testStaleTiles(self):
+        """ Tiles are thrown away when the image is replaced """
+        pyramid = TilePyramid(self.path)
+        pyramid.cut_level(0)
+
+        time.sleep(0.01)
+        Image.new("RGB", (300, 600), (0, 0, 255)).save(self.path)
+        self.assertEqual(300, pyramid.info()["width"])
+        self.assertFalse(pyramid.has_level(0))
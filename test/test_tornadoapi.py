@@ -0,0 +1,86 @@
+#!/usr/bin/python
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+try:
+    import pymei
+except ImportError:
+    pymei = None
+
+if pymei is not None:
+    try:
+        import conf
+    except ImportError:
+        conf = imp.load_source("conf", os.path.join(ROOT, "conf.py.dist"))
+    from neonsrv import tornadoapi
+    from neonsrv.doccache import DocumentCache
+    from neonsrv.journal import Journal
+    from neonsrv.modifymei import ModifyDocument
+
+DATA = os.path.join(os.path.dirname(__file__), "data", "allneumes.mei")
+
+@unittest.skipIf(pymei is None, "requires pymei")
+class ApplyOperationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "allneumes.mei")
+        shutil.copy(DATA, self.path)
+
+        self.journal = conf.JOURNAL
+        self.documents = tornadoapi.documents
+        tornadoapi.documents = DocumentCache(tornadoapi.load_document, 1024 * 1024 * 1024,
+                                             write_behind=True, quiet=60, max_delay=60)
+
+    def tearDown(self):
+        conf.JOURNAL = self.journal
+        tornadoapi.documents = self.documents
+        shutil.rmtree(self.dir)
+
+    def failBatch(self):
+        '''
+        Commit one edit without writing it, then fail on the second
+        operation of a batch. Returns the ids of the neume deleted by
+        the committed edit and of the one the failed batch deleted.
+        '''
+
+        documents = tornadoapi.documents
+        first, second = [n.getId() for n in documents.get(self.path).mei.getElementsByName("neume")[:2]]
+
+        tornadoapi.apply_operations(self.path, [("delete_neume", ([first],), {})])
+        self.assertRaises(Exception, tornadoapi.apply_operations, self.path,
+                          [("delete_neume", ([second],), {}), ("delete_neume", (["m-missing"],), {})])
+
+        md = documents.get(self.path)
+        self.assertEqual(None, md.get_element(first))
+        self.assertNotEqual(None, md.get_element(second))
+        self.assertEqual([], md.check_index())
+        self.assertEqual(1, documents.stats()["dirty"])
+
+        documents.flush_all()
+        return first, second
+
+    def testFailedBatchInDirtyDocument(self):
+        """ A failed batch is undone, earlier unsaved edits are kept """
+        conf.JOURNAL = False
+        first, second = self.failBatch()
+
+        md = ModifyDocument(self.path)
+        self.assertEqual(None, md.get_element(first))
+        self.assertNotEqual(None, md.get_element(second))
+
+    def testFailedBatchInDirtyJournal(self):
+        conf.JOURNAL = True
+        first, second = self.failBatch()
+
+        md = ModifyDocument(self.path, journal=Journal(self.path))
+        self.assertEqual(None, md.get_element(first))
+        self.assertNotEqual(None, md.get_element(second))
+        self.assertEqual(1, md.journal.count)
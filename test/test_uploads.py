@@ -0,0 +1,104 @@
+#!/usr/bin/python
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.uploads import MultipartSpooler, link_or_copy, place
+
+BODY = ("preamble\r\n"
+        "--XyZ\r\n"
+        "Content-Disposition: form-data; name=\"mei\"; filename=\"C:\\scans\\page.mei\"\r\n"
+        "Content-Type: application/xml\r\n"
+        "\r\n"
+        "<mei>\r\n--Xy</mei>\r\n"
+        "--XyZ\r\n"
+        "Content-Disposition: form-data; name=\"mei_img\"; filename=\"\"\r\n"
+        "\r\n"
+        "\r\n"
+        "--XyZ\r\n"
+        "Content-Disposition: form-data; name=\"document_type\"\r\n"
+        "\r\n"
+        "squarenote\r\n"
+        "--XyZ--\r\n")
+
+class MultipartSpoolerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def parse(self, chunk_size):
+        spooler = MultipartSpooler("XyZ", self.dir)
+        for i in range(0, len(BODY), chunk_size):
+            spooler.feed(BODY[i:i + chunk_size])
+        spooler.finish()
+        return spooler
+
+    def testParse(self):
+        """ The result does not depend on how the body is split up """
+        for chunk_size in (1, 7, 64, len(BODY)):
+            spooler = self.parse(chunk_size)
+            self.assertEqual({"mei_img": [""], "document_type": ["squarenote"]}, spooler.fields)
+
+            f = spooler.files["mei"][0]
+            self.assertEqual("page.mei", f.filename)
+            self.assertEqual("application/xml", f.content_type)
+            self.assertEqual("<mei>\r\n--Xy</mei>", open(f.path).read())
+            self.assertEqual(f.size, os.path.getsize(f.path))
+
+            spooler.cleanup()
+            self.assertFalse(os.path.exists(f.path))
+
+    def testIncomplete(self):
+        spooler = MultipartSpooler("XyZ", self.dir)
+        spooler.feed(BODY[:-10])
+        self.assertRaises(ValueError, spooler.finish)
+        spooler.cleanup()
+        self.assertEqual([], os.listdir(self.dir))
+
+    def testFieldTooLarge(self):
+        """ Plain fields are kept in memory and must be small """
+        spooler = MultipartSpooler("XyZ", self.dir, max_field_size=4)
+        self.assertRaises(ValueError, spooler.feed, BODY)
+
+class PlaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir, "src")
+        fp = open(self.src, "w")
+        fp.write("mei")
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testPlace(self):
+        dst = os.path.join(self.dir, "dst")
+        place(self.src, dst)
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual("mei", open(dst).read())
+
+    def testPlaceExisting(self):
+        """ An existing file is never replaced """
+        dst = os.path.join(self.dir, "dst")
+        open(dst, "w").close()
+        try:
+            place(self.src, dst)
+            self.fail()
+        except OSError, e:
+            self.assertEqual(errno.EEXIST, e.errno)
+        self.assertEqual("", open(dst).read())
+
+    def testLinkOrCopy(self):
+        dst = os.path.join(self.dir, "dst")
+        open(dst, "w").close()
+        link_or_copy(self.src, dst)
+        self.assertEqual("mei", open(dst).read())
+        self.assertEqual("mei", open(self.src).read())
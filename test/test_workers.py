@@ -0,0 +1,61 @@
+#!/usr/bin/python
+import os
+import sys
+import time
+
+from tornado.testing import AsyncTestCase, gen_test
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from neonsrv.workers import EditExecutor
+
+def slow_add(a, b, delay=0.05):
+    time.sleep(delay)
+    return a + b
+
+def fail():
+    raise ValueError("boom")
+
+class EditExecutorTest(AsyncTestCase):
+
+    @gen_test
+    def testRunInThread(self):
+        executor = EditExecutor("thread", 1)
+        results = yield [executor.run(slow_add, 1, 2), executor.run(slow_add, 3, 4, delay=0.01)]
+        self.assertEqual([3, 7], results)
+
+        stats = executor.stats()
+        self.assertEqual(2, stats["completed"])
+        self.assertEqual(0, stats["pending"])
+        # the second job waited for the first one in the queue
+        self.assertTrue(stats["max_queued_time"] >= 0.04)
+        self.assertTrue(stats["max_run_time"] >= 0.04)
+        executor.shutdown()
+
+    @gen_test
+    def testFailure(self):
+        executor = EditExecutor("thread", 1)
+        try:
+            yield executor.run(fail)
+            self.fail("expected ValueError")
+        except ValueError:
+            pass
+        self.assertEqual(1, executor.stats()["failed"])
+        self.assertEqual(0, executor.stats()["pending"])
+        executor.shutdown()
+
+    @gen_test
+    def testRunInProcess(self):
+        executor = EditExecutor("process", 1)
+        result = yield executor.run(slow_add, 1, 2, delay=0)
+        self.assertEqual(3, result)
+        executor.shutdown()
+
+    @gen_test
+    def testSameProcessForKey(self):
+        executor = EditExecutor("process", 3)
+        pids = yield [executor.run_for("a.mei", os.getpid) for i in range(6)]
+        self.assertEqual(1, len(set(pids)))
+        executor.shutdown()
+
+    def testUnknownKind(self):
+        self.assertRaises(ValueError, EditExecutor, "fiber", 1)